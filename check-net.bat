@@ -0,0 +1,42 @@
+@echo off
+
+:: Проверка записи исполняемых файлов (compiler\pe.py): каждый пример test\*.txt собирается в exe,
+:: дизассемблируется bin\ildasm, и листинг методов сравнивается с текстом --msil-only той же программы
+
+setlocal
+
+set RUNTIME_MSIL=%~dp0.\runtime-net\runtime.msil
+
+set PYTHON=python.exe
+
+if exist "%~dp0.\bin\_props.bat" call "%~dp0.\bin\_props.bat"
+if exist "%~dp0.\_props.bat" call "%~dp0.\_props.bat"
+
+
+set OUT=%TEMP%\check-net-%RANDOM%
+mkdir "%OUT%"
+
+set FAILED=0
+for %%F in ("%~dp0.\test\*.txt") do call :check "%%~fF" "%%~nF"
+rmdir /s /q "%OUT%"
+exit /b %FAILED%
+
+:check
+:: среда выполнения - модуль в каталоге программы, ildasm показывает только код программы
+"%PYTHON%" "%~dp0main.py" --msil-only --runtime "%RUNTIME_MSIL%" --runtime-dir "%OUT%" "%~1" > "%OUT%\%~2.msil"
+if errorlevel 1 goto failed
+"%PYTHON%" "%~dp0main.py" --exe "%OUT%\%~2.exe" --runtime "%RUNTIME_MSIL%" --runtime-dir "%OUT%" "%~1"
+if errorlevel 1 goto failed
+call "%~dp0.\bin\ildasm" /utf8 /out:"%OUT%\%~2.il" "%OUT%\%~2.exe"
+"%PYTHON%" "%~dp0compiler\pe.py" "%OUT%\%~2.msil" > "%OUT%\%~2.msil.lst"
+"%PYTHON%" "%~dp0compiler\pe.py" "%OUT%\%~2.il" > "%OUT%\%~2.il.lst"
+if errorlevel 1 goto failed
+fc "%OUT%\%~2.msil.lst" "%OUT%\%~2.il.lst"
+if errorlevel 1 goto failed
+echo %~2: ok
+goto :eof
+
+:failed
+echo %~2: failed
+set FAILED=1
+goto :eof
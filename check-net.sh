@@ -0,0 +1,36 @@
+#!/bin/bash
+
+# Проверка записи исполняемых файлов (compiler/pe.py): каждый пример test/*.txt собирается в exe,
+# дизассемблируется bin/ildasm, и листинг методов сравнивается с текстом --msil-only той же программы
+
+CD=$(dirname "$(readlink -f "$0")")  # "
+
+RUNTIME_MSIL="$CD/runtime-net/runtime.msil"
+
+PYTHON=python
+
+[[ -e "$CD/bin/_props.sh" ]] && . "$CD/bin/_props.sh"
+[[ -e "$CD/_props.sh" ]] && . "$CD/_props.sh"
+
+
+OUT=$(mktemp -d)
+trap 'rm -rf "$OUT"' EXIT
+
+FAILED=0
+for FILENAME in "$CD"/test/*.txt; do
+  NAME=$(basename "${FILENAME%.*}")
+  # среда выполнения - модуль в каталоге программы, ildasm показывает только код программы
+  "$PYTHON" "$CD/main.py" --msil-only --runtime "$RUNTIME_MSIL" --runtime-dir "$OUT" \
+    "$FILENAME" >"$OUT/$NAME.msil" || { echo "$NAME: compile error"; FAILED=1; continue; }
+  "$PYTHON" "$CD/main.py" --exe "$OUT/$NAME.exe" --runtime "$RUNTIME_MSIL" --runtime-dir "$OUT" \
+    "$FILENAME" || { echo "$NAME: compile error"; FAILED=1; continue; }
+  "$CD/bin/ildasm" /utf8 /out:"$OUT/$NAME.il" "$OUT/$NAME.exe"
+  "$PYTHON" "$CD/compiler/pe.py" "$OUT/$NAME.msil" >"$OUT/$NAME.msil.lst"
+  "$PYTHON" "$CD/compiler/pe.py" "$OUT/$NAME.il" >"$OUT/$NAME.il.lst" || { echo "$NAME: ildasm error"; FAILED=1; continue; }
+  if diff -u --label "$NAME.msil" --label "$NAME.exe" "$OUT/$NAME.msil.lst" "$OUT/$NAME.il.lst"; then
+    echo "$NAME: ok"
+  else
+    FAILED=1
+  fi
+done
+exit $FAILED
@@ -23,15 +23,15 @@ if not exist "%~1" (
 )
 
 
-del /f /q "%~dpn1.jbc" "%~dpn1.class" "%~dpn1.jar" >NUL 2>&1
-call "%~dp0.\bin\python" -Xutf8 "%~dp0\main.py" --jbc-only "%~dpnx1" >"%~dpn1.jbc"
-set STATUS=%ERRORLEVEL%
-if not "%STATUS%"=="0" (
-  del /f /q "%~dpn1.jbc"
-  exit %STATUS%
-)
-for /f "tokens=3" %%V in ('type "%~dpn1.jbc" ^| findstr /b "public class"') do set CLASS_NAME=%%V
-move "%~dpn1.jbc" "%~dp1.\%CLASS_NAME%.jbc" >NUL 2>&1
-call "%~dp0.\bin\proguard" "%~dp1.\%CLASS_NAME%.jbc" "%~dp1.\%CLASS_NAME%.class"
-call "%~dp0.\bin\jar" --create --file "%~dpn1.jar" --main-class "%CLASS_NAME%" -C "%~dp1." "%CLASS_NAME%.class" -C "%RUNTIME_JAVA%" CompilerDemo/Runtime.class
-:: del /f /q "%~dp1.\%CLASS_NAME%.jbc" "%~dp1.\%CLASS_NAME%.class"
+:: class-файлы рантайма собираются заново, если какого-либо нет (build.bat вызывается вручную после правки *.java)
+if not exist "%RUNTIME_JAVA%\CompilerDemo\Runtime.class" goto build_runtime
+if not exist "%RUNTIME_JAVA%\CompilerDemo\ParallelBody.class" goto build_runtime
+goto runtime_ready
+:build_runtime
+call "%RUNTIME_JAVA%\build.bat"
+:runtime_ready
+
+:: class-файлы и jar пишутся компилятором напрямую, без proguard и jar
+del /f /q "%~dpn1.jar" >NUL 2>&1
+call "%~dp0.\bin\python" -Xutf8 "%~dp0\main.py" --jar "%~dpn1.jar" --java-runtime "%RUNTIME_JAVA%" "%~dpnx1"
+exit /b %ERRORLEVEL%
@@ -26,16 +26,14 @@ if [[ ! -e $FILENAME ]]; then
 fi
 
 
-rm -f "${FILENAME%.*}.jbc" "${FILENAME%.*}.class" "${FILENAME%.*}.jar"
-JBC=$("$PYTHON" "$CD/main.py" --jbc-only "$FILENAME")
-STATUS=$?
-if [[ $STATUS -ne 0 ]]; then
-  exit $STATUS
-fi
-CLASS_NAME=$(echo "$JBC" | grep 'public class' | sed 's/.*class \(\w\+\).*/\1/')  # '
-DIR=$(dirname "$FILENAME")
-rm -f "$DIR/$CLASS_NAME.jbc" "$DIR/$CLASS_NAME.class"
-echo "$JBC" >"$DIR/$CLASS_NAME.jbc"
-"$CD/bin/proguard" "$DIR/$CLASS_NAME.jbc" "$DIR/$CLASS_NAME.class"
-"$CD/bin/jar" --create --file "${FILENAME%.*}.jar" --main-class "$CLASS_NAME" -C "$DIR" "$CLASS_NAME.class" -C "$RUNTIME_JAVA" CompilerDemo/Runtime.class
-# rm -f "$DIR/$CLASS_NAME.jbc" "$DIR/$CLASS_NAME.class"
+# class-файлы рантайма собираются заново, если какой-либо исходник рантайма новее своего class-файла
+for JAVA in "$RUNTIME_JAVA"/CompilerDemo/*.java; do
+  if [[ ! -e "${JAVA%.java}.class" || "$JAVA" -nt "${JAVA%.java}.class" ]]; then
+    "$RUNTIME_JAVA/build.sh" || exit $?
+    break
+  fi
+done
+
+# class-файлы и jar пишутся компилятором напрямую, без proguard и jar
+rm -f "${FILENAME%.*}.jar"
+"$PYTHON" "$CD/main.py" --jar "${FILENAME%.*}.jar" --java-runtime "$RUNTIME_JAVA" "$FILENAME"
@@ -24,13 +24,19 @@ if not exist "%~1" (
 
 
 :: del /f /q "%~dpn1.exe" "%~dpn1.msil"
-echo "%~dp0.\bin\ilasm" /out:"%~dpn1.exe" "%~dpn1.msil" "%RUNTIME_MSIL%"
-"%PYTHON%" "%~dp0main.py" --msil-only "%~dpnx1" > "%~dpn1.msil"
+if not "%USE_ILASM%"=="" goto ilasm
+"%PYTHON%" "%~dp0main.py" --exe "%~dpn1.exe" --runtime "%RUNTIME_MSIL%" "%~dpnx1"
+exit /b %ERRORLEVEL%
+
+:ilasm
+echo "%~dp0.\bin\ilasm" /out:"%~dpn1.exe" "%~dpn1.msil"
+:: среда выполнения - модуль, собираемый один раз в каталоге программы (runtime_<хэш>_v<версия>.netmodule)
+"%PYTHON%" "%~dp0main.py" --msil-only --runtime "%RUNTIME_MSIL%" --runtime-dir "%~dp1." "%~dpnx1" > "%~dpn1.msil"
 set STATUS=%ERRORLEVEL%
 if not "%STATUS%"=="0" (
   del /f /q "%~dpn1.msil"
   exit %STATUS%
 )
 
-"%~dp0.\bin\ilasm" /out:"%~dpn1.exe" "%~dpn1.msil" "%RUNTIME_MSIL%"
+"%~dp0.\bin\ilasm" /out:"%~dpn1.exe" "%~dpn1.msil"
 :: del /f /q "%~dpn1.msil"
@@ -27,12 +27,19 @@ fi
 
 
 rm -f "${FILENAME%.*}.exe" "${FILENAME%.*}.msil"
-"$PYTHON" "$CD/main.py" --msil-only "$FILENAME" >"${FILENAME%.*}.msil"
-STATUS=$?
-if [[ $STATUS -ne 0 ]]; then
-  rm -f "${FILENAME%.*}.msil"
-  exit $STATUS
+if [[ -n $USE_ILASM ]]; then
+  # сборка через ilasm (текст msil сохраняется для отладки), среда выполнения - модуль, собираемый
+  # один раз в каталоге программы (runtime_<хэш>_v<версия>.netmodule)
+  "$PYTHON" "$CD/main.py" --msil-only --runtime "$RUNTIME_MSIL" --runtime-dir "$(dirname "$FILENAME")" \
+    "$FILENAME" >"${FILENAME%.*}.msil"
+  STATUS=$?
+  if [[ $STATUS -ne 0 ]]; then
+    rm -f "${FILENAME%.*}.msil"
+    exit $STATUS
+  fi
+  "$CD/bin/ilasm" /out:"${FILENAME%.*}.exe" "${FILENAME%.*}.msil"
+  # rm -f "${FILENAME%.*}.msil"
+else
+  "$PYTHON" "$CD/main.py" --exe "${FILENAME%.*}.exe" --runtime "$RUNTIME_MSIL" "$FILENAME" || exit $?
 fi
-"$CD/bin/ilasm" /out:"${FILENAME%.*}.exe" "${FILENAME%.*}.msil" "$RUNTIME_MSIL"
-# rm -f "${FILENAME%.*}.msil"
 chmod "u+x,g+x,o+x" "${FILENAME%.*}.exe"
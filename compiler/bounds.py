@@ -0,0 +1,45 @@
+from typing import Optional
+
+from .mel_ast import AstNode, LiteralNode, IdentNode, BinOpNode, MemberNode, AssignNode, ForNode
+from .semantic import BinOp, IdentDesc
+
+
+def _size_of(node: AstNode) -> Optional[IdentDesc]:
+    # a.size для переменной-массива a
+    if isinstance(node, MemberNode) and isinstance(node.obj, IdentNode) and node.obj.node_type.array:
+        return node.obj.node_ident
+    return None
+
+
+def _assigned(node: AstNode, ident: IdentDesc) -> bool:
+    for n in (node.childs or []):
+        if isinstance(n, AssignNode) and n.var.node_ident is ident:
+            return True
+        if _assigned(n, ident):
+            return True
+    return False
+
+
+def indexed_array(loop: ForNode) -> Optional[IdentDesc]:
+    """Распознавание цикла по индексам массива: for (i in start until a.size) или for (i in start..a.size - 1)
+       без шага, где переменная a не изменяется в теле цикла.
+
+       Такой цикл можно генерировать в виде, который JIT распознает и для которого исключает проверки
+       границ массива при обращении к a[i]: for (i = start; i < a.length; i++) (длина массива неизменна,
+       поэтому ее повторное чтение не меняет кол-во итераций)
+    :param loop: цикл for (после семантического анализа)
+    :return: переменная-массив (None, если цикл не подходит)
+    """
+
+    seq = loop.range
+    if seq.stepArg is not None:
+        return None
+    ident = None
+    if seq.seqOp == BinOp.UNTIL:
+        ident = _size_of(seq.endArg)
+    elif seq.seqOp == BinOp.DOTS and isinstance(seq.endArg, BinOpNode) and seq.endArg.op == BinOp.SUB and \
+            isinstance(seq.endArg.arg2, LiteralNode) and seq.endArg.arg2.value == 1:
+        ident = _size_of(seq.endArg.arg1)
+    if ident is None or _assigned(loop.body, ident):
+        return None
+    return ident
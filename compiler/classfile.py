@@ -0,0 +1,765 @@
+import struct
+import zipfile
+from typing import Any, BinaryIO, Dict, Iterable, List, Optional, Tuple, Union
+
+# Запись class-файлов JVM без внешнего ассемблера: сборка кода методов (в объеме, который порождает генератор кода
+# jvm.py), пул констант, вычисление max_stack/max_locals и кадров StackMapTable по потоку типов, запись jar-архива
+
+
+class JvmException(Exception):
+    """Класс для исключений во время сборки class-файла
+    """
+
+    def __init__(self, message, method: str = None, **kwargs: Any) -> None:
+        if method:
+            message = 'Метод {}: {}'.format(method, message)
+        self.message = message
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Инструкции
+
+NONE, LOCAL, CONST, BRANCH, FIELD, METHOD, CLASS, ATYPE, IINC, TABLESWITCH, LOOKUPSWITCH = range(11)
+
+# операция -> (код операции, тип операнда); ldc - псевдоинструкция загрузки константы (int, float или str),
+# ассемблер выбирает для нее iconst_N, bipush, sipush, ldc, ldc_w, dconst_N или ldc2_w
+OPCODES: Dict[str, Tuple[int, int]] = {
+    'nop': (0x00, NONE), 'aconst_null': (0x01, NONE), 'ldc': (0x12, CONST),
+    'iload': (0x15, LOCAL), 'dload': (0x18, LOCAL), 'aload': (0x19, LOCAL),
+    'iaload': (0x2E, NONE), 'daload': (0x31, NONE), 'aaload': (0x32, NONE), 'baload': (0x33, NONE),
+    'istore': (0x36, LOCAL), 'dstore': (0x39, LOCAL), 'astore': (0x3A, LOCAL),
+    'iastore': (0x4F, NONE), 'dastore': (0x52, NONE), 'aastore': (0x53, NONE), 'bastore': (0x54, NONE),
+    'pop': (0x57, NONE), 'pop2': (0x58, NONE), 'dup': (0x59, NONE), 'dup_x1': (0x5A, NONE), 'dup2': (0x5C, NONE),
+    'swap': (0x5F, NONE),
+    'iadd': (0x60, NONE), 'dadd': (0x63, NONE), 'isub': (0x64, NONE), 'dsub': (0x67, NONE),
+    'imul': (0x68, NONE), 'dmul': (0x6B, NONE), 'idiv': (0x6C, NONE), 'ddiv': (0x6F, NONE),
+    'irem': (0x70, NONE), 'drem': (0x73, NONE), 'ineg': (0x74, NONE), 'dneg': (0x77, NONE),
+    'ishl': (0x78, NONE), 'ishr': (0x7A, NONE), 'iushr': (0x7C, NONE),
+    'iand': (0x7E, NONE), 'ior': (0x80, NONE), 'ixor': (0x82, NONE), 'iinc': (0x84, IINC),
+    'i2d': (0x87, NONE), 'd2i': (0x8E, NONE), 'dcmpl': (0x97, NONE), 'dcmpg': (0x98, NONE),
+    'ifeq': (0x99, BRANCH), 'ifne': (0x9A, BRANCH), 'iflt': (0x9B, BRANCH), 'ifge': (0x9C, BRANCH),
+    'ifgt': (0x9D, BRANCH), 'ifle': (0x9E, BRANCH),
+    'if_icmpeq': (0x9F, BRANCH), 'if_icmpne': (0xA0, BRANCH), 'if_icmplt': (0xA1, BRANCH),
+    'if_icmpge': (0xA2, BRANCH), 'if_icmpgt': (0xA3, BRANCH), 'if_icmple': (0xA4, BRANCH),
+    'if_acmpeq': (0xA5, BRANCH), 'if_acmpne': (0xA6, BRANCH), 'goto': (0xA7, BRANCH),
+    'tableswitch': (0xAA, TABLESWITCH), 'lookupswitch': (0xAB, LOOKUPSWITCH),
+    'ireturn': (0xAC, NONE), 'dreturn': (0xAF, NONE), 'areturn': (0xB0, NONE), 'return': (0xB1, NONE),
+    'getstatic': (0xB2, FIELD), 'putstatic': (0xB3, FIELD), 'getfield': (0xB4, FIELD), 'putfield': (0xB5, FIELD),
+    'invokevirtual': (0xB6, METHOD), 'invokespecial': (0xB7, METHOD), 'invokestatic': (0xB8, METHOD),
+    'new': (0xBB, CLASS), 'newarray': (0xBC, ATYPE), 'anewarray': (0xBD, CLASS), 'arraylength': (0xBE, NONE),
+    'athrow': (0xBF, NONE), 'checkcast': (0xC0, CLASS), 'ifnull': (0xC6, BRANCH), 'ifnonnull': (0xC7, BRANCH),
+}
+
+ICONST_0 = 0x03
+DCONST_0 = 0x0E
+BIPUSH = 0x10
+SIPUSH = 0x11
+LDC = 0x12
+LDC_W = 0x13
+LDC2_W = 0x14
+WIDE = 0xC4
+# коды коротких форм (xload_0, xstore_0) для операций с локальными переменными
+LOCAL_SHORT_FORMS = {0x15: 0x1A, 0x18: 0x26, 0x19: 0x2A, 0x36: 0x3B, 0x39: 0x47, 0x3A: 0x4B}
+
+# типы элементов для newarray
+ARRAY_TYPES = {'Z': 4, 'C': 5, 'F': 6, 'D': 7, 'B': 8, 'S': 9, 'I': 10, 'J': 11}
+
+UNCONDITIONAL = ('goto', 'tableswitch', 'lookupswitch', 'ireturn', 'dreturn', 'areturn', 'return', 'athrow')
+
+# типы верификатора: 'I' (int, boolean и т.п.), 'D' (double, занимает две ячейки локальных переменных,
+# вторая - 'T'), 'T' (top - значение не определено), 'null', имя класса или дескриптор массива,
+# ('new', N) - объект, созданный инструкцией N и еще не инициализированный конструктором
+TOP, INT, DOUBLE, NULL = 'T', 'I', 'D', 'null'
+OBJECT_CLASS = 'java/lang/Object'
+
+# операция -> (кол-во снимаемых со стека значений, тип результата или None)
+STACK_EFFECTS: Dict[str, Tuple[int, Optional[str]]] = {
+    'nop': (0, None), 'aconst_null': (0, NULL),
+    'iaload': (2, INT), 'daload': (2, DOUBLE), 'baload': (2, INT),
+    'iastore': (3, None), 'dastore': (3, None), 'aastore': (3, None), 'bastore': (3, None),
+    'pop': (1, None),
+    'iadd': (2, INT), 'dadd': (2, DOUBLE), 'isub': (2, INT), 'dsub': (2, DOUBLE),
+    'imul': (2, INT), 'dmul': (2, DOUBLE), 'idiv': (2, INT), 'ddiv': (2, DOUBLE),
+    'irem': (2, INT), 'drem': (2, DOUBLE), 'ineg': (1, INT), 'dneg': (1, DOUBLE),
+    'ishl': (2, INT), 'ishr': (2, INT), 'iushr': (2, INT), 'iand': (2, INT), 'ior': (2, INT), 'ixor': (2, INT),
+    'iinc': (0, None), 'i2d': (1, DOUBLE), 'd2i': (1, INT), 'dcmpl': (2, INT), 'dcmpg': (2, INT),
+    'ifeq': (1, None), 'ifne': (1, None), 'iflt': (1, None), 'ifge': (1, None), 'ifgt': (1, None), 'ifle': (1, None),
+    'if_icmpeq': (2, None), 'if_icmpne': (2, None), 'if_icmplt': (2, None),
+    'if_icmpge': (2, None), 'if_icmpgt': (2, None), 'if_icmple': (2, None),
+    'if_acmpeq': (2, None), 'if_acmpne': (2, None), 'goto': (0, None),
+    'tableswitch': (1, None), 'lookupswitch': (1, None),
+    'ireturn': (1, None), 'dreturn': (1, None), 'areturn': (1, None), 'return': (0, None),
+    'arraylength': (1, INT), 'athrow': (1, None), 'ifnull': (1, None), 'ifnonnull': (1, None),
+}
+
+# размер значения в ячейках стека/локальных переменных
+SIZES = {DOUBLE: 2, 'J': 2}
+
+
+def type_size(type_: Any) -> int:
+    return SIZES.get(type_, 1)
+
+
+def is_reference(type_: Any) -> bool:
+    return type_ not in (TOP, INT, DOUBLE, 'F', 'J')
+
+
+def field_type(descriptor: str) -> str:
+    """Тип верификатора для дескриптора поля (параметра, результата)
+    """
+
+    if descriptor in ('Z', 'B', 'C', 'S', 'I'):
+        return INT
+    if descriptor.startswith('L'):
+        return descriptor[1:-1]
+    return descriptor
+
+
+def parse_method_descriptor(descriptor: str) -> Tuple[List[str], Optional[str]]:
+    """Типы параметров и результата (None для void) метода по дескриптору вида (ILjava/lang/String;)V
+    """
+
+    params: List[str] = []
+    i = 1
+    while descriptor[i] != ')':
+        start = i
+        while descriptor[i] == '[':
+            i += 1
+        i = descriptor.index(';', i) + 1 if descriptor[i] == 'L' else i + 1
+        params.append(field_type(descriptor[start:i]))
+    ret = descriptor[i + 1:]
+    return params, None if ret == 'V' else field_type(ret)
+
+
+def split_member(ref: str) -> Tuple[str, str, str]:
+    """Разбор ссылки на метод (Owner/name(desc)R) или поле (Owner/name desc) на класс, имя и дескриптор
+    """
+
+    if '(' in ref:
+        path, desc = ref[:ref.index('(')], ref[ref.index('('):]
+    else:
+        path, desc = ref.split(' ', 1)
+    owner, name = path.rsplit('/', 1)
+    return owner, name, desc
+
+
+class StringConst(str):
+    """Строковая константа (операнд ldc, выводится в тексте кода в кавычках)
+    """
+
+    def __str__(self) -> str:
+        result = '"'
+        for c in str.__str__(self):
+            if c in '"\\':
+                result += '\\' + c
+            elif c == '\n':
+                result += '\\n'
+            elif c == '\t':
+                result += '\\t'
+            elif c == '\r':
+                result += '\\r'
+            elif ord(c) < 0x20:
+                result += '\\u{:04x}'.format(ord(c))
+            else:
+                result += c
+        return result + '"'
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Пул констант
+
+CONSTANT_UTF8, CONSTANT_INTEGER, CONSTANT_DOUBLE, CONSTANT_CLASS, CONSTANT_STRING = 1, 3, 6, 7, 8
+CONSTANT_FIELDREF, CONSTANT_METHODREF, CONSTANT_NAME_AND_TYPE = 9, 10, 12
+
+
+def modified_utf8(value: str) -> bytes:
+    """Строка в "модифицированной" UTF-8 (символ 0 - двумя байтами, символы вне BMP - суррогатными парами)
+    """
+
+    data = value.encode('utf-16-be', 'surrogatepass')
+    result = bytearray()
+    for (c, ) in struct.iter_unpack('>H', data):
+        if 0 < c < 0x80:
+            result.append(c)
+        elif c < 0x800:
+            result += bytes((0xC0 | c >> 6, 0x80 | c & 0x3F))
+        else:
+            result += bytes((0xE0 | c >> 12, 0x80 | c >> 6 & 0x3F, 0x80 | c & 0x3F))
+    return bytes(result)
+
+
+class ConstantPool:
+    """Пул констант class-файла (одинаковые константы хранятся один раз)
+    """
+
+    def __init__(self) -> None:
+        self.entries: List[bytes] = []
+        self.indexes: Dict[Tuple[Any, ...], int] = {}
+        self.count = 1
+
+    def add(self, key: Tuple[Any, ...], data: bytes, slots: int = 1) -> int:
+        index = self.indexes.get(key)
+        if index is None:
+            index = self.indexes[key] = self.count
+            self.entries.append(data)
+            self.count += slots
+            if self.count > 0xFFFF:
+                raise JvmException('Слишком много констант в классе')
+        return index
+
+    def utf8(self, value: str) -> int:
+        data = modified_utf8(value)
+        if len(data) > 0xFFFF:
+            raise JvmException('Слишком длинная строка: {}...'.format(value[:20]))
+        return self.add((CONSTANT_UTF8, value), struct.pack('>BH', CONSTANT_UTF8, len(data)) + data)
+
+    def class_(self, name: str) -> int:
+        return self.add((CONSTANT_CLASS, name), struct.pack('>BH', CONSTANT_CLASS, self.utf8(name)))
+
+    def string(self, value: str) -> int:
+        return self.add((CONSTANT_STRING, value), struct.pack('>BH', CONSTANT_STRING, self.utf8(value)))
+
+    def integer(self, value: int) -> int:
+        return self.add((CONSTANT_INTEGER, value), struct.pack('>Bi', CONSTANT_INTEGER, value))
+
+    def double(self, value: float) -> int:
+        # ключ - двоичное представление (чтобы различать 0.0 и -0.0)
+        data = struct.pack('>Bd', CONSTANT_DOUBLE, value)
+        return self.add((CONSTANT_DOUBLE, data), data, 2)
+
+    def name_and_type(self, name: str, descriptor: str) -> int:
+        return self.add((CONSTANT_NAME_AND_TYPE, name, descriptor),
+                        struct.pack('>BHH', CONSTANT_NAME_AND_TYPE, self.utf8(name), self.utf8(descriptor)))
+
+    def member(self, tag: int, ref: str) -> int:
+        owner, name, descriptor = split_member(ref)
+        return self.add((tag, owner, name, descriptor),
+                        struct.pack('>BHH', tag, self.class_(owner), self.name_and_type(name, descriptor)))
+
+    def to_bytes(self) -> bytes:
+        return struct.pack('>H', self.count) + b''.join(self.entries)
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Поток типов (max_stack, max_locals, кадры StackMapTable)
+
+Frame = Tuple[Tuple[Any, ...], Tuple[Any, ...]]
+
+
+def merge_types(a: Any, b: Any) -> Any:
+    if a == b:
+        return a
+    if is_reference(a) and is_reference(b) and not isinstance(a, tuple) and not isinstance(b, tuple):
+        return b if a == NULL else a if b == NULL else OBJECT_CLASS
+    return None
+
+
+def merge_frames(a: Frame, b: Frame) -> Frame:
+    a_locals, a_stack = a
+    b_locals, b_stack = b
+    if len(a_stack) != len(b_stack):
+        raise JvmException('разная глубина стека при слиянии потоков управления')
+    stack = []
+    for x, y in zip(a_stack, b_stack):
+        merged = merge_types(x, y)
+        if merged is None:
+            raise JvmException('несовместимые типы в стеке при слиянии потоков управления: {}, {}'.format(x, y))
+        stack.append(merged)
+    # отсутствующие в конце ячейки - top
+    size = max(len(a_locals), len(b_locals)) + 1
+    a_locals += (TOP, ) * (size - len(a_locals))
+    b_locals += (TOP, ) * (size - len(b_locals))
+    locals_ = [TOP if x != y else x for x, y in zip(a_locals, b_locals)]
+    # от double остается только целая пара ячеек
+    for i, t in enumerate(locals_):
+        if t == DOUBLE and (a_locals[i + 1] != TOP or b_locals[i + 1] != TOP):
+            locals_[i] = TOP
+    while locals_ and locals_[-1] == TOP:
+        locals_.pop()
+    return tuple(locals_), tuple(stack)
+
+
+def store_local(locals_: Tuple[Any, ...], index: int, type_: Any) -> Tuple[Any, ...]:
+    size = type_size(type_)
+    result = list(locals_) + [TOP] * max(0, index + size - len(locals_))
+    if index > 0 and result[index - 1] == DOUBLE:
+        result[index - 1] = TOP
+    result[index] = type_
+    if size == 2:
+        result[index + 1] = TOP
+    return tuple(result)
+
+
+class Instr:
+    def __init__(self, op: str, params: Tuple[Any, ...], line: int) -> None:
+        self.op = op
+        self.params = params
+        self.line = line
+        self.targets: List[int] = []
+
+
+def simulate(instr: Instr, index: int, frame: Frame) -> Frame:
+    """Состояние (типы локальных переменных и стека) после выполнения инструкции
+    """
+
+    locals_, stack = frame
+    stack = list(stack)
+    op, params = instr.op, instr.params
+
+    def pop(count: int = 1) -> List[Any]:
+        if len(stack) < count:
+            raise JvmException('недостаточно значений в стеке для {} (строка {})'.format(op, instr.line))
+        values = stack[len(stack) - count:]
+        del stack[len(stack) - count:]
+        return values
+
+    if op in STACK_EFFECTS:
+        count, result = STACK_EFFECTS[op]
+        pop(count)
+        if result is not None:
+            stack.append(result)
+    elif op == 'ldc':
+        value = params[0]
+        stack.append('java/lang/String' if isinstance(value, str) else DOUBLE if isinstance(value, float) else INT)
+    elif op in ('iload', 'dload', 'aload'):
+        type_ = locals_[params[0]] if params[0] < len(locals_) else TOP
+        expected = {'iload': INT, 'dload': DOUBLE}.get(op)
+        if type_ == TOP or (expected and type_ != expected) or (not expected and not is_reference(type_)):
+            raise JvmException('чтение неинициализированной переменной {} (строка {})'.format(params[0], instr.line))
+        stack.append(type_)
+    elif op in ('istore', 'dstore', 'astore'):
+        locals_ = store_local(locals_, params[0], pop()[0])
+    elif op == 'aaload':
+        array = pop(2)[0]
+        stack.append(field_type(array[1:]) if isinstance(array, str) and array.startswith('[') else OBJECT_CLASS)
+    elif op == 'dup':
+        stack.append(pop()[0])
+        stack.append(stack[-1])
+    elif op == 'dup_x1':
+        a, b = pop(2)
+        stack += [b, a, b]
+    elif op == 'dup2':
+        if type_size(stack[-1] if stack else None) == 2:
+            stack.append(stack[-1])
+        else:
+            stack += pop(2) * 2
+    elif op == 'pop2':
+        if type_size(stack[-1] if stack else None) == 2:
+            pop()
+        else:
+            pop(2)
+    elif op == 'swap':
+        a, b = pop(2)
+        stack += [b, a]
+    elif op in ('getstatic', 'putstatic'):
+        type_ = field_type(split_member(params[0])[2])
+        if op == 'getstatic':
+            stack.append(type_)
+        else:
+            pop()
+    elif op in ('getfield', 'putfield'):
+        type_ = field_type(split_member(params[0])[2])
+        if op == 'getfield':
+            pop()
+            stack.append(type_)
+        else:
+            pop(2)
+    elif op in ('invokestatic', 'invokevirtual', 'invokespecial'):
+        owner, name, descriptor = split_member(params[0])
+        param_types, ret = parse_method_descriptor(descriptor)
+        pop(len(param_types))
+        if op != 'invokestatic':
+            this = pop()[0]
+            if name == '<init>':
+                # после вызова конструктора все копии ссылки на объект становятся инициализированными
+                stack = [owner if t == this else t for t in stack]
+                locals_ = tuple(owner if t == this else t for t in locals_)
+        if ret is not None:
+            stack.append(ret)
+    elif op == 'new':
+        stack.append(('new', index))
+    elif op == 'newarray':
+        pop()
+        stack.append('[' + params[0])
+    elif op == 'anewarray':
+        pop()
+        stack.append('[' + (params[0] if params[0].startswith('[') else 'L' + params[0] + ';'))
+    elif op == 'checkcast':
+        pop()
+        stack.append(params[0])
+    else:
+        raise JvmException('неизвестная инструкция {} (строка {})'.format(op, instr.line))
+    return locals_, tuple(stack)
+
+
+def stack_size(stack: Iterable[Any]) -> int:
+    return sum(type_size(t) for t in stack)
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Код метода
+
+def instr_size(line: Any, offset: int = 0) -> int:
+    """Размер инструкции в байтах (для еще не собранного кода - оценка, ldc считается по длинной форме)
+    :param line: строка кода (объект с атрибутами code и params)
+    :param offset: смещение инструкции (для выравнивания таблиц tableswitch и lookupswitch)
+    """
+
+    op = line.code.strip()
+    if not op or op.startswith('.'):
+        return 0
+    kind = OPCODES[op][1]
+    params = line.params
+    if kind == CONST:
+        value = params[0]
+        if isinstance(value, float):
+            return 1 if value in (0.0, 1.0) and struct.pack('>d', value) != struct.pack('>d', -0.0) else 3
+        if isinstance(value, int):
+            return 1 if -1 <= value <= 5 else 2 if -128 <= value <= 127 else 3
+        return 3
+    if kind == LOCAL:
+        return 1 if params[0] <= 3 else 2 if params[0] <= 255 else 4
+    if kind == IINC:
+        return 3 if params[0] <= 255 and -128 <= params[1] <= 127 else 6
+    if kind in (BRANCH, FIELD, METHOD, CLASS):
+        return 3
+    if kind == ATYPE:
+        return 2
+    padding = 3 - offset % 4
+    if kind == TABLESWITCH:
+        return 1 + padding + 12 + 4 * (len(params) - 2)
+    if kind == LOOKUPSWITCH:
+        return 1 + padding + 8 + 8 * ((len(params) - 1) // 2)
+    return 1
+
+
+def code_size(lines: List[Any]) -> int:
+    return sum(instr_size(line) for line in lines)
+
+
+class MethodAssembler:
+    """Сборка кода метода: поток типов (недостижимый код удаляется), размещение инструкций,
+       кодирование, max_stack, max_locals и StackMapTable
+    """
+
+    def __init__(self, pool: ConstantPool, name: str, descriptor: str, static: bool, owner: str) -> None:
+        self.pool = pool
+        self.name = name
+        self.descriptor = descriptor
+        self.instrs: List[Instr] = []
+        # метка -> номер инструкции, перед которой она стоит
+        self.labels: Dict[Any, int] = {}
+        param_types, _ = parse_method_descriptor(descriptor)
+        locals_: Tuple[Any, ...] = () if static else (owner, )
+        for t in param_types:
+            locals_ += (t, TOP) if type_size(t) == 2 else (t, )
+        self.initial: Frame = (locals_, ())
+
+    def add(self, op: str, params: Tuple[Any, ...], label: Any, line: int) -> None:
+        if label is not None:
+            self.labels[label] = len(self.instrs)
+        if op:
+            if op not in OPCODES:
+                raise JvmException('неизвестная инструкция {} (строка {})'.format(op, line), self.name)
+            self.instrs.append(Instr(op, params, line))
+
+    def resolve_targets(self) -> None:
+        for instr in self.instrs:
+            kind = OPCODES[instr.op][1]
+            if kind == BRANCH:
+                labels = [instr.params[0]]
+            elif kind == TABLESWITCH:
+                labels = list(instr.params[1:])
+            elif kind == LOOKUPSWITCH:
+                labels = [instr.params[0], *instr.params[2::2]]
+            else:
+                continue
+            for label in labels:
+                if label not in self.labels:
+                    raise JvmException('метка {} не определена (строка {})'.format(label, instr.line), self.name)
+            instr.targets = [self.labels[label] for label in labels]
+
+    def flow(self) -> List[Optional[Frame]]:
+        """Состояния перед каждой инструкцией (None - инструкция недостижима)
+        """
+
+        states: List[Optional[Frame]] = [None] * len(self.instrs)
+        if not self.instrs:
+            raise JvmException('пустой метод', self.name)
+        states[0] = self.initial
+        work = [0]
+        while work:
+            i = work.pop()
+            instr = self.instrs[i]
+            try:
+                out = simulate(instr, i, states[i])
+            except JvmException as e:
+                raise JvmException(e.message, self.name)
+            successors = list(instr.targets)
+            if instr.op not in UNCONDITIONAL:
+                if i + 1 >= len(self.instrs):
+                    raise JvmException('выполнение выходит за конец кода метода', self.name)
+                successors.append(i + 1)
+            for s in successors:
+                try:
+                    merged = out if states[s] is None else merge_frames(states[s], out)
+                except JvmException as e:
+                    raise JvmException('{} (строка {})'.format(e.message, self.instrs[s].line), self.name)
+                if merged != states[s]:
+                    states[s] = merged
+                    work.append(s)
+        return states
+
+    def verification_type(self, type_: Any, offsets: List[int]) -> bytes:
+        if type_ == TOP:
+            return b'\x00'
+        if type_ == INT:
+            return b'\x01'
+        if type_ == DOUBLE:
+            return b'\x03'
+        if type_ == NULL:
+            return b'\x05'
+        if isinstance(type_, tuple):
+            return struct.pack('>BH', 8, offsets[type_[1]])
+        return struct.pack('>BH', 7, self.pool.class_(type_))
+
+    def frame_types(self, types: Iterable[Any], offsets: List[int]) -> List[bytes]:
+        # в локальных переменных Double занимает две ячейки (DOUBLE, TOP), в кадре - одну запись;
+        # на стеке операндов Double - один элемент, поэтому стек кодируется без пропусков (см. stack_map)
+        result = []
+        skip = False
+        for t in types:
+            if skip:
+                skip = False
+                continue
+            result.append(self.verification_type(t, offsets))
+            skip = t == DOUBLE
+        return result
+
+    def stack_map(self, frames: List[Tuple[int, Frame]], offsets: List[int]) -> bytes:
+        prev_locals = self.frame_types(self.initial[0], offsets)
+        prev_offset = -1
+        data = b''
+        for offset, (locals_, stack) in frames:
+            locals_types = self.frame_types(locals_, offsets)
+            stack_types = [self.verification_type(t, offsets) for t in stack]
+            delta = offset - prev_offset - 1
+            if locals_types == prev_locals and not stack_types and delta < 64:
+                data += bytes((delta, ))
+            elif locals_types == prev_locals and len(stack_types) == 1 and delta < 64:
+                data += bytes((64 + delta, )) + stack_types[0]
+            elif locals_types == prev_locals and not stack_types:
+                data += struct.pack('>BH', 251, delta)
+            else:
+                data += struct.pack('>BHH', 255, delta, len(locals_types)) + b''.join(locals_types)
+                data += struct.pack('>H', len(stack_types)) + b''.join(stack_types)
+            prev_locals = locals_types
+            prev_offset = offset
+        return struct.pack('>H', len(frames)) + data
+
+    def encode(self, instr: Instr, offset: int, target_offsets: List[int]) -> bytes:
+        code, kind = OPCODES[instr.op]
+        params = instr.params
+        if kind == NONE:
+            return bytes((code, ))
+        if kind == CONST:
+            value = params[0]
+            if isinstance(value, float):
+                if value in (0.0, 1.0) and struct.pack('>d', value) != struct.pack('>d', -0.0):
+                    return bytes((DCONST_0 + int(value), ))
+                return struct.pack('>BH', LDC2_W, self.pool.double(value))
+            if isinstance(value, int):
+                if not -0x80000000 <= value <= 0x7FFFFFFF:
+                    raise JvmException('значение {} вне диапазона Int (строка {})'.format(value, instr.line),
+                                       self.name)
+                if -1 <= value <= 5:
+                    return bytes((ICONST_0 + value, ))
+                if -128 <= value <= 127:
+                    return struct.pack('>Bb', BIPUSH, value)
+                if -32768 <= value <= 32767:
+                    return struct.pack('>Bh', SIPUSH, value)
+                index = self.pool.integer(value)
+            else:
+                index = self.pool.string(value)
+            return struct.pack('>BB', LDC, index) if index <= 0xFF else struct.pack('>BH', LDC_W, index)
+        if kind == LOCAL:
+            index = params[0]
+            if index <= 3:
+                return bytes((LOCAL_SHORT_FORMS[code] + index, ))
+            return struct.pack('>BB', code, index) if index <= 0xFF else struct.pack('>BBH', WIDE, code, index)
+        if kind == IINC:
+            index, value = params
+            if index <= 0xFF and -128 <= value <= 127:
+                return struct.pack('>BBb', code, index, value)
+            return struct.pack('>BBHh', WIDE, code, index, value)
+        if kind == BRANCH:
+            delta = target_offsets[0] - offset
+            if not -0x8000 <= delta <= 0x7FFF:
+                raise JvmException('слишком длинный переход (строка {})'.format(instr.line), self.name)
+            return struct.pack('>Bh', code, delta)
+        if kind == FIELD:
+            return struct.pack('>BH', code, self.pool.member(CONSTANT_FIELDREF, params[0]))
+        if kind == METHOD:
+            return struct.pack('>BH', code, self.pool.member(CONSTANT_METHODREF, params[0]))
+        if kind == CLASS:
+            return struct.pack('>BH', code, self.pool.class_(params[0]))
+        if kind == ATYPE:
+            return struct.pack('>BB', code, ARRAY_TYPES[params[0]])
+        padding = bytes(3 - offset % 4)
+        deltas = [t - offset for t in target_offsets]
+        if kind == TABLESWITCH:
+            low = params[0]
+            return bytes((code, )) + padding + struct.pack('>iii', deltas[0], low, low + len(deltas) - 2) + \
+                struct.pack('>%di' % (len(deltas) - 1), *deltas[1:])
+        keys = params[1::2]
+        pairs = sorted(zip(keys, deltas[1:]))
+        return bytes((code, )) + padding + struct.pack('>ii', deltas[0], len(pairs)) + \
+            b''.join(struct.pack('>ii', key, delta) for key, delta in pairs)
+
+    def assemble(self) -> Tuple[bytes, int, int, bytes]:
+        """Сборка кода метода
+        :return: код, max_stack, max_locals, атрибут StackMapTable (пустой, если кадры не нужны)
+        """
+
+        self.resolve_targets()
+        states = self.flow()
+        # недостижимый код удаляется (для него невозможно построить кадры StackMapTable)
+        live = [i for i, state in enumerate(states) if state is not None]
+        positions = {i: n for n, i in enumerate(live)}
+        offsets: List[int] = []
+        offset = 0
+        for i in live:
+            offsets.append(offset)
+            # размер не зависит от смещений переходов (кроме выравнивания таблиц), константы добавляются в пул
+            instr = self.instrs[i]
+            offset += len(self.encode(instr, offset, [offset] * len(instr.targets)))
+        if offset > 0xFFFF:
+            raise JvmException('слишком большой код метода ({} байт)'.format(offset), self.name)
+        # смещения новых (неинициализированных) объектов - по номерам исходных инструкций
+        instr_offsets = [offsets[positions[i]] if i in positions else 0 for i in range(len(self.instrs))]
+
+        code = bytearray()
+        targets = set()
+        max_stack = 0
+        max_locals = len(self.initial[0])
+        for n, i in enumerate(live):
+            instr = self.instrs[i]
+            targets.update(instr.targets)
+            data = self.encode(instr, offsets[n], [instr_offsets[t] for t in instr.targets])
+            code += data
+            locals_, stack = states[i]
+            max_stack = max(max_stack, stack_size(simulate(instr, i, states[i])[1]), stack_size(stack))
+            max_locals = max(max_locals, len(locals_))
+            if OPCODES[instr.op][1] == LOCAL:
+                max_locals = max(max_locals, instr.params[0] + (2 if instr.op[0] == 'd' else 1))
+        frames = [(instr_offsets[t], states[t]) for t in sorted(targets)]
+        stack_map = self.stack_map(frames, instr_offsets) if frames else b''
+        return bytes(code), max_stack, max_locals, stack_map
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Class-файл
+
+ACCESS_FLAGS = {'public': 0x0001, 'private': 0x0002, 'protected': 0x0004, 'static': 0x0008, 'final': 0x0010,
+                'super': 0x0020}
+ACC_PUBLIC_SUPER = 0x0021
+
+# версия class-файла (Java 8: кадры StackMapTable обязательны)
+MAJOR_VERSION = 52
+
+
+def access_flags(words: Iterable[str]) -> int:
+    flags = 0
+    for word in words:
+        if word not in ACCESS_FLAGS:
+            raise JvmException('неизвестный модификатор {}'.format(word))
+        flags |= ACCESS_FLAGS[word]
+    return flags
+
+
+class ClassFile:
+    def __init__(self, name: str, access: int = ACC_PUBLIC_SUPER, super_name: str = OBJECT_CLASS) -> None:
+        self.pool = ConstantPool()
+        self.name = name
+        self.access = access
+        self.super_name = super_name
+        self.fields: List[bytes] = []
+        self.methods: List[bytes] = []
+
+    def add_field(self, access: int, name: str, descriptor: str) -> None:
+        self.fields.append(struct.pack('>HHHH', access, self.pool.utf8(name), self.pool.utf8(descriptor), 0))
+
+    def add_method(self, access: int, method: MethodAssembler) -> None:
+        code, max_stack, max_locals, stack_map = method.assemble()
+        attrs = b''
+        if stack_map:
+            attrs = struct.pack('>HI', self.pool.utf8('StackMapTable'), len(stack_map)) + stack_map
+        body = struct.pack('>HHI', max_stack, max_locals, len(code)) + code + \
+            struct.pack('>HH', 0, 1 if attrs else 0) + attrs
+        self.methods.append(struct.pack('>HHHHHI', access, self.pool.utf8(method.name),
+                                        self.pool.utf8(method.descriptor), 1, self.pool.utf8('Code'), len(body)) + body)
+
+    def to_bytes(self) -> bytes:
+        this_index = self.pool.class_(self.name)
+        super_index = self.pool.class_(self.super_name)
+        return struct.pack('>IHH', 0xCAFEBABE, 0, MAJOR_VERSION) + self.pool.to_bytes() + \
+            struct.pack('>HHHH', self.access, this_index, super_index, 0) + \
+            struct.pack('>H', len(self.fields)) + b''.join(self.fields) + \
+            struct.pack('>H', len(self.methods)) + b''.join(self.methods) + struct.pack('>H', 0)
+
+
+def assemble(lines: Iterable[Any]) -> Dict[str, bytes]:
+    """Сборка class-файлов из кода генератора (директивы .class, .super, .field, .method, .end method,
+       инструкции и метки)
+    :param lines: строки кода (объекты с атрибутами code, params и label)
+    :return: имя класса -> содержимое class-файла
+    """
+
+    classes: Dict[str, ClassFile] = {}
+    cls: Optional[ClassFile] = None
+    method: Optional[MethodAssembler] = None
+    method_access = 0
+    for number, line in enumerate(lines, 1):
+        code = line.code.strip()
+        words = code.split()
+        if code.startswith('.'):
+            directive, words = words[0], words[1:]
+            if directive == '.class':
+                cls = classes[line.params[0]] = ClassFile(line.params[0], access_flags(words) | ACCESS_FLAGS['super'])
+            elif directive == '.super':
+                cls.super_name = line.params[0]
+            elif directive == '.field':
+                cls.add_field(access_flags(words), *line.params)
+            elif directive == '.method':
+                name, descriptor = line.params[0].split('(', 1)
+                method_access = access_flags(words)
+                method = MethodAssembler(cls.pool, name, '(' + descriptor,
+                                         bool(method_access & ACCESS_FLAGS['static']), cls.name)
+            elif directive == '.end':
+                cls.add_method(method_access, method)
+                method = None
+            else:
+                raise JvmException('неизвестная директива {} (строка {})'.format(directive, number))
+        elif code or line.label is not None:
+            if method is None:
+                raise JvmException('инструкция вне метода (строка {})'.format(number))
+            method.add(code, line.params, line.label, number)
+    return {name: cls.to_bytes() for name, cls in classes.items()}
+
+
+def write_jar(file_name: Union[str, BinaryIO], classes: Dict[str, bytes], main_class: str,
+              files: Iterable[Tuple[str, str]] = ()) -> None:
+    """Запись jar-архива
+    :param file_name: имя файла или поток
+    :param classes: имя класса -> содержимое class-файла
+    :param main_class: класс с методом main (Main-Class в манифесте)
+    :param files: дополнительные файлы (имя в архиве, путь к файлу)
+    """
+
+    manifest = 'Manifest-Version: 1.0\r\nMain-Class: {}\r\n\r\n'.format(main_class.replace('/', '.'))
+    with zipfile.ZipFile(file_name, mode='w', compression=zipfile.ZIP_DEFLATED) as jar:
+        jar.writestr('META-INF/MANIFEST.MF', manifest)
+        for name, data in classes.items():
+            jar.writestr(name + '.class', data)
+        for arc_name, path in files:
+            jar.write(path, arc_name)
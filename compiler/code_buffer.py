@@ -0,0 +1,178 @@
+from array import array
+from typing import Any, Callable, Dict, Iterator, List, TextIO, Tuple, Union
+
+# форматирование строки кода: (отступ, код, параметры, метка) -> текст строки
+LineFormat = Callable[[str, str, Tuple[Any, ...], Any], str]
+
+NO_LABEL = -1
+
+
+class BufferLine:
+    """Строка кода в буфере (легковесное представление: хранит только буфер и номер строки,
+       атрибуты code, params и label читаются и записываются непосредственно в буфер)
+    """
+
+    __slots__ = ('buffer', 'index')
+
+    def __init__(self, buffer: 'CodeBuffer', index: int) -> None:
+        self.buffer = buffer
+        self.index = index
+
+    @property
+    def code(self) -> str:
+        return ' ' * self.buffer.indents[self.index] + self.buffer.texts[self.buffer.ops[self.index]]
+
+    @code.setter
+    def code(self, code: str) -> None:
+        text = code.lstrip()
+        self.buffer.indents[self.index] = len(code) - len(text)
+        self.buffer.ops[self.index] = self.buffer.text_id(text)
+
+    @property
+    def params(self) -> Tuple[Any, ...]:
+        start = self.buffer.param_starts[self.index]
+        return tuple(self.buffer.operands[start:start + self.buffer.param_counts[self.index]])
+
+    @params.setter
+    def params(self, params: Tuple[Any, ...]) -> None:
+        buffer = self.buffer
+        if len(params) == buffer.param_counts[self.index]:
+            start = buffer.param_starts[self.index]
+            buffer.operands[start:start + len(params)] = params
+        else:
+            buffer.param_starts[self.index] = len(buffer.operands)
+            buffer.param_counts[self.index] = len(params)
+            buffer.operands.extend(params)
+            buffer.moved_params_end = len(buffer.operands)
+
+    @property
+    def label(self) -> Any:
+        label = self.buffer.labels[self.index]
+        return self.buffer.label_table[label] if label != NO_LABEL else None
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, BufferLine) and other.buffer is self.buffer and other.index == self.index
+
+    def __hash__(self) -> int:
+        return hash((id(self.buffer), self.index))
+
+    def __str__(self) -> str:
+        return self.buffer.format_line(self.index)
+
+
+class CodeBuffer:
+    """Компактный буфер инструкций: строки кода (операции и директивы без отступа) хранятся в таблице строк,
+       для каждой инструкции в массивах хранятся номер строки кода, отступ, номер метки и положение
+       параметров в общей таблице операндов; номера меток назначаются при выводе (за один проход
+       по массиву меток), после чего текст кода выводится в поток за один проход
+    """
+
+    def __init__(self, line_format: LineFormat) -> None:
+        self.line_format = line_format
+        self.texts: List[str] = []
+        self.text_ids: Dict[str, int] = {}
+        self.ops = array('I')
+        self.indents = array('H')
+        self.labels = array('i')
+        self.param_starts = array('I')
+        self.param_counts = array('H')
+        self.operands: List[Any] = []
+        # конец параметров, перемещенных в конец таблицы операндов при изменении их кол-ва
+        self.moved_params_end = 0
+        self.label_table: List[Any] = []
+
+    def text_id(self, text: str) -> int:
+        result = self.text_ids.get(text)
+        if result is None:
+            result = self.text_ids[text] = len(self.texts)
+            self.texts.append(text)
+        return result
+
+    def add(self, code: str, *params: Any, label: Any = None) -> None:
+        text = code.lstrip()
+        self.ops.append(self.text_id(text))
+        self.indents.append(len(code) - len(text))
+        if label is not None:
+            self.labels.append(len(self.label_table))
+            self.label_table.append(label)
+        else:
+            self.labels.append(NO_LABEL)
+        self.param_starts.append(len(self.operands))
+        self.param_counts.append(len(params))
+        self.operands.extend(params)
+
+    def append(self, line: Any) -> None:
+        """Добавление строки (объекта с атрибутами code, params и label, в т.ч. строки другого буфера)
+        """
+
+        self.add(line.code, *line.params, label=line.label)
+
+    def copy(self, buffer: 'CodeBuffer', index: int) -> None:
+        """Добавление строки index буфера buffer (без создания объекта строки)
+        """
+
+        start = buffer.param_starts[index]
+        label = buffer.labels[index]
+        self.add(' ' * buffer.indents[index] + buffer.texts[buffer.ops[index]],
+                 *buffer.operands[start:start + buffer.param_counts[index]],
+                 label=buffer.label_table[label] if label != NO_LABEL else None)
+
+    def __len__(self) -> int:
+        return len(self.ops)
+
+    def __iter__(self) -> Iterator[BufferLine]:
+        return (BufferLine(self, i) for i in range(len(self.ops)))
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[BufferLine, List[BufferLine]]:
+        if isinstance(index, slice):
+            return [BufferLine(self, i) for i in range(*index.indices(len(self.ops)))]
+        return BufferLine(self, index if index >= 0 else len(self.ops) + index)
+
+    def __delitem__(self, index: Union[int, slice]) -> None:
+        # параметры и метки удаленных строк остаются в таблицах (кроме удаления хвоста буфера)
+        tail = isinstance(index, slice) and index.stop is None and index.step is None
+        if tail:
+            first = index.indices(len(self.ops))[0]
+            operands_end = self.param_starts[first] if first < len(self.ops) else len(self.operands)
+        for column in (self.ops, self.indents, self.labels, self.param_starts, self.param_counts):
+            del column[index]
+        if tail:
+            if operands_end >= self.moved_params_end:
+                del self.operands[operands_end:]
+            del self.label_table[max(self.labels, default=NO_LABEL) + 1:]
+
+    def index(self, line: BufferLine) -> int:
+        return line.index
+
+    def remove(self, line: BufferLine) -> None:
+        del self[line.index]
+
+    def format_line(self, index: int) -> str:
+        start = self.param_starts[index]
+        label = self.labels[index]
+        return self.line_format(' ' * self.indents[index], self.texts[self.ops[index]],
+                                tuple(self.operands[start:start + self.param_counts[index]]),
+                                self.label_table[label] if label != NO_LABEL else None)
+
+    def number_labels(self) -> None:
+        """Назначение номеров меткам в порядке их следования в коде (атрибут index меток)
+        """
+
+        number = 0
+        label_table = self.label_table
+        for label in self.labels:
+            if label != NO_LABEL:
+                label_table[label].index = number
+                number += 1
+
+    def text(self) -> Iterator[str]:
+        self.number_labels()
+        return (self.format_line(i) for i in range(len(self.ops)))
+
+    def write(self, out: TextIO) -> None:
+        """Вывод текста кода в поток (строки выводятся по мере форматирования, без построения списка)
+        """
+
+        for line in self.text():
+            out.write(line)
+            out.write('\n')
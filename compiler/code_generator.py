@@ -1,5 +1,6 @@
-from typing import List, Union
+from typing import Any, List, Tuple, Union
 
+from .code_buffer import CodeBuffer
 from .mel_ast import AstNode, VarsNode
 from .semantic import BaseType
 
@@ -21,6 +22,24 @@ class CodeLabel:
         return f'{self.prefix}_{self.index}'
 
 
+def format_line(indent: str, code: str, params: Tuple[Any, ...], label: CodeLabel) -> str:
+    line = ''
+    if label:
+        if indent:
+            line += indent[2:]
+        line += f'{label}:'
+        if code:
+            line += ' '
+    else:
+        if indent:
+            line += indent
+    if code:
+        line += code
+        for p in params:
+            line += ' ' + str(p)
+    return line
+
+
 class CodeLine:
     def __init__(self, code: Union[str, CodeLabel], *params: Union[str, CodeLabel], label: CodeLabel = None, indent: str = None):
         if isinstance(code, CodeLabel):
@@ -31,21 +50,7 @@ class CodeLine:
         self.indent = indent
 
     def __str__(self):
-        line = ''
-        if self.label:
-            if self.indent:
-                line += self.indent[2:]
-            line += f'{self.label}:'
-            if self.code:
-                line += ' '
-        else:
-            if self.indent:
-                line += self.indent
-        if self.code:
-            line += self.code
-            for p in self.params:
-                line += ' ' + str(p)
-        return line
+        return format_line(self.indent, self.code, self.params, self.label)
 
 
 def find_vars_decls(node: AstNode) -> List[VarsNode]:
@@ -64,7 +69,7 @@ def find_vars_decls(node: AstNode) -> List[VarsNode]:
 
 class CodeGenerator:
     def __init__(self):
-        self.code_lines: List[CodeLine] = []
+        self.code_lines = CodeBuffer(format_line)
         self.indent = ''
 
     def add(self, code: str, *params: Union[str, int, CodeLabel], label: CodeLabel = None):
@@ -72,19 +77,11 @@ class CodeGenerator:
             code, label = None, code
         if code and len(code) > 0 and code[-1] == '}':
             self.indent = self.indent[2:]
-        self.code_lines.append(CodeLine(code, *params, label=label, indent=self.indent))
+        # отступ хранится в буфере вместе с кодом (для строки только с меткой код пустой)
+        self.code_lines.add(self.indent + (code or ''), *params, label=label)
         if code and len(code) > 0 and code[-1] == '{':
             self.indent = self.indent + '  '
 
     @property
     def code(self) -> [str, ...]:
-        index = 0
-        for cl in self.code_lines:
-            line = cl.code
-            if cl.label:
-                cl.label.index = index
-                index += 1
-        code: List[str] = []
-        for cl in self.code_lines:
-            code.append(str(cl))
-        return code
+        return list(self.code_lines.text())
@@ -0,0 +1,303 @@
+import math
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import purity
+from .mel_ast import AstNode, LiteralNode, IdentNode, BinOpNode, TypeConvertNode, CallNode, StmtListNode, \
+    AssignNode, VarsNode, VarNode, ReturnNode, IfNode, WhileNode, DoWhileNode, ForNode, FuncNode, \
+    WhenNode, WhenExprNode, WhenBranchNode, WhenInNode
+from .semantic import BaseType, BinOp, IdentDesc, IdentScope
+
+# максимальное кол-во вычисляемых узлов AST-дерева на одно вычисление вызова
+DEFAULT_FUEL = 100000
+# максимальная глубина вложенности вызовов (ограничена также глубиной рекурсии самого python)
+DEFAULT_MAX_DEPTH = 100
+
+INT_MIN, INT_MAX = -2 ** 31, 2 ** 31 - 1
+
+DEFAULT_VALUES = {
+    BaseType.INT: 0,
+    BaseType.FLOAT: 0.0,
+    BaseType.BOOL: False,
+    BaseType.STR: ''
+}
+
+
+class NotConstantException(Exception):
+    """Исключение, прерывающее вычисление (выражение не может быть вычислено на этапе компиляции)
+    """
+
+    def __init__(self, message: str) -> None:
+        self.message = message
+
+
+class _ReturnSignal(Exception):
+    def __init__(self, value: Any) -> None:
+        self.value = value
+
+
+def to_int32(value: int) -> int:
+    return (value - INT_MIN) % 2 ** 32 + INT_MIN
+
+
+class Evaluator:
+    """Интерпретатор типизированного AST-дерева для вычисления вызовов чистых функций
+       на этапе компиляции (с ограничениями на кол-во шагов и глубину рекурсии)
+    """
+
+    def __init__(self, funcs: Dict[str, FuncNode], fuel: int = DEFAULT_FUEL, max_depth: int = DEFAULT_MAX_DEPTH) -> None:
+        self.funcs = funcs
+        self.fuel = fuel
+        self.max_depth = max_depth
+        self.depth = 0
+        self.cache: Dict[Tuple[str, Tuple[Any, ...]], Any] = {}
+
+    def step(self) -> None:
+        self.fuel -= 1
+        if self.fuel < 0:
+            raise NotConstantException('превышен лимит шагов вычисления')
+
+    def eval(self, node: AstNode, env: Dict[IdentDesc, Any]) -> Any:
+        self.step()
+        if isinstance(node, LiteralNode):
+            return node.value
+        if isinstance(node, IdentNode):
+            if node.node_ident not in env:
+                raise NotConstantException('значение {} неизвестно'.format(node.name))
+            return env[node.node_ident]
+        if isinstance(node, BinOpNode):
+            return self.eval_bin_op(node, self.eval(node.arg1, env), self.eval(node.arg2, env))
+        if isinstance(node, TypeConvertNode):
+            return self.eval_convert(node, self.eval(node.expr, env))
+        if isinstance(node, CallNode):
+            return self.call(node.func.name, tuple(self.eval(param, env) for param in node.params))
+        if isinstance(node, WhenExprNode):
+            return self.eval(self.when_branch(node, env).body, env)
+        raise NotConstantException('узел {} не вычисляется'.format(node))
+
+    @staticmethod
+    def eval_bin_op(node: BinOpNode, a: Any, b: Any) -> Any:
+        base_type = node.arg1.node_type.base_type
+        op = node.op
+        if op in (BinOp.GT, BinOp.LT, BinOp.GE, BinOp.LE) and base_type == BaseType.STR and \
+                any(ord(ch) > 0xFFFF for ch in a + b):
+            # сравнение строк ординальное по UTF-16, для символов вне BMP не совпадает со сравнением в python
+            raise NotConstantException('сравнение строк с символами вне BMP')
+        if op == BinOp.EQUALS:
+            return a == b
+        if op == BinOp.NEQUALS:
+            return a != b
+        if op == BinOp.GT:
+            return a > b
+        if op == BinOp.LT:
+            return a < b
+        if op == BinOp.GE:
+            return a >= b
+        if op == BinOp.LE:
+            return a <= b
+        if op == BinOp.LOGICAL_AND:
+            return a and b
+        if op == BinOp.LOGICAL_OR:
+            return a or b
+        if base_type == BaseType.INT:
+            if op in (BinOp.DIV, BinOp.MOD) and (b == 0 or (a == INT_MIN and b == -1)):
+                raise NotConstantException('исключение при делении')
+            if op == BinOp.ADD:
+                return to_int32(a + b)
+            if op == BinOp.SUB:
+                return to_int32(a - b)
+            if op == BinOp.MUL:
+                return to_int32(a * b)
+            # деление и остаток как в CLR/JVM (с округлением к нулю)
+            quot = abs(a) // abs(b) * (1 if (a < 0) == (b < 0) else -1)
+            if op == BinOp.DIV:
+                return quot
+            if op == BinOp.MOD:
+                return a - quot * b
+            if op == BinOp.BIT_AND:
+                return a & b
+            if op == BinOp.BIT_OR:
+                return a | b
+        elif base_type == BaseType.FLOAT:
+            if op == BinOp.ADD:
+                result = a + b
+            elif op == BinOp.SUB:
+                result = a - b
+            elif op == BinOp.MUL:
+                result = a * b
+            elif op == BinOp.DIV and b != 0:
+                result = a / b
+            elif op == BinOp.MOD and b != 0:
+                result = math.fmod(a, b)
+            else:
+                raise NotConstantException('операция {} не вычисляется'.format(op))
+            if not math.isfinite(result):
+                raise NotConstantException('результат не является конечным числом')
+            return result
+        elif base_type == BaseType.STR and op == BinOp.ADD:
+            return a + b
+        raise NotConstantException('операция {} не вычисляется'.format(op))
+
+    @staticmethod
+    def eval_convert(node: TypeConvertNode, value: Any) -> Any:
+        from_type, to_type = node.expr.node_type.base_type, node.node_type.base_type
+        if from_type == BaseType.INT and to_type == BaseType.FLOAT:
+            return float(value)
+        if from_type == BaseType.INT and to_type == BaseType.BOOL:
+            return value != 0
+        if from_type == BaseType.INT and to_type == BaseType.STR:
+            return str(value)
+        # форматирование Float и Boolean в строку определяется Runtime
+        raise NotConstantException('преобразование {} в {}'.format(from_type, to_type))
+
+    def when_branch(self, node: WhenNode, env: Dict[IdentDesc, Any]) -> Optional[WhenBranchNode]:
+        # условия проверяются по порядку до первого выполненного
+        value = self.eval(node.subject, env)
+        for branch in node.branches:
+            if not branch.conds:
+                return branch
+            for cond in branch.conds:
+                if isinstance(cond, WhenInNode):
+                    seq = cond.range
+                    start, end = self.eval(seq.startArg, env), self.eval(seq.endArg, env)
+                    if seq.seqOp == BinOp.DOWNTO:
+                        start, end = end, start
+                    elif seq.seqOp == BinOp.UNTIL:
+                        end -= 1
+                    if start <= value <= end:
+                        return branch
+                elif self.eval(cond, env) == value:
+                    return branch
+        return None
+
+    def call(self, name: str, args: Tuple[Any, ...]) -> Any:
+        key = (name, args)
+        if key in self.cache:
+            return self.cache[key]
+        func = self.funcs.get(name)
+        if func is None:
+            raise NotConstantException('функция {} не является чистой'.format(name))
+        if self.depth >= self.max_depth:
+            raise NotConstantException('превышена глубина рекурсии')
+        env = {param.name.node_ident: arg for param, arg in zip(func.params, args)}
+        self.depth += 1
+        try:
+            self.exec(func.body, env)
+            raise NotConstantException('функция {} завершилась без return'.format(name))
+        except _ReturnSignal as ret:
+            result = ret.value
+        finally:
+            self.depth -= 1
+        self.cache[key] = result
+        return result
+
+    def exec(self, node: AstNode, env: Dict[IdentDesc, Any]) -> None:
+        self.step()
+        if isinstance(node, StmtListNode):
+            for stmt in node.exprs:
+                self.exec(stmt, env)
+        elif isinstance(node, VarNode):
+            env[node.ident.node_ident] = self.eval(node.var, env)
+        elif isinstance(node, VarsNode):
+            for var in node.vars:
+                if isinstance(var, AssignNode):
+                    self.exec(var, env)
+                else:
+                    env[var.node_ident] = DEFAULT_VALUES[var.node_type.base_type]
+        elif isinstance(node, AssignNode):
+            env[node.var.node_ident] = self.eval(node.val, env)
+        elif isinstance(node, ReturnNode):
+            raise _ReturnSignal(self.eval(node.val, env))
+        elif isinstance(node, IfNode):
+            if self.eval(node.cond, env):
+                self.exec(node.then_stmt, env)
+            elif node.else_stmt:
+                self.exec(node.else_stmt, env)
+        elif isinstance(node, WhileNode):
+            while self.eval(node.cond, env):
+                self.exec(node.body, env)
+        elif isinstance(node, ForNode):
+            seq = node.range
+            start, end = self.eval(seq.startArg, env), self.eval(seq.endArg, env)
+            step = self.eval(seq.stepArg, env) if seq.stepArg is not None else 1
+            if step <= 0:
+                raise NotConstantException('исключение при построении диапазона')
+            if seq.seqOp == BinOp.DOWNTO:
+                values = range(start, end - 1, -step)
+            else:
+                values = range(start, end + (1 if seq.seqOp == BinOp.DOTS else 0), step)
+            for value in values:
+                env[node.ident.node_ident] = value
+                self.exec(node.body, env)
+        elif isinstance(node, DoWhileNode):
+            self.exec(node.body, env)
+            while self.eval(node.condition, env):
+                self.exec(node.body, env)
+        elif isinstance(node, WhenNode):
+            branch = self.when_branch(node, env)
+            if branch is not None:
+                self.exec(branch.body, env)
+        elif isinstance(node, CallNode):
+            self.eval(node, env)
+        else:
+            raise NotConstantException('инструкция {} не вычисляется'.format(node))
+
+
+def _make_literal(value: Any, node: CallNode) -> Optional[LiteralNode]:
+    if isinstance(value, bool):
+        literal = 'true' if value else 'false'
+    elif isinstance(value, int):
+        literal = str(value)
+    elif isinstance(value, float):
+        literal = repr(value)
+    elif isinstance(value, str):
+        # строка без спецсимволов, чтобы литерал совпадал со значением
+        if any(ch in value for ch in '"\\') or not value.isprintable():
+            return None
+        literal = '"{}"'.format(value)
+    else:
+        return None
+    result = LiteralNode(literal, row=node.row, col=node.col)
+    result.semantic_check(IdentScope())
+    return result if result.node_type == node.node_type else None
+
+
+def fold_calls(prog: StmtListNode, fuel: int = DEFAULT_FUEL, max_depth: int = DEFAULT_MAX_DEPTH) -> List[str]:
+    """Замена вызовов чистых функций с константными аргументами на литералы
+       (после семантического анализа)
+    :param prog: программа (корень AST-дерева)
+    :param fuel: ограничение кол-ва шагов вычисления одного вызова
+    :param max_depth: ограничение глубины вложенности вызовов
+    :return: отчет о выполненных (и невыполненных) заменах
+    """
+
+    funcs = {name: info.func for name, info in purity.analyze(prog).items() if info.pure}
+    report: List[str] = []
+    # кэш результатов общий, т.к. функции чистые
+    cache: Dict[Tuple[str, Tuple[Any, ...]], Any] = {}
+
+    def fold(node: AstNode) -> AstNode:
+        if not isinstance(node, CallNode) or node.func.name not in funcs:
+            return node
+        evaluator = Evaluator(funcs, fuel, max_depth)
+        evaluator.cache = cache
+        try:
+            args = tuple(evaluator.eval(param, {}) for param in node.params)
+        except NotConstantException:
+            return node
+        call_str = '{}({})'.format(node.func.name, ', '.join(repr(arg) for arg in args))
+        try:
+            value = evaluator.call(node.func.name, args)
+        except NotConstantException as e:
+            report.append('строка {}: {} не вычислен ({})'.format(node.row, call_str, e.message))
+            return node
+        except RecursionError:
+            report.append('строка {}: {} не вычислен (переполнение стека)'.format(node.row, call_str))
+            return node
+        literal = _make_literal(value, node)
+        if literal is None:
+            return node
+        report.append('строка {}: {} = {}'.format(node.row, call_str, literal))
+        return literal
+
+    prog.transform(fold)
+    return report
@@ -0,0 +1,56 @@
+from typing import Dict
+
+from .mel_ast import AstNode, StmtListNode, FuncNode, IdentNode, AssignNode, VarNode, ForNode
+from .semantic import IdentDesc, ScopeType
+
+
+class GlobalUsage:
+    """Использование глобальной переменной в функциях программы
+    """
+
+    def __init__(self, ident: IdentDesc) -> None:
+        self.ident = ident
+        self.read_in_funcs = False
+        self.written_in_funcs = False
+
+    @property
+    def escapes(self) -> bool:
+        """Переменная используется в функциях (не может быть локальной переменной Main)
+        """
+
+        return self.read_in_funcs or self.written_in_funcs
+
+
+def _is_global(ident: IdentDesc) -> bool:
+    return ident is not None and not ident.type.func and ident.scope in (ScopeType.GLOBAL, ScopeType.GLOBAL_LOCAL)
+
+
+def analyze_globals(prog: StmtListNode) -> Dict[IdentDesc, GlobalUsage]:
+    """Анализ "убегания" глобальных переменных программы в функции
+    :param prog: программа (корень AST-дерева, после семантического анализа)
+    :return: словарь описание переменной -> использование в функциях (в порядке объявления)
+    """
+
+    usages: Dict[IdentDesc, GlobalUsage] = {}
+
+    def find_globals(node: AstNode) -> None:
+        for n in (node.childs or []):
+            if isinstance(n, (VarNode, ForNode)) and _is_global(n.ident.node_ident):
+                usages[n.ident.node_ident] = GlobalUsage(n.ident.node_ident)
+            find_globals(n)
+
+    def find_uses(node: AstNode) -> None:
+        for n in (node.childs or []):
+            if isinstance(n, AssignNode) and n.var.node_ident in usages:
+                usages[n.var.node_ident].written_in_funcs = True
+                find_uses(n.val)
+                continue
+            if isinstance(n, IdentNode) and n.node_ident in usages:
+                usages[n.node_ident].read_in_funcs = True
+            find_uses(n)
+
+    find_globals(prog)
+    for stmt in prog.exprs:
+        if isinstance(stmt, FuncNode):
+            find_uses(stmt.body)
+    return usages
@@ -0,0 +1,997 @@
+from typing import List, Union, Any, Dict, Optional, Set, TextIO, Tuple
+
+from . import visitor
+from . import escape
+from . import split
+from . import switch
+from . import classfile
+from . import bounds as bounds_
+from . import parallel as parallel_
+from .classfile import StringConst
+from .code_buffer import CodeBuffer
+from .strings import flatten_concat, append_args, find_string_builders
+from .semantic import BaseType, TypeDesc, ScopeType, BinOp, IdentDesc
+from .mel_ast import AstNode, ExprNode, LiteralNode, IdentNode, BinOpNode, TypeConvertNode, CallNode, \
+    VarsNode, FuncNode, AssignNode, ReturnNode, IfNode, ForNode, StmtListNode, WhileNode, DoWhileNode, VarNode, SeqNode, \
+    StmtNode, WhenNode, WhenExprNode, WhenInNode, IndexNode, MemberNode, IndexAssignNode, ParallelForNode, \
+    ParallelReduceNode
+from .msil import find_vars_decls, get_progression_bounds
+
+RUNTIME_CLASS_NAME = 'CompilerDemo/Runtime'
+PROGRAM_CLASS_NAME = 'Program'
+# базовый класс среды выполнения для тел параллельных циклов (см. msil.PARALLEL_BODY_CLASS)
+PARALLEL_BODY_CLASS = 'CompilerDemo/ParallelBody'
+
+JVM_TYPE_DESCS = {
+    BaseType.VOID: 'V',
+    BaseType.INT: 'I',
+    BaseType.FLOAT: 'D',
+    BaseType.BOOL: 'Z',
+    BaseType.STR: 'Ljava/lang/String;'
+}
+
+# None - массив (base_type у типа массива не задан)
+LOAD_OPS = {BaseType.INT: 'iload', BaseType.FLOAT: 'dload', BaseType.BOOL: 'iload', BaseType.STR: 'aload',
+            None: 'aload'}
+STORE_OPS = {BaseType.INT: 'istore', BaseType.FLOAT: 'dstore', BaseType.BOOL: 'istore', BaseType.STR: 'astore',
+             None: 'astore'}
+RETURN_OPS = {BaseType.VOID: 'return', BaseType.INT: 'ireturn', BaseType.FLOAT: 'dreturn', BaseType.BOOL: 'ireturn',
+              BaseType.STR: 'areturn', None: 'areturn'}
+
+# операции с элементами массивов: тип элементов -> инструкция
+ARRAY_LOAD_OPS = {BaseType.INT: 'iaload', BaseType.FLOAT: 'daload', BaseType.BOOL: 'baload', BaseType.STR: 'aaload'}
+ARRAY_STORE_OPS = {BaseType.INT: 'iastore', BaseType.FLOAT: 'dastore', BaseType.BOOL: 'bastore',
+                   BaseType.STR: 'aastore'}
+ARRAYS_FILL = 'java/util/Arrays/fill([Ljava/lang/Object;Ljava/lang/Object;)V'
+
+# арифметические операции: операция -> (инструкция для Int/Boolean, для Float)
+ARITHMETIC_OPS = {
+    BinOp.ADD: ('iadd', 'dadd'),
+    BinOp.SUB: ('isub', 'dsub'),
+    BinOp.MUL: ('imul', 'dmul'),
+    BinOp.DIV: ('idiv', 'ddiv'),
+    BinOp.MOD: ('irem', 'drem'),
+    BinOp.BIT_AND: ('iand', 'iand'),
+    BinOp.BIT_OR: ('ior', 'ior'),
+}
+
+# условные переходы для сравнений двух Int: операция -> (переход, если условие истинно; если ложно)
+COMPARE_BRANCHES = {
+    BinOp.LT: ('if_icmplt', 'if_icmpge'),
+    BinOp.GT: ('if_icmpgt', 'if_icmple'),
+    BinOp.LE: ('if_icmple', 'if_icmpgt'),
+    BinOp.GE: ('if_icmpge', 'if_icmplt'),
+    BinOp.EQUALS: ('if_icmpeq', 'if_icmpne'),
+    BinOp.NEQUALS: ('if_icmpne', 'if_icmpeq'),
+}
+
+# то же для сравнения результата dcmpX, compareTo (или Int-значения) с нулем
+ZERO_COMPARE_BRANCHES = {
+    BinOp.LT: ('iflt', 'ifge'),
+    BinOp.GT: ('ifgt', 'ifle'),
+    BinOp.LE: ('ifle', 'ifgt'),
+    BinOp.GE: ('ifge', 'iflt'),
+    BinOp.EQUALS: ('ifeq', 'ifne'),
+    BinOp.NEQUALS: ('ifne', 'ifeq'),
+}
+
+# для Float результат сравнения с NaN выбирается так, чтобы условие было ложным (а его отрицание - истинным)
+FLOAT_COMPARE_OPS = {
+    BinOp.LT: 'dcmpg',
+    BinOp.LE: 'dcmpg',
+    BinOp.GT: 'dcmpl',
+    BinOp.GE: 'dcmpl',
+    BinOp.EQUALS: 'dcmpl',
+    BinOp.NEQUALS: 'dcmpl',
+}
+
+STRING_CLASS = 'java/lang/String'
+STRING_BUILDER_CLASS = 'java/lang/StringBuilder'
+STRING_EQUALS = 'java/util/Objects/equals(Ljava/lang/Object;Ljava/lang/Object;)Z'
+
+# встроенные операции, реализуемые напрямую вызовами стандартной библиотеки, а не через класс Runtime:
+# сигнатура метода Runtime -> инструкции (аргументы уже в стеке)
+INTRINSICS = {
+    'compare(Ljava/lang/String;Ljava/lang/String;)': (
+        ('invokevirtual', 'java/lang/String/compareTo(Ljava/lang/String;)I'),
+    ),
+    'convert(I)': (
+        ('invokestatic', 'java/lang/String/valueOf(I)Ljava/lang/String;'),
+    ),
+    'convert(D)': (
+        ('invokestatic', 'java/lang/String/valueOf(D)Ljava/lang/String;'),
+    ),
+    'convert(Z)': (
+        ('invokestatic', 'java/lang/String/valueOf(Z)Ljava/lang/String;'),
+    ),
+}
+
+# максимальный размер байт-кода метода, который компилирует JIT HotSpot (-XX:HugeMethodLimit),
+# поэтому Main разбивается на части не больше этого размера
+HUGE_METHOD_LIMIT = 8000
+
+
+class CodeLabel:
+    def __init__(self):
+        self.index = None
+
+    def __str__(self):
+        return f'L_{self.index}'
+
+
+def format_line(indent: str, code: str, params: Tuple[Any, ...], label: Optional[CodeLabel]) -> str:
+    line = ''
+    if label:
+        line += str(label) + ': '
+    line += indent + code
+    for p in params:
+        line += ' ' + str(p)
+    return line
+
+
+def parallel_class_name(node: ParallelForNode) -> str:
+    return PROGRAM_CLASS_NAME + node.func.name.name
+
+
+def jvm_type_desc(type_: TypeDesc) -> str:
+    if type_.array:
+        return '[' + jvm_type_desc(type_.elem_type)
+    return JVM_TYPE_DESCS[type_.base_type]
+
+
+def method_desc(ret_type: TypeDesc, *param_types: TypeDesc) -> str:
+    return f'({"".join(jvm_type_desc(t) for t in param_types)}){jvm_type_desc(ret_type)}'
+
+
+class CodeGenerator:
+    """Генерация байт-кода JVM (текст в синтаксисе, близком к Jasmin, из него же собираются class-файлы,
+       см. classfile.assemble)
+    """
+
+    def __init__(self, promote_globals: bool = True, string_builders: bool = True,
+                 main_part_size: int = split.DEFAULT_PART_SIZE, buffered_output: bool = True):
+        self.code_lines = CodeBuffer(format_line)
+        self.indent = ''
+        self.promote_globals = promote_globals
+        # глобальные переменные, хранящиеся в main в локальных переменных (-> номер переменной),
+        # для "зеркалируемых" (читаемых в функциях) значение также записывается в поле
+        self.main_slots: Dict[IdentDesc, int] = {}
+        self.mirrored: Set[IdentDesc] = set()
+        self.in_main = False
+        # номера локальных переменных и параметров текущего метода (Float занимает два номера)
+        self.var_slots: Dict[IdentDesc, int] = {}
+        self.next_slot = 0
+        self.ret_type = BaseType.VOID
+        self.string_builders = string_builders
+        self.builder_loops: Dict[AstNode, List[IdentDesc]] = {}
+        self.builders: Dict[IdentDesc, int] = {}
+        self.main_part_size = min(main_part_size, HUGE_METHOD_LIMIT) if main_part_size else 0
+        self.buffered_output = buffered_output
+        self.parallel_loops: List[ParallelForNode] = []
+        self.report: List[str] = []
+
+    def add(self, code: str, *params: Union[str, int, float, CodeLabel], label: CodeLabel = None):
+        if code.startswith('.end'):
+            self.indent = self.indent[2:]
+        self.code_lines.add(self.indent + str(code), *params, label=label)
+        if code.startswith('.method'):
+            self.indent = self.indent + '  '
+
+    @property
+    def code(self) -> [str, ...]:
+        return list(self.code_lines.text())
+
+    def write(self, out: TextIO) -> None:
+        self.code_lines.write(out)
+
+    def class_files(self) -> Dict[str, bytes]:
+        """Сборка class-файлов программы (имя класса -> содержимое)
+        """
+
+        return classfile.assemble(self.code_lines)
+
+    def start(self) -> None:
+        self.add('.class public', PROGRAM_CLASS_NAME)
+        self.add('.super', classfile.OBJECT_CLASS)
+
+    def begin_method(self, access: str, name: str, desc: str, params: List[Tuple[IdentDesc, BaseType]]) -> None:
+        self.add(f'.method {access}', f'{name}{desc}')
+        self.var_slots = {}
+        self.next_slot = 0
+        for ident, base_type in params:
+            if ident is None:
+                self.add_local(base_type)
+            else:
+                self.var_slots[ident] = self.add_local(base_type)
+
+    def end_method(self) -> None:
+        self.add('.end method')
+
+    def add_local(self, base_type: Optional[BaseType]) -> int:
+        """Новая локальная переменная (None - ссылка на объект, кроме String)
+        """
+
+        index = self.next_slot
+        self.next_slot += 2 if base_type == BaseType.FLOAT else 1
+        return index
+
+    @visitor.on('AstNode')
+    def jbc_gen(self, AstNode):
+        """
+        Нужен для работы модуля visitor (инициализации диспетчера)
+        """
+        pass
+
+    @visitor.when(LiteralNode)
+    def jbc_gen(self, node: LiteralNode) -> None:
+        if node.node_type.base_type == BaseType.INT:
+            self.add('ldc', node.value)
+        elif node.node_type.base_type == BaseType.FLOAT:
+            self.add('ldc', float(node.value))
+        elif node.node_type.base_type == BaseType.BOOL:
+            self.add('ldc', 1 if node.value else 0)
+        elif node.node_type.base_type == BaseType.STR:
+            self.add('ldc', StringConst(node.value))
+        else:
+            pass
+
+    @visitor.when(IdentNode)
+    def jbc_gen(self, node: IdentNode) -> None:
+        self.jbc_gen_load(node.node_ident)
+
+    def field_ref(self, ident: IdentDesc) -> str:
+        return f'{PROGRAM_CLASS_NAME}/_gv{ident.index} {jvm_type_desc(ident.type)}'
+
+    def jbc_gen_load(self, ident: IdentDesc) -> None:
+        base_type = ident.type.base_type
+        if ident.scope in (ScopeType.LOCAL, ScopeType.PARAM):
+            self.add(LOAD_OPS[base_type], self.var_slots[ident])
+        elif ident.scope in (ScopeType.GLOBAL, ScopeType.GLOBAL_LOCAL):
+            if self.in_main and ident in self.main_slots:
+                self.add(LOAD_OPS[base_type], self.main_slots[ident])
+            else:
+                self.add('getstatic', self.field_ref(ident))
+
+    def jbc_gen_store(self, ident: IdentDesc) -> None:
+        base_type = ident.type.base_type
+        if ident.scope in (ScopeType.LOCAL, ScopeType.PARAM):
+            self.add(STORE_OPS[base_type], self.var_slots[ident])
+        elif ident.scope in (ScopeType.GLOBAL, ScopeType.GLOBAL_LOCAL):
+            if self.in_main and ident in self.main_slots:
+                if ident in self.mirrored:
+                    self.add('dup2' if base_type == BaseType.FLOAT else 'dup')
+                    self.add('putstatic', self.field_ref(ident))
+                self.add(STORE_OPS[base_type], self.main_slots[ident])
+            else:
+                self.add('putstatic', self.field_ref(ident))
+
+    def local_slot(self, ident: IdentDesc) -> Optional[int]:
+        """Номер локальной переменной, в которой хранится значение (None - значение хранится в поле
+           или должно записываться и в поле)
+        """
+
+        if ident.scope in (ScopeType.LOCAL, ScopeType.PARAM):
+            return self.var_slots[ident]
+        if self.in_main and ident in self.main_slots and ident not in self.mirrored:
+            return self.main_slots[ident]
+        return None
+
+    @visitor.when(AssignNode)
+    def jbc_gen(self, node: AssignNode) -> None:
+        ident = node.var.node_ident
+        if ident in self.builders:
+            # в цикле к переменной значения только добавляются (см. strings.find_string_builders)
+            self.add('aload', self.builders[ident])
+            for arg in append_args(node, ident):
+                self.jbc_gen(arg)
+                self.add('invokevirtual', f'{STRING_BUILDER_CLASS}/append(Ljava/lang/String;)L{STRING_BUILDER_CLASS};')
+            self.add('pop')
+            return
+        self.jbc_gen(node.val)
+        self.jbc_gen_store(node.var.node_ident)
+
+    @visitor.when(VarsNode)
+    def jbc_gen(self, node: VarsNode) -> None:
+        for var in node.vars:
+            if isinstance(var, AssignNode):
+                self.jbc_gen(var)
+
+    @visitor.when(VarNode)
+    def jbc_gen(self, node: VarNode):
+        if node.var is not None:
+            self.jbc_gen(node.var)
+            self.jbc_gen_store(node.ident.node_ident)
+
+    def jbc_gen_runtime_call(self, ret_type: BaseType, name: str, *param_types: BaseType) -> None:
+        """Вызов метода класса Runtime (или соответствующей ему встроенной операции из INTRINSICS)
+        """
+
+        signature = f'{name}({"".join(JVM_TYPE_DESCS[t] for t in param_types)})'
+        if signature in INTRINSICS:
+            for code, param in INTRINSICS[signature]:
+                self.add(code, param)
+        else:
+            self.add('invokestatic', f'{RUNTIME_CLASS_NAME}/{signature}{JVM_TYPE_DESCS[ret_type]}')
+
+    def jbc_gen_bool(self, node: ExprNode) -> None:
+        """Значение условия (0 или 1) через условный переход
+        """
+
+        false_label = CodeLabel()
+        end_label = CodeLabel()
+        self.jbc_gen_cond(node, false_label, False)
+        self.add('ldc', 1)
+        self.add('goto', end_label)
+        self.add('', label=false_label)
+        self.add('ldc', 0)
+        self.add('', label=end_label)
+
+    @visitor.when(BinOpNode)
+    def jbc_gen(self, node: BinOpNode) -> None:
+        if node.op in (BinOp.EQUALS, BinOp.NEQUALS) and node.arg1.node_type == TypeDesc.STR:
+            self.jbc_gen(node.arg1)
+            self.jbc_gen(node.arg2)
+            self.add('invokestatic', STRING_EQUALS)
+            if node.op == BinOp.NEQUALS:
+                self.add('ldc', 1)
+                self.add('ixor')
+            return
+        if node.op in (BinOp.LOGICAL_AND, BinOp.LOGICAL_OR) or node.op in COMPARE_BRANCHES:
+            # в JVM нет инструкций сравнения, возвращающих значение
+            self.jbc_gen_bool(node)
+            return
+        if node.op == BinOp.ADD and node.node_type == TypeDesc.STR:
+            self.jbc_gen_concat(flatten_concat(node))
+            return
+
+        self.jbc_gen(node.arg1)
+        self.jbc_gen(node.arg2)
+        if node.op in ARITHMETIC_OPS:
+            self.add(ARITHMETIC_OPS[node.op][1 if node.node_type == TypeDesc.FLOAT else 0])
+
+    def jbc_gen_concat(self, args: List[ExprNode]) -> None:
+        """Конкатенация строк через StringBuilder (без промежуточных строк)
+        """
+
+        self.add('new', STRING_BUILDER_CLASS)
+        self.add('dup')
+        self.add('invokespecial', f'{STRING_BUILDER_CLASS}/<init>()V')
+        for arg in args:
+            self.jbc_gen(arg)
+            self.add('invokevirtual', f'{STRING_BUILDER_CLASS}/append(Ljava/lang/String;)L{STRING_BUILDER_CLASS};')
+        self.add('invokevirtual', f'{STRING_BUILDER_CLASS}/toString()Ljava/lang/String;')
+
+    @visitor.when(TypeConvertNode)
+    def jbc_gen(self, node: TypeConvertNode) -> None:
+        if node.node_type.base_type == BaseType.FLOAT and node.expr.node_type.base_type == BaseType.INT:
+            self.jbc_gen(node.expr)
+            self.add('i2d')
+        elif node.node_type.base_type == BaseType.BOOL and node.expr.node_type.base_type == BaseType.INT:
+            self.jbc_gen_bool(node)
+        else:
+            self.jbc_gen(node.expr)
+            self.jbc_gen_runtime_call(node.node_type.base_type, 'convert', node.expr.node_type.base_type)
+
+    @visitor.when(IndexNode)
+    def jbc_gen(self, node: IndexNode) -> None:
+        self.jbc_gen(node.array)
+        self.jbc_gen(node.index)
+        self.add(ARRAY_LOAD_OPS[node.node_type.base_type])
+
+    @visitor.when(IndexAssignNode)
+    def jbc_gen(self, node: IndexAssignNode) -> None:
+        self.jbc_gen(node.target.array)
+        self.jbc_gen(node.target.index)
+        self.jbc_gen(node.val)
+        self.add(ARRAY_STORE_OPS[node.val.node_type.base_type])
+
+    @visitor.when(MemberNode)
+    def jbc_gen(self, node: MemberNode) -> None:
+        # единственное свойство - size у массива
+        self.jbc_gen(node.obj)
+        self.add('arraylength')
+
+    def jbc_gen_new_array(self, elem_type: TypeDesc) -> None:
+        """Создание массива (размер - на вершине стека)
+        """
+
+        if elem_type.base_type != BaseType.STR:
+            self.add('newarray', JVM_TYPE_DESCS[elem_type.base_type])
+            return
+        # элементы Array<String> - пустые строки (а не null)
+        self.add('anewarray', STRING_CLASS)
+        self.add('dup')
+        self.add('ldc', StringConst(''))
+        self.add('invokestatic', ARRAYS_FILL)
+
+    @visitor.when(CallNode)
+    def jbc_gen(self, node: CallNode) -> None:
+        for param in node.params:
+            self.jbc_gen(param)
+        if node.func.node_ident.built_in and node.node_type.array:
+            self.jbc_gen_new_array(node.node_type.elem_type)
+            return
+        if node.func.node_ident.built_in:
+            self.jbc_gen_runtime_call(node.node_type.base_type, node.func.name,
+                                      *(param.node_type.base_type for param in node.params))
+            return
+        desc = method_desc(node.node_type, *(param.node_type for param in node.params))
+        self.add('invokestatic', f'{PROGRAM_CLASS_NAME}/{node.func.name}{desc}')
+
+    @visitor.when(ReturnNode)
+    def jbc_gen(self, node: ReturnNode) -> None:
+        self.jbc_gen(node.val)
+        self.add(RETURN_OPS[self.ret_type])
+
+    def jbc_gen_stmt(self, stmt: AstNode) -> None:
+        """Оператор (значение вызова функции, используемого как оператор, снимается со стека)
+        """
+
+        self.jbc_gen(stmt)
+        if isinstance(stmt, CallNode) and stmt.node_type.base_type != BaseType.VOID:
+            self.add('pop2' if stmt.node_type.base_type == BaseType.FLOAT else 'pop')
+
+    def jbc_gen_cond(self, node: ExprNode, label: CodeLabel, jump_if: bool) -> None:
+        """Генерация условного перехода на label, если значение условия node равно jump_if
+           (&& и || вычисляются по короткой схеме, сравнения объединяются с переходом)
+        """
+
+        if isinstance(node, BinOpNode) and node.op in (BinOp.LOGICAL_AND, BinOp.LOGICAL_OR):
+            # для && сразу выполняется переход по false, для || - по true
+            direct = node.op == BinOp.LOGICAL_OR
+            if jump_if == direct:
+                self.jbc_gen_cond(node.arg1, label, jump_if)
+                self.jbc_gen_cond(node.arg2, label, jump_if)
+            else:
+                skip_label = CodeLabel()
+                self.jbc_gen_cond(node.arg1, skip_label, not jump_if)
+                self.jbc_gen_cond(node.arg2, label, jump_if)
+                self.add('', label=skip_label)
+        elif isinstance(node, BinOpNode) and node.op in COMPARE_BRANCHES:
+            arg_type = node.arg1.node_type.base_type
+            branch = 0 if jump_if else 1
+            self.jbc_gen(node.arg1)
+            if arg_type in (BaseType.INT, BaseType.BOOL) and isinstance(node.arg2, LiteralNode) and not node.arg2.value:
+                # сравнение с нулем - одной инструкцией
+                self.add(ZERO_COMPARE_BRANCHES[node.op][branch], label)
+                return
+            self.jbc_gen(node.arg2)
+            if arg_type == BaseType.STR:
+                if node.op in (BinOp.EQUALS, BinOp.NEQUALS):
+                    self.add('invokestatic', STRING_EQUALS)
+                    self.add('ifne' if jump_if == (node.op == BinOp.EQUALS) else 'ifeq', label)
+                    return
+                self.jbc_gen_runtime_call(BaseType.INT, 'compare', BaseType.STR, BaseType.STR)
+                self.add(ZERO_COMPARE_BRANCHES[node.op][branch], label)
+            elif arg_type == BaseType.FLOAT:
+                self.add(FLOAT_COMPARE_OPS[node.op])
+                self.add(ZERO_COMPARE_BRANCHES[node.op][branch], label)
+            else:
+                self.add(COMPARE_BRANCHES[node.op][branch], label)
+        elif isinstance(node, TypeConvertNode) and node.node_type.base_type == BaseType.BOOL and \
+                node.expr.node_type.base_type == BaseType.INT:
+            self.jbc_gen(node.expr)
+            self.add('ifne' if jump_if else 'ifeq', label)
+        elif isinstance(node, LiteralNode):
+            if node.value == jump_if:
+                self.add('goto', label)
+        else:
+            self.jbc_gen(node)
+            self.add('ifne' if jump_if else 'ifeq', label)
+
+    def jbc_gen_builders_begin(self, loop: AstNode) -> None:
+        for ident in self.builder_loops.get(loop, []):
+            self.builders[ident] = self.add_local(None)
+            self.add('new', STRING_BUILDER_CLASS)
+            self.add('dup')
+            self.jbc_gen_load(ident)
+            self.add('invokespecial', f'{STRING_BUILDER_CLASS}/<init>(Ljava/lang/String;)V')
+            self.add('astore', self.builders[ident])
+
+    def jbc_gen_builders_end(self, loop: AstNode) -> None:
+        for ident in self.builder_loops.get(loop, []):
+            self.add('aload', self.builders.pop(ident))
+            self.add('invokevirtual', f'{STRING_BUILDER_CLASS}/toString()Ljava/lang/String;')
+            self.jbc_gen_store(ident)
+
+    @visitor.when(IfNode)
+    def jbc_gen(self, node: IfNode) -> None:
+        else_label = CodeLabel()
+        end_label = CodeLabel()
+
+        self.jbc_gen_cond(node.cond, else_label, False)
+        self.jbc_gen_stmt(node.then_stmt)
+        if node.else_stmt:
+            self.add('goto', end_label)
+        self.add('', label=else_label)
+        if node.else_stmt:
+            self.jbc_gen_stmt(node.else_stmt)
+            self.add('', label=end_label)
+
+    @visitor.when(WhileNode)
+    def jbc_gen(self, node: WhileNode) -> None:
+        # цикл "переворачивается" (см. msil.CodeGenerator)
+        body_label = CodeLabel()
+        end_label = CodeLabel()
+        self.jbc_gen_builders_begin(node)
+        self.jbc_gen_cond(node.cond, end_label, False)
+        self.add('', label=body_label)
+        if node.body is not None:
+            self.jbc_gen_stmt(node.body)
+        self.jbc_gen_cond(node.cond, body_label, True)
+        self.add('', label=end_label)
+        self.jbc_gen_builders_end(node)
+
+    @visitor.when(DoWhileNode)
+    def jbc_gen(self, node: DoWhileNode) -> None:
+        body_label = CodeLabel()
+        self.jbc_gen_builders_begin(node)
+        self.add('', label=body_label)
+        self.jbc_gen_stmt(node.body)
+        self.jbc_gen_cond(node.condition, body_label, True)
+        self.jbc_gen_builders_end(node)
+
+    @visitor.when(ForNode)
+    def jbc_gen(self, node: ForNode) -> None:
+        # счетчик, последнее значение и шаг - как в msil.CodeGenerator
+        seq: SeqNode = node.range
+        ident = node.ident.node_ident
+        down = seq.seqOp == BinOp.DOWNTO
+        step = seq.stepArg.value if isinstance(seq.stepArg, LiteralNode) else None if seq.stepArg else 1
+        body_label = CodeLabel()
+        end_label = CodeLabel()
+
+        array = bounds_.indexed_array(node)
+        if array is not None and (array.scope in (ScopeType.LOCAL, ScopeType.PARAM) or
+                                  (self.in_main and array in self.main_slots)):
+            self.jbc_gen_array_for(node, array)
+            return
+
+        bounds = None
+        if isinstance(seq.startArg, LiteralNode) and isinstance(seq.endArg, LiteralNode) and step is not None:
+            bounds = get_progression_bounds(seq.startArg.value, seq.endArg.value, step, seq.seqOp)
+            if bounds is None:
+                # пустой диапазон
+                return
+
+        self.jbc_gen_builders_begin(node)
+        self.jbc_gen(seq.startArg)
+        self.jbc_gen_store(ident)
+        if bounds is not None:
+            last = None
+        else:
+            last = self.add_local(BaseType.INT)
+            self.jbc_gen(seq.endArg)
+            self.add('istore', last)
+        step_local = None
+        if step is None:
+            step_local = self.add_local(BaseType.INT)
+            step_ok_label = CodeLabel()
+            self.jbc_gen(seq.stepArg)
+            self.add('dup')
+            self.add('istore', step_local)
+            self.add('ifgt', step_ok_label)
+            self.add('new', 'java/lang/IllegalArgumentException')
+            self.add('dup')
+            self.add('ldc', StringConst('Step must be positive.'))
+            self.add('invokespecial', 'java/lang/IllegalArgumentException/<init>(Ljava/lang/String;)V')
+            self.add('athrow')
+            self.add('', label=step_ok_label)
+
+        def load_step():
+            if step_local is None:
+                self.add('ldc', step)
+            else:
+                self.add('iload', step_local)
+
+        if last is not None:
+            # пустой диапазон; для until граница не входит в диапазон
+            self.jbc_gen_load(ident)
+            self.add('iload', last)
+            self.add('if_icmpge' if seq.seqOp == BinOp.UNTIL else 'if_icmplt' if down else 'if_icmpgt', end_label)
+            if seq.seqOp == BinOp.UNTIL:
+                self.add('iinc', last, -1)
+            if step != 1:
+                # последнее значение: граница минус остаток от деления длины диапазона на шаг (без знака)
+                self.add('iload', last)
+                if down:
+                    self.jbc_gen_load(ident)
+                    self.add('iload', last)
+                else:
+                    self.add('iload', last)
+                    self.jbc_gen_load(ident)
+                self.add('isub')
+                load_step()
+                self.add('invokestatic', 'java/lang/Integer/remainderUnsigned(II)I')
+                self.add('iadd' if down else 'isub')
+                self.add('istore', last)
+
+        self.add('', label=body_label)
+        self.jbc_gen_stmt(node.body)
+        # значение до изменения сравнивается с последним
+        self.jbc_gen_load(ident)
+        slot = self.local_slot(ident)
+        if slot is not None and step_local is None and -0x8000 <= step <= 0x7FFF:
+            self.add('iinc', slot, -step if down else step)
+        else:
+            self.add('dup')
+            load_step()
+            self.add('isub' if down else 'iadd')
+            self.jbc_gen_store(ident)
+        if last is None:
+            self.add('ldc', bounds[1])
+        else:
+            self.add('iload', last)
+        self.add('if_icmpne', body_label)
+        self.add('', label=end_label)
+        self.jbc_gen_builders_end(node)
+
+    def jbc_gen_array_for(self, node: ForNode, array: IdentDesc) -> None:
+        """Цикл по индексам массива (см. bounds.indexed_array) в виде for (i = start; i < a.length; i++),
+           для которого JIT исключает проверки границ при обращении к a[i]
+        """
+
+        ident = node.ident.node_ident
+        body_label = CodeLabel()
+        cond_label = CodeLabel()
+        self.jbc_gen_builders_begin(node)
+        self.jbc_gen(node.range.startArg)
+        self.jbc_gen_store(ident)
+        self.add('goto', cond_label)
+        self.add('', label=body_label)
+        self.jbc_gen_stmt(node.body)
+        slot = self.local_slot(ident)
+        if slot is not None:
+            self.add('iinc', slot, 1)
+        else:
+            self.jbc_gen_load(ident)
+            self.add('ldc', 1)
+            self.add('iadd')
+            self.jbc_gen_store(ident)
+        self.add('', label=cond_label)
+        self.jbc_gen_load(ident)
+        self.jbc_gen_load(array)
+        self.add('arraylength')
+        self.add('if_icmplt', body_label)
+        self.jbc_gen_builders_end(node)
+
+    @visitor.when(ParallelForNode)
+    def jbc_gen(self, node: ParallelForNode) -> None:
+        body = self.jbc_gen_parallel(node)
+        self.add('pop')
+        self.add('aload', body)
+        self.add('invokevirtual', f'{PARALLEL_BODY_CLASS}/execute()V')
+
+    @visitor.when(ParallelReduceNode)
+    def jbc_gen(self, node: ParallelReduceNode) -> None:
+        # как в msil.CodeGenerator: результаты частей диапазона сворачиваются функцией node.fold
+        cls = parallel_class_name(node)
+        results_desc = jvm_type_desc(TypeDesc.array_of(node.node_type))
+        body = self.jbc_gen_parallel(node)
+        count = self.add_local(BaseType.INT)
+        self.add('istore', count)
+        if node.op != parallel_.SUM:
+            not_empty_label = CodeLabel()
+            self.add('iload', count)
+            self.add('ifne', not_empty_label)
+            self.add('new', 'java/util/NoSuchElementException')
+            self.add('dup')
+            self.add('ldc', StringConst('Range is empty.'))
+            self.add('invokespecial', 'java/util/NoSuchElementException/<init>(Ljava/lang/String;)V')
+            self.add('athrow')
+            self.add('', label=not_empty_label)
+        self.add('aload', body)
+        self.add('iload', count)
+        self.jbc_gen_new_array(node.node_type)
+        self.add('putfield', f'{cls}/_results {results_desc}')
+        self.add('aload', body)
+        self.add('invokevirtual', f'{PARALLEL_BODY_CLASS}/execute()V')
+        self.add('aload', body)
+        self.add('getfield', f'{cls}/_results {results_desc}')
+        self.add('invokestatic', f'{PROGRAM_CLASS_NAME}/{node.fold.name.name}' +
+                 method_desc(node.node_type, TypeDesc.array_of(node.node_type)))
+
+    def jbc_gen_parallel(self, node: ParallelForNode) -> int:
+        """Создание объекта с телом параллельного цикла, разбиение диапазона и запись захваченных значений
+           (см. msil.CodeGenerator.msil_gen_parallel)
+        :return: номер локальной переменной с объектом (кол-во частей диапазона остается на вершине стека)
+        """
+
+        if node not in self.parallel_loops:
+            self.parallel_loops.append(node)
+        cls = parallel_class_name(node)
+        body = self.add_local(None)
+        self.add('new', cls)
+        self.add('dup')
+        self.add('invokespecial', f'{cls}/<init>()V')
+        self.add('astore', body)
+        self.add('aload', body)
+        self.jbc_gen(node.range.startArg)
+        self.jbc_gen(node.range.endArg)
+        self.add('ldc', 1 if node.range.seqOp == BinOp.UNTIL else 0)
+        self.add('invokevirtual', f'{PARALLEL_BODY_CLASS}/split(IIZ)I')
+        for k, param in enumerate(node.call.params):
+            self.add('aload', body)
+            self.jbc_gen(param)
+            self.add('putfield', f'{cls}/_c{k} {jvm_type_desc(param.node_type)}')
+        return body
+
+    def jbc_gen_parallel_class(self, node: ParallelForNode) -> None:
+        """Класс-наследник ParallelBody для параллельного цикла (см. msil.CodeGenerator.msil_gen_parallel_class)
+        """
+
+        cls = parallel_class_name(node)
+        func = node.func
+        reduce = isinstance(node, ParallelReduceNode)
+        results_desc = jvm_type_desc(TypeDesc.array_of(node.node_type)) if reduce else None
+        captured = func.params[:-2]
+        self.add('.class public final', cls)
+        self.add('.super', PARALLEL_BODY_CLASS)
+        for k, param in enumerate(captured):
+            self.add('.field public', f'_c{k}', jvm_type_desc(param.type.type))
+        if reduce:
+            self.add('.field public', '_results', results_desc)
+        self.begin_method('public', '<init>', '()V', [(None, None)])
+        self.add('aload', 0)
+        self.add('invokespecial', f'{PARALLEL_BODY_CLASS}/<init>()V')
+        self.add('return')
+        self.end_method()
+        self.begin_method('protected', 'run', '(III)V', [(None, None)])
+        if reduce:
+            self.add('aload', 0)
+            self.add('getfield', f'{cls}/_results {results_desc}')
+            self.add('iload', 1)
+        for k, param in enumerate(captured):
+            self.add('aload', 0)
+            self.add('getfield', f'{cls}/_c{k} {jvm_type_desc(param.type.type)}')
+        self.add('iload', 2)
+        self.add('iload', 3)
+        self.add('invokestatic', f'{PROGRAM_CLASS_NAME}/{func.name.name}' +
+                 method_desc(func.type.type, *(p.type.type for p in func.params)))
+        if reduce:
+            self.add(ARRAY_STORE_OPS[node.node_type.base_type])
+        self.add('return')
+        self.end_method()
+
+    @visitor.when(WhenNode)
+    def jbc_gen(self, node: WhenNode) -> None:
+        self.jbc_gen_when(node)
+
+    @visitor.when(WhenExprNode)
+    def jbc_gen(self, node: WhenExprNode) -> None:
+        self.jbc_gen_when(node)
+
+    def jbc_gen_when(self, node: WhenNode) -> None:
+        """Генерация when (см. msil.CodeGenerator.msil_gen_when): ветвь выбирается инструкциями
+           tableswitch/lookupswitch и/или бинарным поиском, для строк - по String.hashCode()
+        """
+
+        subject_type = node.subject.node_type.base_type
+        subject = self.add_local(subject_type)
+        self.jbc_gen(node.subject)
+        self.add(STORE_OPS[subject_type], subject)
+        labels = [CodeLabel() for _ in node.branches]
+        end_label = CodeLabel()
+        default_label = labels[-1] if node.else_branch else end_label
+        cases = [(cond, label) for branch, label in zip(node.branches, labels) for cond in branch.conds]
+
+        if subject_type == BaseType.INT and all(switch.cond_bounds(cond) is not None for cond, _ in cases):
+            intervals = [(*switch.cond_bounds(cond), label) for cond, label in cases]
+            self.jbc_gen_int_dispatch(subject, switch.case_intervals(intervals), default_label)
+        elif subject_type == BaseType.STR and all(isinstance(cond, LiteralNode) for cond, _ in cases) and \
+                len({cond.value for cond, _ in cases}) >= switch.STRING_HASH_MIN_CASES:
+            self.jbc_gen_string_dispatch(subject, [(cond.value, label) for cond, label in cases], default_label)
+        else:
+            for cond, label in cases:
+                self.jbc_gen_when_cond(subject, subject_type, cond, label)
+            self.add('goto', default_label)
+
+        for branch, label in zip(node.branches, labels):
+            self.add('', label=label)
+            if isinstance(node, WhenExprNode):
+                self.jbc_gen(branch.body)
+            else:
+                self.jbc_gen_stmt(branch.body)
+            self.add('goto', end_label)
+        self.add('', label=end_label)
+
+    def jbc_gen_when_cond(self, subject: int, subject_type: BaseType, cond: ExprNode, label: CodeLabel) -> None:
+        """Переход на label, если значение переменной subject удовлетворяет условию ветви when
+        """
+
+        if isinstance(cond, WhenInNode):
+            seq = cond.range
+            down = seq.seqOp == BinOp.DOWNTO
+            skip_label = CodeLabel()
+            self.add('iload', subject)
+            self.jbc_gen(seq.startArg)
+            self.add('if_icmpgt' if down else 'if_icmplt', skip_label)
+            self.add('iload', subject)
+            self.jbc_gen(seq.endArg)
+            self.add('if_icmpge' if down else 'if_icmplt' if seq.seqOp == BinOp.UNTIL else 'if_icmple', label)
+            self.add('', label=skip_label)
+        else:
+            self.add(LOAD_OPS[subject_type], subject)
+            self.jbc_gen(cond)
+            if subject_type == BaseType.STR:
+                self.add('invokestatic', STRING_EQUALS)
+                self.add('ifne', label)
+            elif subject_type == BaseType.FLOAT:
+                self.add('dcmpl')
+                self.add('ifeq', label)
+            else:
+                self.add('if_icmpeq', label)
+
+    def jbc_gen_int_dispatch(self, subject: int, intervals: List[switch.Interval], default_label: CodeLabel) -> None:
+        """Переход на ветвь по значению Int-переменной subject (интервалы - см. switch.case_intervals):
+           плотные значения - tableswitch, отдельные значения - lookupswitch, иначе - бинарный поиск
+        """
+
+        if switch.is_dense(intervals):
+            lo = intervals[0][0]
+            table = [default_label] * (intervals[-1][1] - lo + 1)
+            for a, b, label in intervals:
+                for value in range(a, b + 1):
+                    table[value - lo] = label
+            self.add('iload', subject)
+            self.add('tableswitch', lo, default_label, *table)
+        elif len(intervals) > switch.LINEAR_MAX_CASES and all(a == b for a, b, _ in intervals):
+            self.add('iload', subject)
+            self.add('lookupswitch', default_label, *(p for a, _, label in intervals for p in (a, label)))
+        elif len(intervals) <= switch.LINEAR_MAX_CASES:
+            for a, b, label in intervals:
+                self.add('iload', subject)
+                if a == b:
+                    self.add('ldc', a)
+                    self.add('if_icmpeq', label)
+                else:
+                    # a <= x <= b  <=>  (x - a) <= (b - a) без знака (сравнение со сдвигом на Int.MIN_VALUE)
+                    if a != 0:
+                        self.add('ldc', a)
+                        self.add('isub')
+                    self.add('ldc', -0x80000000)
+                    self.add('ixor')
+                    self.add('ldc', switch.to_int32((b - a) ^ 0x80000000))
+                    self.add('if_icmple', label)
+            self.add('goto', default_label)
+        else:
+            mid = len(intervals) // 2
+            right_label = CodeLabel()
+            self.add('iload', subject)
+            self.add('ldc', intervals[mid][0])
+            self.add('if_icmpge', right_label)
+            self.jbc_gen_int_dispatch(subject, intervals[:mid], default_label)
+            self.add('', label=right_label)
+            self.jbc_gen_int_dispatch(subject, intervals[mid:], default_label)
+
+    def jbc_gen_string_dispatch(self, subject: int, cases: List[Tuple[str, CodeLabel]],
+                                default_label: CodeLabel) -> None:
+        """Переход на ветвь по значению String-переменной subject: выбор группы строк по String.hashCode()
+           (см. jbc_gen_int_dispatch), затем сравнение со строками группы
+        """
+
+        buckets = switch.string_buckets(cases, switch.java_string_hash)
+        bucket_labels = {h: CodeLabel() for h in buckets}
+        hash_local = self.add_local(BaseType.INT)
+        self.add('aload', subject)
+        self.add('invokevirtual', f'{STRING_CLASS}/hashCode()I')
+        self.add('istore', hash_local)
+        self.jbc_gen_int_dispatch(hash_local, switch.case_intervals(
+            [(h, h, label) for h, label in bucket_labels.items()]), default_label)
+        for h, bucket in buckets.items():
+            self.add('', label=bucket_labels[h])
+            for value, label in bucket:
+                self.add('ldc', StringConst(value))
+                self.add('aload', subject)
+                self.add('invokevirtual', f'{STRING_CLASS}/equals(Ljava/lang/Object;)Z')
+                self.add('ifne', label)
+            self.add('goto', default_label)
+
+    @visitor.when(FuncNode)
+    def jbc_gen(self, func: FuncNode) -> None:
+        self.ret_type = func.type.type.base_type
+        param_types = [p.type.type for p in func.params]
+        self.begin_method('public static', func.name.name, method_desc(func.type.type, *param_types),
+                          [(p.name.node_ident, t.base_type) for p, t in zip(func.params, param_types)])
+        local_idents = sorted((ident for ident in find_vars_decls(func) if ident.scope == ScopeType.LOCAL),
+                              key=lambda ident: ident.index)
+        for ident in local_idents:
+            self.var_slots[ident] = self.add_local(ident.type.base_type)
+        self.jbc_gen_stmt(func.body)
+        if self.ret_type == BaseType.VOID:
+            self.add('return')
+        self.end_method()
+
+    @visitor.when(StmtListNode)
+    def jbc_gen(self, node: StmtListNode) -> None:
+        for stmt in node.exprs:
+            self.jbc_gen_stmt(stmt)
+
+    def jbc_gen_program(self, prog: StmtListNode):
+        if self.string_builders:
+            self.builder_loops = find_string_builders(prog)
+        promoted: List[IdentDesc] = []
+        if self.promote_globals:
+            for ident, usage in escape.analyze_globals(prog).items():
+                if not usage.escapes:
+                    promoted.append(ident)
+                elif not usage.written_in_funcs:
+                    promoted.append(ident)
+                    self.mirrored.add(ident)
+        self.start()
+        for ident in find_vars_decls(prog):
+            if ident.scope in (ScopeType.GLOBAL, ScopeType.GLOBAL_LOCAL) and \
+                    (ident not in promoted or ident in self.mirrored):
+                self.add('.field public static', f'_gv{ident.index}', jvm_type_desc(ident.type))
+        for stmt in prog.exprs:
+            if isinstance(stmt, FuncNode):
+                self.jbc_gen(stmt)
+        stmts = [stmt for stmt in prog.childs if not isinstance(stmt, FuncNode)]
+        start = len(self.code_lines)
+        sizes = self.jbc_gen_main(stmts, promoted)
+        if self.main_part_size and sum(sizes) > self.main_part_size:
+            del self.code_lines[start:]
+            self.jbc_gen_main_parts(stmts, split.split_parts(sizes, self.main_part_size), promoted)
+        for loop in self.parallel_loops:
+            self.jbc_gen_parallel_class(loop)
+
+    def jbc_gen_main(self, stmts: List[StmtNode], promoted: List[IdentDesc],
+                     name: str = 'main', entrypoint: bool = True) -> List[int]:
+        """Генерация метода с "глобальным" кодом программы
+        :param stmts: операторы
+        :param promoted: глобальные переменные, хранящиеся в локальных переменных метода
+        :return: размеры кода операторов (см. classfile.instr_size)
+        """
+
+        if entrypoint:
+            self.begin_method('public static', name, '([Ljava/lang/String;)V', [(None, None)])
+        else:
+            self.begin_method('private static', name, '()V', [])
+        self.main_slots = {}
+        for ident in promoted:
+            self.main_slots[ident] = self.add_local(ident.type.base_type)
+        self.in_main = True
+        self.ret_type = BaseType.VOID
+        if entrypoint:
+            self.jbc_gen_output_begin()
+        sizes = []
+        for stmt in stmts:
+            start = len(self.code_lines)
+            self.jbc_gen_stmt(stmt)
+            sizes.append(classfile.code_size(self.code_lines[start:]))
+        if entrypoint:
+            self.jbc_gen_output_end()
+        self.add('return')
+        self.in_main = False
+        self.end_method()
+        return sizes
+
+    def jbc_gen_main_parts(self, stmts: List[StmtNode], parts: List[List[int]], promoted: List[IdentDesc]) -> None:
+        """Генерация "глобального" кода программы методами Main_partN (см. msil.CodeGenerator.msil_gen_main_parts)
+        """
+
+        parts_stmts = [[stmts[i] for i in part] for part in parts]
+        parts_idents = [set().union(*(split.referenced_idents(stmt) for stmt in part)) for part in parts_stmts]
+        shared = [ident for ident in promoted if sum(ident in idents for idents in parts_idents) > 1]
+        for ident in shared:
+            if ident not in self.mirrored:
+                self.add('.field public static', f'_gv{ident.index}', jvm_type_desc(ident.type))
+        for n, (part, idents) in enumerate(zip(parts_stmts, parts_idents), 1):
+            self.jbc_gen_main(part, [ident for ident in promoted if ident in idents and ident not in shared],
+                              f'Main_part{n}', False)
+        self.begin_method('public static', 'main', '([Ljava/lang/String;)V', [(None, None)])
+        self.jbc_gen_output_begin()
+        for n in range(1, len(parts) + 1):
+            self.add('invokestatic', f'{PROGRAM_CLASS_NAME}/Main_part{n}()V')
+        self.jbc_gen_output_end()
+        self.add('return')
+        self.end_method()
+
+    def jbc_gen_output_begin(self) -> None:
+        if not self.buffered_output:
+            self.add('invokestatic', f'{RUNTIME_CLASS_NAME}/unbuffered()V')
+
+    def jbc_gen_output_end(self) -> None:
+        # явный сброс вывода (shutdown hook в среде выполнения - на случай исключения)
+        if self.buffered_output:
+            self.add('invokestatic', f'{RUNTIME_CLASS_NAME}/flush()V')
@@ -1,9 +1,10 @@
+import copy
 from abc import ABC, abstractmethod
 from contextlib import suppress
 from typing import Optional, Union, Tuple, Callable
 
-from .semantic import TYPE_CONVERTIBILITY, BIN_OP_TYPE_COMPATIBILITY, BinOp, SinOp, \
-    TypeDesc, IdentDesc, ScopeType, IdentScope, SemanticException
+from .semantic import TYPE_CONVERTIBILITY, BIN_OP_TYPE_COMPATIBILITY, RANGE_OPS, BinOp, SinOp, \
+    TypeDesc, IdentDesc, ScopeType, IdentScope, SemanticException, GENERIC_ARRAY_TYPE_NAME
 
 
 class AstNode(ABC):
@@ -63,6 +64,36 @@ class AstNode(ABC):
         func(self)
         map(func, self.childs)  # посещаем все поддерева
 
+    def transform(self, func: Callable[['AstNode'], 'AstNode']) -> None:
+        """Замена дочерних узлов (в т.ч. хранящихся в кортежах) на результат func,
+           обход снизу вверх (сначала преобразуются поддеревья дочернего узла)
+        """
+
+        for name, value in list(vars(self).items()):
+            if isinstance(value, AstNode):
+                value.transform(func)
+                setattr(self, name, func(value))
+            elif isinstance(value, (tuple, list)) and any(isinstance(v, AstNode) for v in value):
+                items = []
+                for v in value:
+                    if isinstance(v, AstNode):
+                        v.transform(func)
+                        v = func(v)
+                    items.append(v)
+                setattr(self, name, type(value)(items))
+
+    def clone(self) -> 'AstNode':
+        """Копия поддерева (описания идентификаторов и типов данных остаются общими)
+        """
+
+        result = copy.copy(self)
+        for name, value in list(vars(result).items()):
+            if isinstance(value, AstNode):
+                setattr(result, name, value.clone())
+            elif isinstance(value, (tuple, list)) and any(isinstance(v, AstNode) for v in value):
+                setattr(result, name, type(value)(v.clone() if isinstance(v, AstNode) else v for v in value))
+        return result
+
     def __getitem__(self, index):
         return self.childs[index] if index < len(self.childs) else None
 
@@ -101,7 +132,7 @@ class LiteralNode(ExprNode):
         super().__init__(row=row, col=col, **props)
         self.literal = literal
         if literal in ('true', 'false'):
-            self.value = bool(literal)
+            self.value = literal == 'true'
         else:
             self.value = eval(literal)
 
@@ -144,16 +175,16 @@ class IdentNode(ExprNode):
 
 class TypeNode(IdentNode):
     """Класс для представления в AST-дереве типов данный
-       (при появлении составных типов данных должен быть расширен)
+       (generic - параметр-тип, например, String для Array<String>)
     """
 
-    def __init__(self, name: str, generic=None,
+    def __init__(self, name: str, generic: Optional['TypeNode'] = None,
                  row: Optional[int] = None, col: Optional[int] = None, **props) -> None:
         super().__init__(name, row=row, col=col, **props)
         self.generic = generic
         self.type = None
         with suppress(SemanticException):
-            self.type = TypeDesc.from_str(name)
+            self.type = TypeDesc.from_str(name, generic.type if generic else None)
 
     def to_str_full(self):
         return self.to_str()
@@ -164,7 +195,12 @@ class TypeNode(IdentNode):
 
     def semantic_check(self, scope: IdentScope) -> None:
         if self.type is None:
-            self.semantic_error('Неизвестный тип {}'.format(self.name))
+            if self.generic:
+                self.generic.semantic_check(scope)
+            try:
+                self.type = TypeDesc.from_str(self.name, self.generic.type if self.generic else None)
+            except SemanticException as e:
+                self.semantic_error(e.message)
 
 
 class SinOpNode(ExprNode):
@@ -186,10 +222,10 @@ class SinOpNode(ExprNode):
 
 
 class SeqNode(ExprNode):
-    """Класс для представления в AST-дереве бинарных операций
+    """Класс для представления в AST-дереве диапазонов (a..b, a until b, a downTo b с необязательным step)
     """
 
-    def __init__(self, startArg: ExprNode, seqOp: str, endArg: ExprNode,
+    def __init__(self, startArg: ExprNode, seqOp: BinOp, endArg: ExprNode,
                  stepArg: ExprNode = None,
                  row: Optional[int] = None, col: Optional[int] = None, **props) -> None:
         super().__init__(row=row, col=col, **props)
@@ -199,11 +235,26 @@ class SeqNode(ExprNode):
         self.stepArg = stepArg
 
     def __str__(self) -> str:
-        return 'seq'
+        return str(self.seqOp) + (' step' if self.stepArg is not None else '')
 
     @property
-    def childs(self) -> Tuple[ExprNode, ExprNode]:
-        return [self.startArg, self.seqOp, self.endArg] + [self.stepArg] if self.stepArg is not None else []
+    def childs(self) -> Tuple[ExprNode, ...]:
+        return (self.startArg, self.endArg) + ((self.stepArg, ) if self.stepArg is not None else ())
+
+    def semantic_check(self, scope: IdentScope) -> None:
+        # объект диапазона не создается, поэтому диапазон может быть только частью цикла for или условия when
+        self.semantic_error('Диапазон {} допустим только в цикле for и в условии in ветви when'.format(self.seqOp))
+
+    def check_range(self, scope: IdentScope) -> None:
+        self.startArg.semantic_check(scope)
+        self.startArg = type_convert(self.startArg, TypeDesc.INT, None, 'начало диапазона')
+        self.endArg.semantic_check(scope)
+        self.endArg = type_convert(self.endArg, TypeDesc.INT, None, 'конец диапазона')
+        if self.stepArg is not None:
+            self.stepArg.semantic_check(scope)
+            self.stepArg = type_convert(self.stepArg, TypeDesc.INT, None, 'шаг диапазона')
+            if isinstance(self.stepArg, LiteralNode) and self.stepArg.value <= 0:
+                self.stepArg.semantic_error('Шаг диапазона должен быть положительным ({})'.format(self.stepArg.value))
 
 
 class BinOpNode(ExprNode):
@@ -260,14 +311,15 @@ class CallNode(ExprNode):
        (в языке программирования может быть как expression, так и statement)
     """
 
-    def __init__(self, func: IdentNode, *params: ExprNode,
+    def __init__(self, func: IdentNode, *params: ExprNode, generic: Optional[TypeNode] = None,
                  row: Optional[int] = None, col: Optional[int] = None, **props) -> None:
         super().__init__(row=row, col=col, **props)
         self.func = func
         self.params = params
+        self.generic = generic
 
     def __str__(self) -> str:
-        return 'call'
+        return 'call' + ('<{}>'.format(self.generic) if self.generic else '')
 
     @property
     def childs(self) -> Tuple[IdentNode, ...]:
@@ -279,6 +331,28 @@ class CallNode(ExprNode):
             self.semantic_error('Функция {} не найдена'.format(self.func.name))
         if not func.type.func:
             self.semantic_error('Идентификатор {} не является функцией'.format(func.name))
+        if func.writes_globals and scope.in_parallel:
+            self.semantic_error('Функция {} изменяет глобальные переменные и не может вызываться '
+                                'в параллельном цикле'.format(func.name))
+        if self.generic is not None:
+            # параметр-тип есть только у конструктора массива Array<String>(size)
+            self.generic.semantic_check(scope)
+            if not (func.built_in and func.type.return_type.array):
+                self.semantic_error('Функция {} не имеет параметра-типа'.format(func.name))
+            try:
+                TypeDesc.from_str(func.name, self.generic.type)
+            except SemanticException as e:
+                self.generic.semantic_error(e.message)
+        elif func.built_in and func.name == GENERIC_ARRAY_TYPE_NAME:
+            self.semantic_error('Конструктор {0} требует параметра-типа ({0}<String>)'.format(func.name))
+        for param in self.params:
+            param.semantic_check(scope)
+        # из перегрузок встроенной функции выбирается точно совпадающая по типам аргументов
+        for overload in (func, *func.overloads):
+            if len(overload.type.params) == len(self.params) and \
+                    all(param.node_type == type_ for param, type_ in zip(self.params, overload.type.params)):
+                func = overload
+                break
         if len(func.type.params) != len(self.params):
             self.semantic_error('Кол-во аргументов {} не совпадает (ожидалось {}, передано {})'.format(
                 func.name, len(func.type.params), len(self.params)
@@ -288,7 +362,6 @@ class CallNode(ExprNode):
         decl_params_str = fact_params_str = ''
         for i in range(len(self.params)):
             param: ExprNode = self.params[i]
-            param.semantic_check(scope)
             if (len(decl_params_str) > 0):
                 decl_params_str += ', '
             decl_params_str += str(func.type.params[i])
@@ -311,6 +384,56 @@ class CallNode(ExprNode):
             self.node_type = func.type.return_type
 
 
+class IndexNode(ExprNode):
+    """Класс для представления в AST-дереве обращения к элементу массива (a[i])
+    """
+
+    def __init__(self, array: ExprNode, index: ExprNode,
+                 row: Optional[int] = None, col: Optional[int] = None, **props) -> None:
+        super().__init__(row=row, col=col, **props)
+        self.array = array
+        self.index = index
+
+    def __str__(self) -> str:
+        return '[]'
+
+    @property
+    def childs(self) -> Tuple[ExprNode, ExprNode]:
+        return self.array, self.index
+
+    def semantic_check(self, scope: IdentScope) -> None:
+        self.array.semantic_check(scope)
+        if not self.array.node_type.array:
+            self.semantic_error('Выражение типа {} не является массивом'.format(self.array.node_type))
+        self.index.semantic_check(scope)
+        self.index = type_convert(self.index, TypeDesc.INT, None, 'индекс массива')
+        self.node_type = self.array.node_type.elem_type
+
+
+class MemberNode(ExprNode):
+    """Класс для представления в AST-дереве обращения к свойству значения (сейчас только a.size для массивов)
+    """
+
+    def __init__(self, obj: ExprNode, member: IdentNode,
+                 row: Optional[int] = None, col: Optional[int] = None, **props) -> None:
+        super().__init__(row=row, col=col, **props)
+        self.obj = obj
+        self.member = member
+
+    def __str__(self) -> str:
+        return '.' + self.member.name
+
+    @property
+    def childs(self) -> Tuple[ExprNode]:
+        return self.obj,
+
+    def semantic_check(self, scope: IdentScope) -> None:
+        self.obj.semantic_check(scope)
+        if not (self.obj.node_type.array and self.member.name == 'size'):
+            self.semantic_error('Свойство {} не найдено у типа {}'.format(self.member.name, self.obj.node_type))
+        self.node_type = TypeDesc.INT
+
+
 class TypeConvertNode(ExprNode):
     """Класс для представления в AST-дереве операций конвертации типов данных
        (в языке программирования может быть как expression, так и statement)
@@ -344,7 +467,9 @@ def type_convert(expr: ExprNode, type_: TypeDesc, except_node: Optional[AstNode]
         except_node.semantic_error('Тип выражения не определен')
     if type_ is None:
         except_node.node_type = expr.node_type
-        except_node.type = TypeNode(except_node.node_type.base_type)
+        except_node.type = TypeNode(str(except_node.node_type))
+        # имя типа массива с параметром-типом (Array<String>) не разбирается как имя типа
+        except_node.type.type = except_node.node_type
         return expr
     if expr.node_type == type_:
         return expr
@@ -409,11 +534,41 @@ class AssignNode(ExprNode):
 
     def semantic_check(self, scope: IdentScope) -> None:
         self.var.semantic_check(scope)
+        if self.var.node_ident.const:
+            self.semantic_error('Переменная цикла {} не может быть изменена'.format(self.var.name))
+        if scope.is_shared(self.var.name):
+            self.semantic_error('Переменная {} объявлена вне параллельного цикла и не может изменяться в нем '
+                                '(для накопления значений используйте parallelSum, parallelMin или parallelMax)'.format(
+                                    self.var.name))
         self.val.semantic_check(scope)
         self.val = type_convert(self.val, self.var.node_type, self, 'присваиваемое значение')
         self.node_type = self.var.node_type
 
 
+class IndexAssignNode(ExprNode):
+    """Класс для представления в AST-дереве присваивания элементу массива (a[i] = v)
+    """
+
+    def __init__(self, target: IndexNode, val: ExprNode,
+                 row: Optional[int] = None, col: Optional[int] = None, **props) -> None:
+        super().__init__(row=row, col=col, **props)
+        self.target = target
+        self.val = val
+
+    def __str__(self) -> str:
+        return '='
+
+    @property
+    def childs(self) -> Tuple[IndexNode, ExprNode]:
+        return self.target, self.val
+
+    def semantic_check(self, scope: IdentScope) -> None:
+        self.target.semantic_check(scope)
+        self.val.semantic_check(scope)
+        self.val = type_convert(self.val, self.target.node_type, self, 'присваиваемое значение')
+        self.node_type = self.target.node_type
+
+
 class VarsNode(StmtNode):
     """Класс для представления в AST-дереве объявления переменнных
     """
@@ -512,6 +667,8 @@ class ReturnNode(StmtNode):
         func = scope.curr_func
         if func is None:
             self.semantic_error('Оператор return применим только к функции')
+        if scope.in_parallel:
+            self.semantic_error('Оператор return недопустим в теле параллельного цикла')
         self.val = type_convert(self.val, func.func.type.return_type, self, 'возвращаемое значение')
         self.node_type = TypeDesc.VOID
 
@@ -543,15 +700,132 @@ class IfNode(StmtNode):
         self.node_type = TypeDesc.VOID
 
 
+class WhenInNode(ExprNode):
+    """Класс для представления в AST-дереве условия ветви when вида in a..b
+    """
+
+    def __init__(self, range_: ExprNode,
+                 row: Optional[int] = None, col: Optional[int] = None, **props) -> None:
+        super().__init__(row=row, col=col, **props)
+        self.range = range_
+
+    def __str__(self) -> str:
+        return 'in'
+
+    @property
+    def childs(self) -> Tuple[ExprNode]:
+        return self.range,
+
+    def semantic_check(self, scope: IdentScope) -> None:
+        if not isinstance(self.range, SeqNode):
+            self.semantic_error('После in в условии when ожидается диапазон')
+        if self.range.stepArg is not None:
+            self.range.stepArg.semantic_error('Шаг диапазона в условии when не поддерживается')
+        self.range.check_range(scope)
+        self.node_type = TypeDesc.BOOL
+
+
+class WhenBranchNode(AstNode):
+    """Класс для представления в AST-дереве ветви when (условия и тело, у ветви else условий нет)
+    """
+
+    def __init__(self, body: ExprNode, *conds: ExprNode,
+                 row: Optional[int] = None, col: Optional[int] = None, **props) -> None:
+        super().__init__(row=row, col=col, **props)
+        self.body = body
+        self.conds = conds
+
+    def __str__(self) -> str:
+        return '->' if self.conds else 'else'
+
+    @property
+    def childs(self) -> Tuple[ExprNode, ...]:
+        return (*self.conds, self.body)
+
+
+class WhenNode(StmtNode):
+    """Класс для представления в AST-дереве оператора when (с выражением в скобках)
+    """
+
+    def __init__(self, subject: ExprNode, *branches: WhenBranchNode,
+                 row: Optional[int] = None, col: Optional[int] = None, **props) -> None:
+        super().__init__(row=row, col=col, **props)
+        self.subject = subject
+        self.branches = branches
+
+    def __str__(self) -> str:
+        return 'when'
+
+    @property
+    def childs(self) -> Tuple[AstNode, ...]:
+        return (self.subject, *self.branches)
+
+    @property
+    def else_branch(self) -> Optional[WhenBranchNode]:
+        return self.branches[-1] if self.branches and not self.branches[-1].conds else None
+
+    def semantic_check(self, scope: IdentScope) -> None:
+        self.subject.semantic_check(scope)
+        subject_type = self.subject.node_type
+        if not subject_type.is_simple or subject_type == TypeDesc.VOID:
+            self.subject.semantic_error('Тип {} не допустим в when'.format(subject_type))
+        for i, branch in enumerate(self.branches):
+            if not branch.conds and i < len(self.branches) - 1:
+                branch.semantic_error('Ветвь else должна быть последней в when')
+            conds = []
+            for cond in branch.conds:
+                if isinstance(cond, WhenInNode) and subject_type != TypeDesc.INT:
+                    cond.semantic_error('Условие in допустимо только в when с выражением типа {}'.format(TypeDesc.INT))
+                cond.semantic_check(scope)
+                if not isinstance(cond, WhenInNode):
+                    cond = type_convert(cond, subject_type, None, 'условие when')
+                conds.append(cond)
+            branch.conds = tuple(conds)
+            self.check_body(branch, scope)
+        self.node_type = TypeDesc.VOID
+
+    def check_body(self, branch: WhenBranchNode, scope: IdentScope) -> None:
+        branch.body.semantic_check(IdentScope(scope))
+
+
+class WhenExprNode(WhenNode):
+    """Класс для представления в AST-дереве выражения when (значение - значение тела выбранной ветви)
+    """
+
+    def to_str_full(self):
+        return ExprNode.to_str_full(self)
+
+    def semantic_check(self, scope: IdentScope) -> None:
+        super().semantic_check(scope)
+        if self.else_branch is None:
+            self.semantic_error('Выражение when должно содержать ветвь else')
+        types = [branch.body.node_type for branch in self.branches]
+        if any(not type_.is_simple or type_ == TypeDesc.VOID for type_ in types):
+            self.semantic_error('Ветви выражения when должны иметь значение')
+        # тип результата - первый из типов ветвей, к которому приводятся значения остальных ветвей
+        for type_ in types:
+            if all(t == type_ or (t.base_type in TYPE_CONVERTIBILITY and
+                                  type_.base_type in TYPE_CONVERTIBILITY[t.base_type]) for t in types):
+                self.node_type = type_
+                break
+        else:
+            self.semantic_error('Типы ветвей выражения when ({}) несовместимы'.format(', '.join(map(str, types))))
+        for branch in self.branches:
+            branch.body = type_convert(branch.body, self.node_type, None, 'значение ветви when')
+
+    def check_body(self, branch: WhenBranchNode, scope: IdentScope) -> None:
+        branch.body.semantic_check(scope)
+
+
 class ForNode(StmtNode):
-    """Класс для представления в AST-дереве цикла for
+    """Класс для представления в AST-дереве цикла for по диапазону
     """
 
-    def __init__(self, init: IdentNode, cond: ExprNode, body: StmtNode,
+    def __init__(self, ident: IdentNode, range_: ExprNode, body: StmtNode,
                  row: Optional[int] = None, col: Optional[int] = None, **props) -> None:
         super().__init__(row=row, col=col, **props)
-        self.init = init
-        self.cond = cond
+        self.ident = ident
+        self.range = range_
         self.body = body
 
     def __str__(self) -> str:
@@ -559,19 +833,101 @@ class ForNode(StmtNode):
 
     @property
     def childs(self) -> Tuple[AstNode, ...]:
-        return self.init, self.cond, self.body
+        return self.ident, self.range, self.body
 
     def semantic_check(self, scope: IdentScope) -> None:
+        if not isinstance(self.range, SeqNode):
+            self.range.semantic_error('Цикл for поддерживается только по диапазону (.., until, downTo)')
+        # границы и шаг вычисляются до объявления переменной цикла
+        self.range.check_range(scope)
         scope = IdentScope(scope)
-        self.init.semantic_check(scope)
-        if self.cond == EMPTY_STMT:
-            self.cond = LiteralNode('true')
-        self.cond.semantic_check(scope)
-        self.cond = type_convert(self.cond, TypeDesc.BOOL, None, 'условие')
+        ident = IdentDesc(self.ident.name, TypeDesc.INT)
+        ident.const = True
+        try:
+            scope.add_ident(ident)
+        except SemanticException as e:
+            self.ident.semantic_error(e.message)
+        self.ident.semantic_check(scope)
+        self.body.semantic_check(IdentScope(scope))
+        self.node_type = TypeDesc.VOID
+
+
+class ParallelForNode(StmtNode):
+    """Класс для представления в AST-дереве параллельного цикла parallelFor(a until b) { i -> ... }
+
+       Итерации выполняются параллельно (частями диапазона в разных потоках), поэтому тело цикла не может
+       изменять внешние переменные (кроме элементов массивов) и вызывать функции, изменяющие глобальные
+       переменные. Перед генерацией кода тело цикла выносится в отдельную функцию (см. parallel.lower)
+    """
+
+    def __init__(self, range_: ExprNode, ident: IdentNode, body: StmtNode,
+                 row: Optional[int] = None, col: Optional[int] = None, **props) -> None:
+        super().__init__(row=row, col=col, **props)
+        self.range = range_
+        self.ident = ident
+        self.body = body
+        # после выноса тела: функция, выполняющая часть диапазона, и ее вызов с захваченными переменными
+        self.func: Optional['FuncNode'] = None
+        self.call: Optional[CallNode] = None
+
+    def __str__(self) -> str:
+        return 'parallelFor'
+
+    @property
+    def childs(self) -> Tuple[AstNode, ...]:
+        if self.call is not None:
+            return self.range, self.call
+        return self.ident, self.range, self.body
+
+    def semantic_check(self, scope: IdentScope) -> None:
+        if scope.in_parallel:
+            self.semantic_error('Вложенные параллельные циклы не поддерживаются')
+        if not isinstance(self.range, SeqNode) or self.range.seqOp == BinOp.DOWNTO or self.range.stepArg is not None:
+            self.range.semantic_error('{} поддерживается только по диапазону без шага (.., until)'.format(self))
+        self.range.check_range(scope)
+        scope = IdentScope(scope)
+        scope.parallel = True
+        ident = IdentDesc(self.ident.name, TypeDesc.INT)
+        ident.const = True
+        try:
+            scope.add_ident(ident)
+        except SemanticException as e:
+            self.ident.semantic_error(e.message)
+        self.ident.semantic_check(scope)
+        self.check_body(scope)
+
+    def check_body(self, scope: IdentScope) -> None:
         self.body.semantic_check(IdentScope(scope))
         self.node_type = TypeDesc.VOID
 
 
+class ParallelReduceNode(ParallelForNode):
+    """Класс для представления в AST-дереве параллельной свертки диапазона
+       parallelSum(a until b) { i -> expr } (а также parallelMin, parallelMax), значение - сумма
+       (минимум, максимум) значений выражения для всех значений диапазона
+    """
+
+    def __init__(self, op: str, range_: ExprNode, ident: IdentNode, expr: ExprNode,
+                 row: Optional[int] = None, col: Optional[int] = None, **props) -> None:
+        super().__init__(range_, ident, expr, row=row, col=col, **props)
+        self.op = op
+        # функция, объединяющая результаты частей диапазона (см. parallel.lower)
+        self.fold: Optional['FuncNode'] = None
+
+    def __str__(self) -> str:
+        return self.op
+
+    def to_str_full(self):
+        return ExprNode.to_str_full(self)
+
+    def check_body(self, scope: IdentScope) -> None:
+        self.body.semantic_check(scope)
+        if self.body.node_type not in (TypeDesc.INT, TypeDesc.FLOAT):
+            self.body.semantic_error('Значение {} должно иметь тип {} или {} (а не {})'.format(
+                self.op, TypeDesc.INT, TypeDesc.FLOAT, self.body.node_type))
+        self.node_type = self.body.node_type
+
+
 class WhileNode(StmtNode):
     """Класс для представления в AST-дереве условного оператора
     """
@@ -597,7 +953,7 @@ class WhileNode(StmtNode):
 
 
 class DoWhileNode(StmtNode):
-    """Класс для представления в AST-дереве цикла while
+    """Класс для представления в AST-дереве цикла do-while
     """
 
     def __init__(self, body: StmtNode, condition: ExprNode,
@@ -611,8 +967,20 @@ class DoWhileNode(StmtNode):
 
     @property
     def childs(self) -> Tuple[AstNode, ...]:
-        return self.condition, self.body
+        return self.body, self.condition
 
+    def semantic_check(self, scope: IdentScope) -> None:
+        # как в Kotlin, переменные, объявленные в теле цикла, видны в условии
+        scope = IdentScope(scope)
+        if isinstance(self.body, StmtListNode):
+            for expr in self.body.exprs:
+                expr.semantic_check(scope)
+            self.body.node_type = TypeDesc.VOID
+        else:
+            self.body.semantic_check(scope)
+        self.condition.semantic_check(scope)
+        self.condition = type_convert(self.condition, TypeDesc.BOOL, None, 'условие')
+        self.node_type = TypeDesc.VOID
 
 
 class ParamNode(StmtNode):
@@ -668,6 +1036,9 @@ class FuncNode(StmtNode):
     def semantic_check(self, scope: IdentScope) -> None:
         if scope.curr_func:
             self.semantic_error("Объявление функции ({}) внутри другой функции не поддерживается".format(self.name.name))
+        if scope.in_parallel:
+            self.semantic_error("Объявление функции ({}) в теле параллельного цикла не поддерживается".format(
+                self.name.name))
         parent_scope = scope
         self.type.semantic_check(scope)
         scope = IdentScope(scope)
@@ -689,7 +1060,24 @@ class FuncNode(StmtNode):
         except SemanticException as e:
             self.name.semantic_error("Повторное объявление функции {}".format(self.name.name))
         self.body.semantic_check(scope)
+        func_ident.writes_globals = writes_globals(self.body)
         self.node_type = TypeDesc.VOID
 
+
+def writes_globals(node: AstNode) -> bool:
+    """Поддерево (после семантического анализа) изменяет глобальные переменные: присваивает им значения
+       или вызывает функции, которые их изменяют
+    """
+
+    for n in (node.childs or []):
+        if isinstance(n, AssignNode) and n.var.node_ident.scope in (ScopeType.GLOBAL, ScopeType.GLOBAL_LOCAL):
+            return True
+        if isinstance(n, CallNode) and n.func.node_ident is not None and n.func.node_ident.writes_globals:
+            return True
+        if writes_globals(n):
+            return True
+    return False
+
+
 EMPTY_STMT = StmtListNode()
 EMPTY_IDENT = IdentDesc('', TypeDesc.VOID)
\ No newline at end of file
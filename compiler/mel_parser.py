@@ -19,11 +19,17 @@ def _make_parser():
     BIT_OR = pp.Keyword('or')
     UNTIL, DOWNTO, STEP = pp.Keyword('until'), pp.Keyword('downTo'), pp.Keyword('step').suppress()
     IN = pp.Keyword('in')
-    keywords = IF | FOR | WHILE | DO | RETURN | VAR | VAL | FUN | BIT_AND | BIT_OR | UNTIL | DOWNTO | IN
+    WHEN, ELSE = pp.Keyword('when'), pp.Keyword('else')
+    PARALLEL_FOR = pp.Keyword('parallelFor')
+    PARALLEL_REDUCE = pp.Keyword('parallelSum') | pp.Keyword('parallelMin') | pp.Keyword('parallelMax')
+    keywords = IF | FOR | WHILE | DO | RETURN | VAR | VAL | FUN | BIT_AND | BIT_OR | UNTIL | DOWNTO | IN | WHEN | \
+        PARALLEL_FOR | PARALLEL_REDUCE
     SEMI, COMMA, COLON, DOTS = pp.Literal(';').suppress(), pp.Literal(',').suppress(), pp.Literal(':'), pp.Literal('..')
+    DOT = pp.Literal('.').suppress()
 
     # num = ppc.fnumber.copy().setParseAction(lambda s, loc, tocs: tocs[0])
-    num = pp.Regex('[+-]?\\d+\\.?\\d*([eE][+-]?\\d+)?')
+    # точка, за которой следует вторая точка, относится к диапазону (1..10), а не к числу
+    num = pp.Regex('[+-]?\\d+(\\.(?!\\.)\\d*)?([eE][+-]?\\d+)?')
     # c escape-последовательностями как-то неправильно работает
     str_ = pp.QuotedString('"', escChar='\\', unquoteResults=False, convertWhitespaceEscapes=False)
     bool_ = pp.Regex('true|false')
@@ -49,47 +55,71 @@ def _make_parser():
     NEQUALS, EQUALS = pp.Literal('!='), pp.Literal('==')
 
     NE = pp.Literal('!').setName('sin_op')
+    ARROW = pp.Literal('->').suppress()
 
     add = pp.Forward()
     expr = pp.Forward()
     stmt = pp.Forward()
     stmt_list = pp.Forward()
+    when_expr = pp.Forward()
 
-    call = ident + LPAR + pp.Optional(expr + pp.ZeroOrMore(COMMA + expr)) + RPAR
+    # параметр-тип допустим только у конструктора массива: Array<String>(n)
+    call = ident + pp.Optional(LANGLE + type_ + RANGLE) + LPAR + pp.Optional(expr + pp.ZeroOrMore(COMMA + expr)) + RPAR
+    # параллельная свертка диапазона: parallelSum(0 until n) { i -> a[i] * a[i] }
+    parallel_reduce = PARALLEL_REDUCE + LPAR + expr + RPAR + LBRACE + ident + ARROW + expr + RBRACE
     group = (
         literal |
+        parallel_reduce |
         call |  # обязательно перед ident, т.к. приоритетный выбор (или использовать оператор ^ вместо | )
         ident |
+        when_expr |
         LPAR + expr + RPAR
     )
+    # индекс в pp.Group, чтобы отличать от обращения к свойству (a[i], a.size, a[i][j] и т.п.)
+    index_suffix = pp.Group(LBRACK + expr + RBRACK)
+    postfix = group + pp.ZeroOrMore(index_suffix | DOT + ident)
+    index_target = ident + pp.OneOrMore(index_suffix)
 
     # обязательно везде pp.Group, иначе приоритет операций не будет работать (см. реализцию set_parse_action_magic);
     # также можно воспользоваться pp.operatorPrecedence (должно быть проще, но не проверял)
 
-    mult = pp.Group(group + pp.ZeroOrMore((MUL | DIV | MOD) + group)).setName('bin_op')
+    mult = pp.Group(postfix + pp.ZeroOrMore((MUL | DIV | MOD) + postfix)).setName('bin_op')
     add << pp.Group(mult + pp.ZeroOrMore((ADD | SUB) + mult)).setName('bin_op')
     seq = pp.Group(add + pp.Optional((DOTS | UNTIL | DOWNTO) + add + pp.Optional(STEP + expr))).setName('bin_op')
     compare1 = pp.Group(seq + pp.Optional((GE | LE | GT | LT) + seq)).setName('bin_op')  # GE и LE первыми, т.к. приоритетный выбор
     compare2 = pp.Group(compare1 + pp.Optional((EQUALS | NEQUALS) + compare1)).setName('bin_op')
-    logical_and = pp.Group(compare2 + pp.ZeroOrMore(AND | BIT_AND + compare2)).setName('bin_op')
-    logical_or = pp.Group(logical_and + pp.ZeroOrMore(OR | BIT_OR + logical_and)).setName('bin_op')
+    logical_and = pp.Group(compare2 + pp.ZeroOrMore((AND | BIT_AND) + compare2)).setName('bin_op')
+    logical_or = pp.Group(logical_and + pp.ZeroOrMore((OR | BIT_OR) + logical_and)).setName('bin_op')
 
     expr << (logical_or)
 
+    # ветви when разделяются переводом строки или ';' (как и операторы, перевод строки не учитывается, поэтому
+    # ветвь, начинающуюся с отрицательного числа, после ветви со значением-выражением нужно отделять ';')
+    when_in = IN.suppress() + seq
+    when_cond = when_in | expr
+    when_conds = ELSE.suppress() | when_cond + pp.ZeroOrMore(COMMA + when_cond)
+    when_subject = WHEN.suppress() + LPAR + expr + RPAR
+    when_expr_branch = (when_conds + ARROW + expr + pp.Optional(SEMI)).setName('when_branch')
+    when_expr << (when_subject + LBRACE + pp.ZeroOrMore(when_expr_branch) + RBRACE)
+
     simple_assign = (ident + ASSIGN.suppress() + expr).setName('assign')
     var_ = (VAR | VAL) + ((ident + COLON + type_ + pp.Optional(ASSIGN.suppress() + expr)) |
                              (ident + pp.Optional(ASSIGN.suppress() + expr)))
 
     assign = ident + ASSIGN.suppress() + expr
-    simple_stmt = assign | call
+    index_assign = index_target + ASSIGN.suppress() + expr
+    simple_stmt = assign | index_assign | call
 
     self_operators = pp.Group(ident + pp.Optional((SADD | SSUB | SMUL | SDIV | SMOD) + expr)).setName('bin_op')
     if_ = IF.suppress() + LPAR + expr + RPAR + stmt + pp.Optional(pp.Keyword("else").suppress() + stmt)
     for_ = FOR.suppress() + LPAR + ident + IN.suppress() + expr + RPAR + stmt
+    parallel_for = PARALLEL_FOR.suppress() + LPAR + expr + RPAR + LBRACE + ident + ARROW + stmt_list + RBRACE
     while_ = WHILE.suppress() + LPAR + expr + RPAR + stmt
     do_while = DO.suppress() + stmt + WHILE.suppress() + LPAR + expr + RPAR
     return_ = RETURN.suppress() + pp.Optional(expr)
     composite = LBRACE + stmt_list + RBRACE
+    when_branch = when_conds + ARROW + stmt + pp.Optional(SEMI)
+    when_ = when_subject + LBRACE + pp.ZeroOrMore(when_branch) + RBRACE
 
     param = ident + COLON.suppress() + type_
     params = param + pp.ZeroOrMore(COMMA + param)
@@ -99,7 +129,9 @@ def _make_parser():
             if_ |
             while_ |
             for_ |
+            parallel_for |
             do_while |
+            when_ |
             return_ |
             simple_stmt + pp.Optional(SEMI) |
             # обязательно ниже if, for и т.п., иначе считает их за типы данных (сейчас уже не считает - см. грамматику)
@@ -130,15 +162,37 @@ def _make_parser():
                     secondNode = tocs[i + 1]
                     if not isinstance(secondNode, AstNode):
                         secondNode = bin_op_parse_action(s, loc, secondNode)
-                    node = BinOpNode(BinOp(tocs[i]), node, secondNode, loc=loc)
+                    op = BinOp(tocs[i])
+                    if op in RANGE_OPS:
+                        # диапазон: начало, операция, конец и необязательный шаг (step уже отброшен)
+                        stepNode = tocs[i + 2] if len(tocs) > i + 2 else None
+                        if stepNode is not None and not isinstance(stepNode, AstNode):
+                            stepNode = bin_op_parse_action(s, loc, stepNode)
+                        return SeqNode(node, op, secondNode, stepNode, loc=loc)
+                    node = BinOpNode(op, node, secondNode, loc=loc)
                 return node
             parser.setParseAction(bin_op_parse_action)
+        elif rule_name in ('postfix', 'index_target'):
+            def postfix_parse_action(s, loc, tocs):
+                node = tocs[0]
+                for suffix in tocs[1:]:
+                    if isinstance(suffix, IdentNode):
+                        node = MemberNode(node, suffix, loc=loc)
+                    else:
+                        node = IndexNode(node, suffix[0], loc=loc)
+                return node
+            parser.setParseAction(postfix_parse_action)
         else:
             cls = ''.join(x.capitalize() for x in rule_name.split('_')) + 'Node'
             with suppress(NameError):
                 cls = eval(cls)
                 if not inspect.isabstract(cls):
                     def parse_action(s, loc, tocs):
+                        if cls is WhenBranchNode:
+                            # тело ветви - последний элемент
+                            return WhenBranchNode(tocs[-1], *tocs[:-1], loc=loc)
+                        if cls is CallNode and len(tocs) > 1 and isinstance(tocs[1], TypeNode):
+                            return CallNode(tocs[0], *tocs[2:], generic=tocs[1], loc=loc)
                         if cls is FuncNode:
                             if isinstance(tocs[-2], TypeNode):
                                 return FuncNode(tocs[-2], tocs[0], tocs[1:-2], tocs[-1], loc=loc)
@@ -1,12 +1,28 @@
-from typing import List, Union, Any
+import re
+from typing import List, Union, Any, Dict, Optional, Set, TextIO, Tuple
 
 from . import visitor
-from .semantic import BaseType, TypeDesc, ScopeType, BinOp
-from .mel_ast import AstNode, LiteralNode, IdentNode, BinOpNode, TypeConvertNode, CallNode, \
-    VarsNode, FuncNode, AssignNode, ReturnNode, IfNode, ForNode, StmtListNode, WhileNode, VarNode
+from . import purity
+from . import escape
+from . import slots
+from . import stack
+from . import split
+from . import switch
+from . import bounds as bounds_
+from . import parallel as parallel_
+from .code_buffer import CodeBuffer
+from .strings import flatten_concat, append_args, find_string_builders
+from . import peephole as peephole_
+from .semantic import BaseType, TypeDesc, ScopeType, BinOp, IdentDesc
+from .mel_ast import AstNode, ExprNode, LiteralNode, IdentNode, BinOpNode, TypeConvertNode, CallNode, \
+    VarsNode, FuncNode, AssignNode, ReturnNode, IfNode, ForNode, StmtListNode, WhileNode, DoWhileNode, VarNode, SeqNode, \
+    StmtNode, WhenNode, WhenExprNode, WhenInNode, IndexNode, MemberNode, IndexAssignNode, ParallelForNode, \
+    ParallelReduceNode
 
 RUNTIME_CLASS_NAME = 'CompilerDemo.Runtime'
 PROGRAM_CLASS_NAME = 'Program'
+# базовый класс среды выполнения для тел параллельных циклов (разбиение диапазона на части и Parallel.For)
+PARALLEL_BODY_CLASS = 'CompilerDemo.ParallelBody'
 
 MSIL_TYPE_NAMES = {
     BaseType.VOID: 'void',
@@ -16,6 +32,80 @@ MSIL_TYPE_NAMES = {
     BaseType.STR: 'string'
 }
 
+MSIL_ELEM_SUFFIXES = {
+    BaseType.INT: 'i4',
+    BaseType.FLOAT: 'r8',
+    BaseType.BOOL: 'u1',
+    BaseType.STR: 'ref'
+}
+
+# для stelem нет беззнаковых вариантов
+MSIL_STORE_ELEM_SUFFIXES = {
+    BaseType.INT: 'i4',
+    BaseType.FLOAT: 'r8',
+    BaseType.BOOL: 'i1',
+    BaseType.STR: 'ref'
+}
+
+INVARIANT_CULTURE = 'call class [mscorlib]System.Globalization.CultureInfo ' \
+                    '[mscorlib]System.Globalization.CultureInfo::get_InvariantCulture()'
+
+# встроенные операции, реализуемые напрямую вызовами BCL (JIT может их встроить), а не через класс Runtime:
+# сигнатура метода Runtime -> инструкции (аргументы уже в стеке);
+# сравнение строк - ординальное (как String.compareTo в Kotlin/Java), числа - в инвариантной культуре
+INTRINSICS = {
+    'compare(string, string)': (
+        'call int32 [mscorlib]System.String::CompareOrdinal(string, string)',
+    ),
+    'convert(int32)': (
+        INVARIANT_CULTURE,
+        'call string [mscorlib]System.Convert::ToString(int32, class [mscorlib]System.IFormatProvider)',
+    ),
+    'convert(float64)': (
+        INVARIANT_CULTURE,
+        'call string [mscorlib]System.Convert::ToString(float64, class [mscorlib]System.IFormatProvider)',
+    ),
+    'convert(bool)': (
+        'call string [mscorlib]System.Convert::ToString(bool)',
+    ),
+}
+
+# условные переходы для сравнений: операция -> (переход, если условие истинно; если ложно)
+COMPARE_BRANCHES = {
+    BinOp.LT: ('blt', 'bge'),
+    BinOp.GT: ('bgt', 'ble'),
+    BinOp.LE: ('ble', 'bgt'),
+    BinOp.GE: ('bge', 'blt'),
+    BinOp.EQUALS: ('beq', 'bne.un'),
+    BinOp.NEQUALS: ('bne.un', 'beq'),
+}
+
+# для Float отрицание сравнения должно быть истинным для NaN (переходы .un)
+FLOAT_COMPARE_BRANCHES = {
+    BinOp.LT: ('blt', 'bge.un'),
+    BinOp.GT: ('bgt', 'ble.un'),
+    BinOp.LE: ('ble', 'bgt.un'),
+    BinOp.GE: ('bge', 'blt.un'),
+    BinOp.EQUALS: ('beq', 'bne.un'),
+    BinOp.NEQUALS: ('bne.un', 'beq'),
+}
+
+STRING_BUILDER_CLASS = '[mscorlib]System.Text.StringBuilder'
+
+# максимальное кол-во аргументов перегрузок String.Concat(string, ...), для большего - String.Concat(string[])
+CONCAT_MAX_ARGS = 4
+
+MEMO_DENSE = 'dense'
+MEMO_DICT = 'dict'
+# размер таблицы для мемоизации функций от одного Int-параметра (значения вне [0, size) не кэшируются)
+MEMO_DENSE_SIZE = 1024
+MEMO_MAX_BOOL_PARAMS = 10
+MEMO_IMPL_SUFFIX = '__impl'
+MEMO_DICT_CLASS = '[mscorlib]System.Collections.Generic.Dictionary`2'
+
+# метод вычисления хэш-кода строки (см. switch.string_hash) для выбора ветви when по строке
+STRING_HASH_METHOD = '_string_hash'
+
 
 class CodeLabel:
     def __init__(self):
@@ -25,6 +115,19 @@ class CodeLabel:
         return f'L_{self.index}'
 
 
+def format_line(indent: str, code: str, params: Tuple[Any, ...], label: Optional[CodeLabel]) -> str:
+    line = ''
+    if label:
+        line += str(label) + ': '
+    line += indent + code
+    if code.strip() == 'switch':
+        # таблица переходов: switch (L_1, L_2, ...)
+        return line + ' (' + ', '.join(str(p) for p in params) + ')'
+    for p in params:
+        line += ' ' + str(p)
+    return line
+
+
 class CodeLine:
     def __init__(self, code: str, *params: Union[str, CodeLabel], label: CodeLabel = None):
         self.code = code
@@ -32,13 +135,7 @@ class CodeLine:
         self.params = params
 
     def __str__(self):
-        line = ''
-        if self.label:
-            line += str(self.label) + ': '
-        line += self.code
-        for p in self.params:
-            line += ' ' + str(p)
-        return line
+        return format_line('', self.code, self.params, self.label)
 
 
 class MsilException(Exception):
@@ -50,18 +147,68 @@ class MsilException(Exception):
         self.message = message
 
 
-def find_vars_decls(node: AstNode) -> List[VarNode]:
-    vars_nodes: List[VarNode] = []
+def find_vars_decls(node: AstNode) -> List[IdentDesc]:
+    """Поиск объявленных переменных (в т.ч. переменных циклов for)
+    """
+
+    idents: List[IdentDesc] = []
 
     def find(node: AstNode) -> None:
         for n in (node.childs or []):
             if isinstance(n, VarNode):
-                vars_nodes.append(n)
+                idents.append(n.ident.node_ident)
             else:
+                if isinstance(n, ForNode):
+                    idents.append(n.ident.node_ident)
                 find(n)
 
     find(node)
-    return vars_nodes
+    return idents
+
+
+def get_memo_kind(func: FuncNode) -> Optional[str]:
+    """Определение способа мемоизации функции по типам ее параметров
+       (None, если функцию мемоизировать нельзя)
+    """
+
+    if func.type.type.base_type == BaseType.VOID or len(func.params) == 0:
+        return None
+    types = [p.type.type.base_type for p in func.params]
+    if any(t not in (BaseType.INT, BaseType.BOOL) for t in types):
+        return None
+    if types == [BaseType.INT] or (types.count(BaseType.BOOL) == len(types) and len(types) <= MEMO_MAX_BOOL_PARAMS):
+        return MEMO_DENSE
+    if sum(32 if t == BaseType.INT else 1 for t in types) <= 64:
+        return MEMO_DICT
+    return None
+
+
+def get_memo_size(func: FuncNode) -> int:
+    if func.params[0].type.type.base_type == BaseType.INT:
+        return MEMO_DENSE_SIZE
+    return 1 << len(func.params)
+
+
+def get_progression_bounds(start: int, end: int, step: int, op: BinOp) -> Optional[Tuple[int, int]]:
+    """Первое и последнее значения диапазона с известными границами и шагом
+       (None, если диапазон пуст)
+    """
+
+    if op == BinOp.UNTIL:
+        end -= 1
+    if (start > end) if op != BinOp.DOWNTO else (start < end):
+        return None
+    return start, end - (end - start) % step if op != BinOp.DOWNTO else end + (start - end) % step
+
+
+def msil_type_name(type_: TypeDesc) -> str:
+    if type_.array:
+        return msil_type_name(type_.elem_type) + '[]'
+    return MSIL_TYPE_NAMES[type_.base_type]
+
+
+def parallel_class_name(node: ParallelForNode) -> str:
+    return PROGRAM_CLASS_NAME + node.func.name.name
 
 
 def get_msil_type(type) -> str:
@@ -76,40 +223,169 @@ def get_msil_type(type) -> str:
 
 
 class CodeGenerator:
-    def __init__(self):
-        self.code_lines: List[CodeLine] = []
+    def __init__(self, memoize: bool = False, peephole: bool = True, promote_globals: bool = True,
+                 reuse_locals: bool = True, string_builders: bool = True,
+                 main_part_size: int = split.DEFAULT_PART_SIZE, buffered_output: bool = True,
+                 runtime_module: Optional[Tuple[str, bytes]] = None):
+        self.code_lines = CodeBuffer(format_line)
         self.indent = ''
+        self.memoize = memoize
+        self.promote_globals = promote_globals
+        # глобальные переменные, хранящиеся в Main в локальных переменных (-> номер переменной),
+        # для "зеркалируемых" (читаемых в функциях) значение также записывается в поле
+        self.main_slots: Dict[IdentDesc, int] = {}
+        self.mirrored: Set[IdentDesc] = set()
+        self.in_main = False
+        self.locals_line: Optional[CodeLine] = None
+        self.locals: List[Tuple[str, str]] = []
+        self.reuse_locals = reuse_locals
+        self.string_builders = string_builders
+        # циклы, в которых строковые переменные заменяются на StringBuilder (-> переменные),
+        # и номера локальных переменных StringBuilder для генерируемого в данный момент цикла
+        self.builder_loops: Dict[AstNode, List[IdentDesc]] = {}
+        self.builders: Dict[IdentDesc, int] = {}
+        # размер кода, при превышении которого Main разбивается на части (0 - не разбивается)
+        self.main_part_size = main_part_size
+        # вывод среды выполнения буферизован (сбрасывается в конце Main), иначе - сбрасывается после каждой записи
+        self.buffered_output = buffered_output
+        # модуль среды выполнения (имя файла, SHA-1 содержимого), на который ссылается программа,
+        # иначе код среды выполнения собирается в один модуль с программой
+        self.runtime_module = runtime_module
+        scope = f'[.module {runtime_module[0]}]' if runtime_module else ''
+        self.runtime_class = scope + RUNTIME_CLASS_NAME
+        self.parallel_body_class = scope + PARALLEL_BODY_CLASS
+        self.peephole = peephole
+        self.peephole_stats: Optional[Dict[str, int]] = None
+        # максимальная глубина стека вычислений методов (заполняется при получении кода)
+        self.max_stacks: Optional[Dict[str, int]] = None
+        self.memo_kinds: Dict[str, str] = {}
+        self.memo_funcs: Dict[str, FuncNode] = {}
+        # используется метод хэш-кода строк (генерируется в конце программы)
+        self.string_hash_used = False
+        # параллельные циклы, для которых после класса программы генерируются классы-наследники ParallelBody
+        self.parallel_loops: List[ParallelForNode] = []
+        self.report: List[str] = []
 
     def add(self, code: str, *params: Union[str, int, CodeLabel], label: CodeLabel = None):
         if len(code) > 0 and code[-1] == '}':
             self.indent = self.indent[2:]
-        self.code_lines.append(CodeLine(self.indent + str(code), *params, label=label))
+        self.code_lines.add(self.indent + str(code), *params, label=label)
         if len(code) > 0 and code[-1] == '{':
             self.indent = self.indent + '  '
 
+    def finish(self) -> None:
+        """Оконная оптимизация и .maxstack (выполняются один раз, перед первым выводом кода)
+        """
+
+        if self.peephole and self.peephole_stats is None:
+            self.code_lines, self.peephole_stats = peephole_.optimize(self.code_lines)
+        if self.max_stacks is None:
+            self.msil_gen_max_stack()
+
     @property
     def code(self) -> [str, ...]:
-        index = 0
-        for cl in self.code_lines:
-            line = cl.code
-            if cl.label:
-                cl.label.index = index
-                index += 1
-        code: List[str] = []
-        for cl in self.code_lines:
-            code.append(str(cl))
-        return code
+        self.finish()
+        return list(self.code_lines.text())
+
+    def write(self, out: TextIO) -> None:
+        """Вывод кода программы в поток (без построения списка строк)
+        """
+
+        self.finish()
+        self.code_lines.write(out)
+
+    def msil_gen_max_stack(self) -> None:
+        """Добавление .maxstack в каждый метод (по окончательному коду, т.е. после оконной оптимизации)
+        """
+
+        self.max_stacks = {}
+        source = self.code_lines
+        lines = CodeBuffer(format_line)
+        header = None
+        # начало тела метода в исходном буфере и номер строки .maxstack в новом
+        body_start = None
+        max_stack_line = None
+        depth = 0
+        for i in range(len(source)):
+            code = source.texts[source.ops[i]].strip()
+            if code.startswith('.method'):
+                header = code
+            elif code == '{':
+                depth += 1
+                if header is not None and body_start is None:
+                    lines.copy(source, i)
+                    lines.add(' ' * (source.indents[i] + 2) + '.maxstack', 0)
+                    max_stack_line = len(lines) - 1
+                    body_start = i + 1
+                    continue
+            elif code == '}':
+                depth -= 1
+                if body_start is not None and depth == 1:
+                    name = re.search(r'([^\s(]+)\(', header).group(1)
+                    try:
+                        max_stack = stack.max_stack(source[body_start:i],
+                                                    stack.method_return_type(header) != MSIL_TYPE_NAMES[BaseType.VOID])
+                    except stack.StackException as e:
+                        raise MsilException('Метод {}: {}'.format(name, e.message))
+                    lines[max_stack_line].params = (max_stack, )
+                    self.max_stacks[name] = max_stack
+                    header = body_start = None
+            lines.copy(source, i)
+        self.code_lines = lines
 
     def start(self) -> None:
         self.add('.assembly program')
         self.add('{')
         self.add('}')
+        if self.runtime_module:
+            name, hash_ = self.runtime_module
+            self.add(f'.module extern {name}')
+            self.add(f'.file {name} .hash = ({hash_.hex(" ").upper()})')
         self.add('.class public ' + PROGRAM_CLASS_NAME)
         self.add('{')
 
     def end(self) -> None:
         self.add('}')
 
+    def begin_locals(self) -> None:
+        """Начало объявления локальных переменных метода (строка .locals заполняется в end_locals,
+           т.к. временные переменные могут понадобиться во время генерации кода метода)
+        """
+
+        self.locals = []
+        self.add('.locals init ()')
+        self.locals_line = self.code_lines[-1]
+
+    def add_local(self, msil_type: str, name: Optional[str] = None) -> int:
+        index = len(self.locals)
+        self.locals.append((msil_type, name or f'_t{index}'))
+        return index
+
+    def end_locals(self) -> None:
+        if self.reuse_locals and self.locals:
+            self.reallocate_locals()
+        if self.locals:
+            decl = ', '.join(f'{msil_type} {name}' for msil_type, name in self.locals)
+            self.locals_line.code = self.locals_line.code.replace('()', f'({decl})')
+        else:
+            self.code_lines.remove(self.locals_line)
+        self.locals_line = None
+
+    def reallocate_locals(self) -> None:
+        """Переназначение слотов локальных переменных текущего метода (см. slots.allocate)
+        """
+
+        start = self.code_lines.index(self.locals_line) + 1
+        mapping = slots.allocate(self.code_lines[start:], [msil_type for msil_type, _ in self.locals])
+        for line in self.code_lines[start:]:
+            if line.code.strip() in slots.LOAD_OPS + slots.STORE_OPS + slots.ADDRESS_OPS:
+                line.params = (mapping[line.params[0]], *line.params[1:])
+        new_locals: Dict[int, Tuple[str, str]] = {}
+        for index, slot in enumerate(mapping):
+            if slot is not None and slot not in new_locals:
+                new_locals[slot] = self.locals[index]
+        self.locals = [new_locals[slot] for slot in range(len(new_locals))]
+
     @visitor.on('AstNode')
     def msil_gen(self, AstNode):
         """
@@ -132,24 +408,47 @@ class CodeGenerator:
 
     @visitor.when(IdentNode)
     def msil_gen(self, node: IdentNode) -> None:
-        if node.node_ident.scope == ScopeType.LOCAL:
-            self.add('ldloc', node.node_ident.index)
-        elif node.node_ident.scope == ScopeType.PARAM:
-            self.add('ldarg', node.node_ident.index)
-        elif node.node_ident.scope in (ScopeType.GLOBAL, ScopeType.GLOBAL_LOCAL):
-            self.add(
-                f'ldsfld {MSIL_TYPE_NAMES[node.node_ident.type.base_type]} {PROGRAM_CLASS_NAME}::_gv{node.node_ident.index}')
+        self.msil_gen_load(node.node_ident)
+
+    def msil_gen_load(self, ident: IdentDesc) -> None:
+        if ident.scope == ScopeType.LOCAL:
+            self.add('ldloc', ident.index)
+        elif ident.scope == ScopeType.PARAM:
+            self.add('ldarg', ident.index)
+        elif ident.scope in (ScopeType.GLOBAL, ScopeType.GLOBAL_LOCAL):
+            if self.in_main and ident in self.main_slots:
+                self.add('ldloc', self.main_slots[ident])
+            else:
+                self.add(f'ldsfld {msil_type_name(ident.type)} {PROGRAM_CLASS_NAME}::_gv{ident.index}')
+
+    def msil_gen_store(self, ident: IdentDesc) -> None:
+        if ident.scope == ScopeType.LOCAL:
+            self.add('stloc', ident.index)
+        elif ident.scope == ScopeType.PARAM:
+            self.add('starg', ident.index)
+        elif ident.scope in (ScopeType.GLOBAL, ScopeType.GLOBAL_LOCAL):
+            field = f'{msil_type_name(ident.type)} {PROGRAM_CLASS_NAME}::_gv{ident.index}'
+            if self.in_main and ident in self.main_slots:
+                if ident in self.mirrored:
+                    self.add('dup')
+                    self.add(f'stsfld {field}')
+                self.add('stloc', self.main_slots[ident])
+            else:
+                self.add(f'stsfld {field}')
 
     @visitor.when(AssignNode)
     def msil_gen(self, node: AssignNode) -> None:
+        ident = node.var.node_ident
+        if ident in self.builders:
+            # в цикле к переменной значения только добавляются (см. strings.find_string_builders)
+            self.add('ldloc', self.builders[ident])
+            for arg in append_args(node, ident):
+                self.msil_gen(arg)
+                self.add(f'callvirt instance class {STRING_BUILDER_CLASS} {STRING_BUILDER_CLASS}::Append(string)')
+            self.add('pop')
+            return
         self.msil_gen(node.val)
-        var = node.var
-        if var.node_ident.scope == ScopeType.LOCAL:
-            self.add('stloc', var.node_ident.index)
-        elif var.node_ident.scope == ScopeType.PARAM:
-            self.add('starg', var.node_ident.index)
-        elif var.node_ident.scope in (ScopeType.GLOBAL, ScopeType.GLOBAL_LOCAL):
-            self.add(f'stsfld {MSIL_TYPE_NAMES[var.node_ident.type.base_type]} Program::_gv{var.node_ident.index}')
+        self.msil_gen_store(node.var.node_ident)
 
     @visitor.when(VarsNode)
     def msil_gen(self, node: VarsNode) -> None:
@@ -159,28 +458,42 @@ class CodeGenerator:
 
     @visitor.when(VarNode)
     def msil_gen(self, node: VarNode):
+        # Генерация кода для инициализации переменной
         if node.var is not None:
-            if node.type.name == "String":
-                self.add('ldstr', node.var)
-                self.add(f'stsfld string Program::_gv{node.ident.node_ident.index}')
-            elif node.type.name == "Float":
-                self.add('ldc.r8', node.var)
-                self.add(f'stsfld float64 Program::_gv{node.ident.node_ident.index}')
-            elif node.type.name == "Boolean":
-                if node.var.literal == "true":
-                    node.var.literal = "1"
-                self.add('ldc.r8', node.var)
-                self.add(f'stsfld bool Program::_gv{node.ident.node_ident.index}')
-            else:
-                self.add('ldc.i4', node.var)
-                self.add(f'stsfld int32 Program::_gv{node.ident.node_ident.index}')
+            self.msil_gen(node.var)
+            self.msil_gen_store(node.ident.node_ident)
 
-        # Генерация кода для инициализации переменной
-        if isinstance(node.var, AssignNode):
-            node.var.msil_gen(self)
+    def msil_gen_runtime_call(self, ret_type: BaseType, name: str, *param_types: BaseType) -> None:
+        """Вызов метода класса Runtime (или соответствующей ему встроенной операции из INTRINSICS)
+        """
+
+        signature = f'{name}({", ".join(MSIL_TYPE_NAMES[t] for t in param_types)})'
+        if signature in INTRINSICS:
+            for code in INTRINSICS[signature]:
+                self.add(code)
+        else:
+            self.add(f'call {MSIL_TYPE_NAMES[ret_type]} class {self.runtime_class}::{signature}')
+
+    def msil_gen_str_compare(self) -> None:
+        self.msil_gen_runtime_call(BaseType.INT, 'compare', BaseType.STR, BaseType.STR)
 
     @visitor.when(BinOpNode)
     def msil_gen(self, node: BinOpNode) -> None:
+        if node.op in (BinOp.LOGICAL_AND, BinOp.LOGICAL_OR):
+            # вычисление по короткой схеме
+            false_label = CodeLabel()
+            end_label = CodeLabel()
+            self.msil_gen_cond(node, false_label, False)
+            self.add('ldc.i4.1')
+            self.add('br', end_label)
+            self.add('', label=false_label)
+            self.add('ldc.i4.0')
+            self.add('', label=end_label)
+            return
+        if node.op == BinOp.ADD and node.node_type == TypeDesc.STR:
+            self.msil_gen_concat(flatten_concat(node))
+            return
+
         self.msil_gen(node.arg1)
         self.msil_gen(node.arg2)
         if node.op == BinOp.NEQUALS:
@@ -197,46 +510,39 @@ class CodeGenerator:
                 self.add('ceq')
         elif node.op == BinOp.GT:
             if node.arg1.node_type == TypeDesc.STR:
-                self.add(
-                    f'call {MSIL_TYPE_NAMES[BaseType.INT]} class {RUNTIME_CLASS_NAME}::compare({MSIL_TYPE_NAMES[BaseType.STR]}, {MSIL_TYPE_NAMES[BaseType.STR]})')
+                self.msil_gen_str_compare()
                 self.add('ldc.i4.0')
                 self.add('cgt')
             else:
                 self.add('cgt')
         elif node.op == BinOp.LT:
             if node.arg1.node_type == TypeDesc.STR:
-                self.add(
-                    f'call {MSIL_TYPE_NAMES[BaseType.INT]} class {RUNTIME_CLASS_NAME}::compare({MSIL_TYPE_NAMES[BaseType.STR]}, {MSIL_TYPE_NAMES[BaseType.STR]})')
+                self.msil_gen_str_compare()
                 self.add('ldc.i4.0')
                 self.add('clt')
             else:
                 self.add('clt')
         elif node.op == BinOp.GE:
             if node.arg1.node_type == TypeDesc.STR:
-                self.add(
-                    f'call {MSIL_TYPE_NAMES[BaseType.INT]} class {RUNTIME_CLASS_NAME}::compare({MSIL_TYPE_NAMES[BaseType.STR]}, {MSIL_TYPE_NAMES[BaseType.STR]})')
+                self.msil_gen_str_compare()
                 self.add('ldc.i4', '-1')
                 self.add('cgt')
             else:
-                self.add('clt')
+                # для Float: !(a < b или не упорядочены), чтобы сравнение с NaN было ложным
+                self.add('clt.un' if node.arg1.node_type == TypeDesc.FLOAT else 'clt')
                 self.add('ldc.i4.0')
                 self.add('ceq')
         elif node.op == BinOp.LE:
             if node.arg1.node_type == TypeDesc.STR:
-                self.add(
-                    f'call {MSIL_TYPE_NAMES[BaseType.INT]} class {RUNTIME_CLASS_NAME}::compare({MSIL_TYPE_NAMES[BaseType.STR]}, {MSIL_TYPE_NAMES[BaseType.STR]})')
+                self.msil_gen_str_compare()
                 self.add('ldc.i4.1')
                 self.add('clt')
             else:
-                self.add('cgt')
+                self.add('cgt.un' if node.arg1.node_type == TypeDesc.FLOAT else 'cgt')
                 self.add('ldc.i4.0')
                 self.add('ceq')
         elif node.op == BinOp.ADD:
-            if node.arg1.node_type == TypeDesc.STR:
-                self.add(
-                    f'call {MSIL_TYPE_NAMES[BaseType.STR]} class {RUNTIME_CLASS_NAME}::concat({MSIL_TYPE_NAMES[BaseType.STR]}, {MSIL_TYPE_NAMES[BaseType.STR]})')
-            else:
-                self.add('add')
+            self.add('add')
         elif node.op == BinOp.SUB:
             self.add('sub')
         elif node.op == BinOp.MUL:
@@ -245,10 +551,6 @@ class CodeGenerator:
             self.add('div')
         elif node.op == BinOp.MOD:
             self.add('rem')
-        elif node.op == BinOp.LOGICAL_AND:
-            self.add('and')
-        elif node.op == BinOp.LOGICAL_OR:
-            self.add('or')
         elif node.op == BinOp.BIT_AND:
             self.add('and')
         elif node.op == BinOp.BIT_OR:
@@ -256,6 +558,25 @@ class CodeGenerator:
         else:
             pass
 
+    def msil_gen_concat(self, args: List[ExprNode]) -> None:
+        """Конкатенация строк одним вызовом String.Concat (без промежуточных строк)
+        """
+
+        str_type = MSIL_TYPE_NAMES[BaseType.STR]
+        if len(args) <= CONCAT_MAX_ARGS:
+            for arg in args:
+                self.msil_gen(arg)
+            self.add(f'call {str_type} [mscorlib]System.String::Concat({", ".join([str_type] * len(args))})')
+        else:
+            self.add('ldc.i4', len(args))
+            self.add('newarr [mscorlib]System.String')
+            for i, arg in enumerate(args):
+                self.add('dup')
+                self.add('ldc.i4', i)
+                self.msil_gen(arg)
+                self.add('stelem.ref')
+            self.add(f'call {str_type} [mscorlib]System.String::Concat({str_type}[])')
+
     @visitor.when(TypeConvertNode)
     def msil_gen(self, node: TypeConvertNode) -> None:
         self.msil_gen(node.expr)
@@ -268,125 +589,867 @@ class CodeGenerator:
             self.add('ldc.i4.0')
             self.add('ceq')
         else:
-            cmd = f'call {MSIL_TYPE_NAMES[node.node_type.base_type]} class {RUNTIME_CLASS_NAME}::convert({MSIL_TYPE_NAMES[node.expr.node_type.base_type]})'
-            self.add(cmd)
+            self.msil_gen_runtime_call(node.node_type.base_type, 'convert', node.expr.node_type.base_type)
+
+    @visitor.when(IndexNode)
+    def msil_gen(self, node: IndexNode) -> None:
+        self.msil_gen(node.array)
+        self.msil_gen(node.index)
+        self.add(f'ldelem.{MSIL_ELEM_SUFFIXES[node.node_type.base_type]}')
+
+    @visitor.when(IndexAssignNode)
+    def msil_gen(self, node: IndexAssignNode) -> None:
+        self.msil_gen(node.target.array)
+        self.msil_gen(node.target.index)
+        self.msil_gen(node.val)
+        self.add(f'stelem.{MSIL_STORE_ELEM_SUFFIXES[node.val.node_type.base_type]}')
+
+    @visitor.when(MemberNode)
+    def msil_gen(self, node: MemberNode) -> None:
+        # единственное свойство - size у массива
+        self.msil_gen(node.obj)
+        self.add('ldlen')
+        self.add('conv.i4')
+
+    def msil_gen_new_array(self, elem_type: TypeDesc) -> None:
+        """Создание массива (размер - на вершине стека)
+        """
+
+        self.add(f'newarr {msil_type_name(elem_type)}')
+        if elem_type.base_type != BaseType.STR:
+            return
+        # элементы Array<String> - пустые строки (а не null)
+        array = self.add_local(msil_type_name(TypeDesc.array_of(elem_type)))
+        index = self.add_local(MSIL_TYPE_NAMES[BaseType.INT])
+        body_label = CodeLabel()
+        cond_label = CodeLabel()
+        self.add('stloc', array)
+        self.add('ldc.i4.0')
+        self.add('stloc', index)
+        self.add('br', cond_label)
+        self.add('', label=body_label)
+        self.add('ldloc', array)
+        self.add('ldloc', index)
+        self.add('ldstr ""')
+        self.add('stelem.ref')
+        self.add('ldloc', index)
+        self.add('ldc.i4.1')
+        self.add('add')
+        self.add('stloc', index)
+        self.add('', label=cond_label)
+        self.add('ldloc', index)
+        self.add('ldloc', array)
+        self.add('ldlen')
+        self.add('conv.i4')
+        self.add('blt', body_label)
+        self.add('ldloc', array)
 
     @visitor.when(CallNode)
     def msil_gen(self, node: CallNode) -> None:
         for param in node.params:
             self.msil_gen(param)
-        class_name = RUNTIME_CLASS_NAME if node.func.node_ident.built_in else PROGRAM_CLASS_NAME
-        param_types = ', '.join(MSIL_TYPE_NAMES[param.node_type.base_type] for param in node.params)
-        cmd = f'call {MSIL_TYPE_NAMES[node.node_type.base_type]} class {class_name}::{node.func.name}({param_types})'
-        self.add(cmd)
+        if node.func.node_ident.built_in and node.node_type.array:
+            self.msil_gen_new_array(node.node_type.elem_type)
+            return
+        if node.func.node_ident.built_in:
+            self.msil_gen_runtime_call(node.node_type.base_type, node.func.name,
+                                       *(param.node_type.base_type for param in node.params))
+            return
+        param_types = ', '.join(msil_type_name(param.node_type) for param in node.params)
+        self.add(f'call {msil_type_name(node.node_type)} class {PROGRAM_CLASS_NAME}::{node.func.name}({param_types})')
 
     @visitor.when(ReturnNode)
     def msil_gen(self, node: ReturnNode) -> None:
         self.msil_gen(node.val)
         self.add('ret')
 
+    def msil_gen_cond(self, node: ExprNode, label: CodeLabel, jump_if: bool) -> None:
+        """Генерация условного перехода на label, если значение условия node равно jump_if
+           (&& и || вычисляются по короткой схеме, сравнения объединяются с переходом)
+        """
+
+        if isinstance(node, BinOpNode) and node.op in (BinOp.LOGICAL_AND, BinOp.LOGICAL_OR):
+            # для && сразу выполняется переход по false, для || - по true
+            direct = node.op == BinOp.LOGICAL_OR
+            if jump_if == direct:
+                self.msil_gen_cond(node.arg1, label, jump_if)
+                self.msil_gen_cond(node.arg2, label, jump_if)
+            else:
+                skip_label = CodeLabel()
+                self.msil_gen_cond(node.arg1, skip_label, not jump_if)
+                self.msil_gen_cond(node.arg2, label, jump_if)
+                self.add('', label=skip_label)
+        elif isinstance(node, BinOpNode) and node.op in COMPARE_BRANCHES:
+            arg_type = node.arg1.node_type.base_type
+            self.msil_gen(node.arg1)
+            self.msil_gen(node.arg2)
+            branches = FLOAT_COMPARE_BRANCHES if arg_type == BaseType.FLOAT else COMPARE_BRANCHES
+            if arg_type == BaseType.STR:
+                if node.op in (BinOp.EQUALS, BinOp.NEQUALS):
+                    self.add('call bool [mscorlib]System.String::op_Equality(string, string)')
+                    self.add('brtrue' if jump_if == (node.op == BinOp.EQUALS) else 'brfalse', label)
+                    return
+                self.msil_gen_str_compare()
+                self.add('ldc.i4.0')
+            self.add(branches[node.op][0 if jump_if else 1], label)
+        elif isinstance(node, TypeConvertNode) and node.node_type.base_type == BaseType.BOOL and \
+                node.expr.node_type.base_type == BaseType.INT:
+            self.msil_gen(node.expr)
+            self.add('brtrue' if jump_if else 'brfalse', label)
+        elif isinstance(node, LiteralNode):
+            if node.value == jump_if:
+                self.add('br', label)
+        else:
+            self.msil_gen(node)
+            self.add('brtrue' if jump_if else 'brfalse', label)
+
+    def msil_gen_builders_begin(self, loop: AstNode) -> None:
+        for ident in self.builder_loops.get(loop, []):
+            self.builders[ident] = self.add_local(f'class {STRING_BUILDER_CLASS}')
+            self.msil_gen_load(ident)
+            self.add(f'newobj instance void {STRING_BUILDER_CLASS}::.ctor(string)')
+            self.add('stloc', self.builders[ident])
+
+    def msil_gen_builders_end(self, loop: AstNode) -> None:
+        for ident in self.builder_loops.get(loop, []):
+            self.add('ldloc', self.builders.pop(ident))
+            self.add(f'callvirt instance string {STRING_BUILDER_CLASS}::ToString()')
+            self.msil_gen_store(ident)
+
     @visitor.when(IfNode)
     def msil_gen(self, node: IfNode) -> None:
         else_label = CodeLabel()
         end_label = CodeLabel()
 
-        self.msil_gen(node.cond)
-        self.add('brfalse', else_label)
-        self.msil_gen(node.then_stmt)
-        self.add('br', end_label)
+        self.msil_gen_cond(node.cond, else_label, False)
+        self.msil_gen_stmt(node.then_stmt)
+        if node.else_stmt:
+            self.add('br', end_label)
         self.add('', label=else_label)
         if node.else_stmt:
-            self.msil_gen(node.else_stmt)
-        self.add('', label=end_label)
-
-        # @visitor.when(IfNode)
-        # def msil_gen(self, node: IfNode) -> None:
-        #     else_label = CodeLabel()
-        #     end_label = CodeLabel()
-        #     self.msil_gen(node.cond)
-        #     self.add('brfalse', else_label)
-        #     self.msil_gen(node.then_stmt)
-        #     self.add('br', end_label)
-        #     self.add('', label=else_label)
-        #     if node.else_stmt:
-        #         self.msil_gen(node.else_stmt)
-        #     self.add('', label=end_label)
+            self.msil_gen_stmt(node.else_stmt)
+            self.add('', label=end_label)
 
     @visitor.when(WhileNode)
     def msil_gen(self, node: WhileNode) -> None:
-        start_label = CodeLabel()
+        # цикл "переворачивается": проверка перед входом в цикл и проверка в конце тела,
+        # так на каждой итерации выполняется только один условный переход
+        body_label = CodeLabel()
         end_label = CodeLabel()
-        self.add('', label=start_label)
-        self.msil_gen(node.cond)
-        end_label = CodeLabel()
-        self.add('brfalse', end_label)
-        self.msil_gen(node.body)
-        self.add('br', start_label)
+        self.msil_gen_builders_begin(node)
+        self.msil_gen_cond(node.cond, end_label, False)
+        self.add('', label=body_label)
+        self.msil_gen_stmt(node.body)
+        self.msil_gen_cond(node.cond, body_label, True)
         self.add('', label=end_label)
+        self.msil_gen_builders_end(node)
+
+    @visitor.when(DoWhileNode)
+    def msil_gen(self, node: DoWhileNode) -> None:
+        body_label = CodeLabel()
+        self.msil_gen_builders_begin(node)
+        self.add('', label=body_label)
+        self.msil_gen_stmt(node.body)
+        self.msil_gen_cond(node.condition, body_label, True)
+        self.msil_gen_builders_end(node)
 
     @visitor.when(ForNode)
     def msil_gen(self, node: ForNode) -> None:
-        start_label = CodeLabel()
+        # объект диапазона не создается: переменная цикла - счетчик, последнее значение и шаг вычисляются
+        # один раз до цикла; выход по равенству с последним значением, поэтому переполнения нет
+        # (как у Kotlin для IntProgression)
+        seq: SeqNode = node.range
+        ident = node.ident.node_ident
+        down = seq.seqOp == BinOp.DOWNTO
+        step = seq.stepArg.value if isinstance(seq.stepArg, LiteralNode) else None if seq.stepArg else 1
+        body_label = CodeLabel()
         end_label = CodeLabel()
-        self.msil_gen(node.init)
-        self.add('', label=start_label)
-        self.msil_gen(node.cond)
+
+        array = bounds_.indexed_array(node)
+        if array is not None and self.is_local(array):
+            self.msil_gen_array_for(node, array)
+            return
+
+        bounds = None
+        if isinstance(seq.startArg, LiteralNode) and isinstance(seq.endArg, LiteralNode) and step is not None:
+            bounds = get_progression_bounds(seq.startArg.value, seq.endArg.value, step, seq.seqOp)
+            if bounds is None:
+                # пустой диапазон
+                return
+
+        self.msil_gen_builders_begin(node)
+        self.msil_gen(seq.startArg)
+        self.msil_gen_store(ident)
+        if bounds is not None:
+            last = None
+        else:
+            last = self.add_local(MSIL_TYPE_NAMES[BaseType.INT])
+            self.msil_gen(seq.endArg)
+            self.add('stloc', last)
+        step_local = None
+        if step is None:
+            step_local = self.add_local(MSIL_TYPE_NAMES[BaseType.INT])
+            step_ok_label = CodeLabel()
+            self.msil_gen(seq.stepArg)
+            self.add('dup')
+            self.add('stloc', step_local)
+            self.add('ldc.i4.0')
+            self.add('bgt', step_ok_label)
+            self.add('ldstr "Step must be positive."')
+            self.add('newobj instance void [mscorlib]System.ArgumentException::.ctor(string)')
+            self.add('throw')
+            self.add('', label=step_ok_label)
+
+        def load_step():
+            if step_local is None:
+                self.add('ldc.i4', step)
+            else:
+                self.add('ldloc', step_local)
+
+        if last is not None:
+            # пустой диапазон; для until граница не входит в диапазон (a until Int.MIN_VALUE всегда пуст)
+            self.msil_gen_load(ident)
+            self.add('ldloc', last)
+            self.add('bge' if seq.seqOp == BinOp.UNTIL else 'blt' if down else 'bgt', end_label)
+            if seq.seqOp == BinOp.UNTIL:
+                self.add('ldloc', last)
+                self.add('ldc.i4.1')
+                self.add('sub')
+                self.add('stloc', last)
+            if step != 1:
+                # последнее значение: граница минус остаток от деления длины диапазона на шаг
+                # (длина вычисляется без знака, т.к. может превышать Int.MAX_VALUE)
+                self.add('ldloc', last)
+                if down:
+                    self.msil_gen_load(ident)
+                    self.add('ldloc', last)
+                else:
+                    self.add('ldloc', last)
+                    self.msil_gen_load(ident)
+                self.add('sub')
+                load_step()
+                self.add('rem.un')
+                self.add('add' if down else 'sub')
+                self.add('stloc', last)
+
+        self.add('', label=body_label)
+        self.msil_gen_stmt(node.body)
+        # значение до изменения сравнивается с последним (после последней итерации счетчик может переполниться,
+        # но вне цикла переменная не видна)
+        self.msil_gen_load(ident)
+        self.add('dup')
+        load_step()
+        self.add('sub' if down else 'add')
+        self.msil_gen_store(ident)
+        if last is None:
+            self.add('ldc.i4', bounds[1])
+        else:
+            self.add('ldloc', last)
+        self.add('bne.un', body_label)
+        self.add('', label=end_label)
+        self.msil_gen_builders_end(node)
+
+    def is_local(self, ident: IdentDesc) -> bool:
+        return ident.scope in (ScopeType.LOCAL, ScopeType.PARAM) or (self.in_main and ident in self.main_slots)
+
+    def msil_gen_array_for(self, node: ForNode, array: IdentDesc) -> None:
+        """Цикл по индексам массива (см. bounds.indexed_array) в виде for (i = start; i < a.Length; i++),
+           для которого JIT исключает проверки границ при обращении к a[i]
+        """
+
+        ident = node.ident.node_ident
+        body_label = CodeLabel()
+        cond_label = CodeLabel()
+        self.msil_gen_builders_begin(node)
+        self.msil_gen(node.range.startArg)
+        self.msil_gen_store(ident)
+        self.add('br', cond_label)
+        self.add('', label=body_label)
+        self.msil_gen_stmt(node.body)
+        self.msil_gen_load(ident)
+        self.add('ldc.i4.1')
+        self.add('add')
+        self.msil_gen_store(ident)
+        self.add('', label=cond_label)
+        self.msil_gen_load(ident)
+        self.msil_gen_load(array)
+        self.add('ldlen')
+        self.add('conv.i4')
+        self.add('blt', body_label)
+        self.msil_gen_builders_end(node)
+
+    @visitor.when(ParallelForNode)
+    def msil_gen(self, node: ParallelForNode) -> None:
+        body = self.msil_gen_parallel(node)
+        self.add('pop')
+        self.add('ldloc', body)
+        self.add(f'callvirt instance void class {self.parallel_body_class}::execute()')
+
+    @visitor.when(ParallelReduceNode)
+    def msil_gen(self, node: ParallelReduceNode) -> None:
+        # результаты частей диапазона записываются в массив, который затем сворачивается функцией node.fold
+        cls = parallel_class_name(node)
+        results_type = msil_type_name(TypeDesc.array_of(node.node_type))
+        body = self.msil_gen_parallel(node)
+        count = self.add_local(MSIL_TYPE_NAMES[BaseType.INT])
+        self.add('stloc', count)
+        if node.op != parallel_.SUM:
+            # минимум и максимум пустого диапазона не определены
+            not_empty_label = CodeLabel()
+            self.add('ldloc', count)
+            self.add('brtrue', not_empty_label)
+            self.add('ldstr "Range is empty."')
+            self.add('newobj instance void [mscorlib]System.InvalidOperationException::.ctor(string)')
+            self.add('throw')
+            self.add('', label=not_empty_label)
+        self.add('ldloc', body)
+        self.add('ldloc', count)
+        self.add(f'newarr {msil_type_name(node.node_type)}')
+        self.add(f'stfld {results_type} {cls}::_results')
+        self.add('ldloc', body)
+        self.add(f'callvirt instance void class {self.parallel_body_class}::execute()')
+        self.add('ldloc', body)
+        self.add(f'ldfld {results_type} {cls}::_results')
+        self.add(f'call {msil_type_name(node.node_type)} class {PROGRAM_CLASS_NAME}::{node.fold.name.name}({results_type})')
+
+    def msil_gen_parallel(self, node: ParallelForNode) -> int:
+        """Создание объекта с телом параллельного цикла (класса-наследника ParallelBody, см. msil_gen_parallel_class),
+           разбиение диапазона на части и запись в поля объекта захваченных телом значений
+           (после вычисления границ диапазона, как и в последовательном цикле)
+        :return: номер локальной переменной с объектом (кол-во частей диапазона остается на вершине стека)
+        """
+
+        if node not in self.parallel_loops:
+            self.parallel_loops.append(node)
+        cls = parallel_class_name(node)
+        body = self.add_local(f'class {cls}')
+        self.add(f'newobj instance void class {cls}::.ctor()')
+        self.add('stloc', body)
+        self.add('ldloc', body)
+        self.msil_gen(node.range.startArg)
+        self.msil_gen(node.range.endArg)
+        self.add('ldc.i4', 1 if node.range.seqOp == BinOp.UNTIL else 0)
+        self.add(f'callvirt instance int32 class {self.parallel_body_class}::split(int32, int32, bool)')
+        for k, param in enumerate(node.call.params):
+            self.add('ldloc', body)
+            self.msil_gen(param)
+            self.add(f'stfld {msil_type_name(param.node_type)} {cls}::_c{k}')
+        return body
+
+    def msil_gen_parallel_class(self, node: ParallelForNode) -> None:
+        """Класс-наследник ParallelBody для параллельного цикла: поля с захваченными телом значениями
+           (и результатами частей диапазона для свертки), метод run вызывает функцию с телом цикла (см. parallel.lower)
+           для одной части диапазона
+        """
+
+        cls = parallel_class_name(node)
+        func = node.func
+        reduce = isinstance(node, ParallelReduceNode)
+        results_type = msil_type_name(TypeDesc.array_of(node.node_type)) if reduce else None
+        # последние два параметра функции - границы части диапазона
+        captured = func.params[:-2]
+        self.add('')
+        self.add(f'.class private auto ansi sealed {cls} extends {self.parallel_body_class}')
+        self.add('{')
+        for k, param in enumerate(captured):
+            self.add(f'.field public {msil_type_name(param.type.type)} _c{k}')
+        if reduce:
+            self.add(f'.field public {results_type} _results')
+        self.add('.method public hidebysig specialname rtspecialname instance void .ctor() cil managed')
+        self.add('{')
+        self.add('ldarg', 0)
+        self.add(f'call instance void class {self.parallel_body_class}::.ctor()')
+        self.add('ret')
+        self.add('}')
+        self.add('.method family hidebysig virtual instance void run(int32 part, int32 first, int32 last) cil managed')
+        self.add('{')
+        if reduce:
+            self.add('ldarg', 0)
+            self.add(f'ldfld {results_type} {cls}::_results')
+            self.add('ldarg', 1)
+        for k, param in enumerate(captured):
+            self.add('ldarg', 0)
+            self.add(f'ldfld {msil_type_name(param.type.type)} {cls}::_c{k}')
+        self.add('ldarg', 2)
+        self.add('ldarg', 3)
+        param_types = ', '.join(msil_type_name(p.type.type) for p in func.params)
+        self.add(f'call {msil_type_name(func.type.type)} class {PROGRAM_CLASS_NAME}::{func.name.name}({param_types})')
+        if reduce:
+            self.add(f'stelem.{MSIL_STORE_ELEM_SUFFIXES[node.node_type.base_type]}')
+        self.add('ret')
+        self.add('}')
+        self.add('}')
+
+    @visitor.when(WhenNode)
+    def msil_gen(self, node: WhenNode) -> None:
+        self.msil_gen_when(node)
+
+    @visitor.when(WhenExprNode)
+    def msil_gen(self, node: WhenExprNode) -> None:
+        self.msil_gen_when(node)
+
+    def msil_gen_when(self, node: WhenNode) -> None:
+        """Генерация when: значение выражения сохраняется во временную переменную, ветвь выбирается
+           таблицей переходов switch и/или бинарным поиском (условия - Int-константы и диапазоны с константными
+           границами), по хэш-коду (String-константы), иначе - сравнениями в порядке следования условий
+           (для выражения when каждая ветвь оставляет в стеке свое значение)
+        """
+
+        subject_type = node.subject.node_type.base_type
+        subject = self.add_local(MSIL_TYPE_NAMES[subject_type])
+        self.msil_gen(node.subject)
+        self.add('stloc', subject)
+        labels = [CodeLabel() for _ in node.branches]
+        end_label = CodeLabel()
+        default_label = labels[-1] if node.else_branch else end_label
+        cases = [(cond, label) for branch, label in zip(node.branches, labels) for cond in branch.conds]
+
+        if subject_type == BaseType.INT and all(switch.cond_bounds(cond) is not None for cond, _ in cases):
+            intervals = [(*switch.cond_bounds(cond), label) for cond, label in cases]
+            self.msil_gen_int_dispatch(subject, switch.case_intervals(intervals), default_label)
+        elif subject_type == BaseType.STR and all(isinstance(cond, LiteralNode) for cond, _ in cases) and \
+                len({cond.value for cond, _ in cases}) >= switch.STRING_HASH_MIN_CASES:
+            self.msil_gen_string_dispatch(subject, [(cond.value, label) for cond, label in cases], default_label)
+        else:
+            for cond, label in cases:
+                self.msil_gen_when_cond(subject, cond, label)
+            self.add('br', default_label)
+
+        for branch, label in zip(node.branches, labels):
+            self.add('', label=label)
+            if isinstance(node, WhenExprNode):
+                self.msil_gen(branch.body)
+            else:
+                self.msil_gen_stmt(branch.body)
+            self.add('br', end_label)
+        self.add('', label=end_label)
+
+    def msil_gen_when_cond(self, subject: int, cond: ExprNode, label: CodeLabel) -> None:
+        """Переход на label, если значение переменной subject удовлетворяет условию ветви when
+        """
+
+        if isinstance(cond, WhenInNode):
+            # границы вычисляются в порядке записи (начало, затем конец диапазона)
+            seq = cond.range
+            down = seq.seqOp == BinOp.DOWNTO
+            skip_label = CodeLabel()
+            self.add('ldloc', subject)
+            self.msil_gen(seq.startArg)
+            self.add('bgt' if down else 'blt', skip_label)
+            self.add('ldloc', subject)
+            self.msil_gen(seq.endArg)
+            self.add('bge' if down else 'blt' if seq.seqOp == BinOp.UNTIL else 'ble', label)
+            self.add('', label=skip_label)
+        else:
+            self.add('ldloc', subject)
+            self.msil_gen(cond)
+            if cond.node_type == TypeDesc.STR:
+                self.add('call bool [mscorlib]System.String::op_Equality(string, string)')
+                self.add('brtrue', label)
+            else:
+                self.add('beq', label)
+
+    def msil_gen_int_dispatch(self, subject: int, intervals: List[switch.Interval], default_label: CodeLabel) -> None:
+        """Переход на ветвь по значению Int-переменной subject (интервалы - см. switch.case_intervals):
+           плотные значения - таблицей переходов switch, редкие - бинарным поиском по интервалам
+        """
+
+        if switch.is_dense(intervals):
+            lo = intervals[0][0]
+            table = [default_label] * (intervals[-1][1] - lo + 1)
+            for a, b, label in intervals:
+                for value in range(a, b + 1):
+                    table[value - lo] = label
+            self.add('ldloc', subject)
+            if lo != 0:
+                self.add('ldc.i4', lo)
+                self.add('sub')
+            # значения вне таблицы (в т.ч. меньшие lo - при беззнаковом сравнении) проходят дальше
+            self.add('switch', *table)
+        elif len(intervals) <= switch.LINEAR_MAX_CASES:
+            for a, b, label in intervals:
+                self.add('ldloc', subject)
+                if a == b:
+                    self.add('ldc.i4', a)
+                    self.add('beq', label)
+                else:
+                    # a <= x <= b  <=>  (x - a) <= (b - a) без знака
+                    if a != 0:
+                        self.add('ldc.i4', a)
+                        self.add('sub')
+                    self.add('ldc.i4', switch.to_int32(b - a))
+                    self.add('ble.un', label)
+        else:
+            mid = len(intervals) // 2
+            right_label = CodeLabel()
+            self.add('ldloc', subject)
+            self.add('ldc.i4', intervals[mid][0])
+            self.add('bge', right_label)
+            self.msil_gen_int_dispatch(subject, intervals[:mid], default_label)
+            self.add('', label=right_label)
+            self.msil_gen_int_dispatch(subject, intervals[mid:], default_label)
+            return
+        self.add('br', default_label)
+
+    def msil_gen_string_dispatch(self, subject: int, cases: List[Tuple[str, CodeLabel]],
+                                 default_label: CodeLabel) -> None:
+        """Переход на ветвь по значению String-переменной subject: выбор группы строк по хэш-коду
+           (см. msil_gen_int_dispatch), затем сравнение со строками группы
+        """
+
+        self.string_hash_used = True
+        buckets = switch.string_buckets(cases)
+        bucket_labels = {h: CodeLabel() for h in buckets}
+        hash_local = self.add_local(MSIL_TYPE_NAMES[BaseType.INT])
+        self.add('ldloc', subject)
+        self.add(f'call int32 class {PROGRAM_CLASS_NAME}::{STRING_HASH_METHOD}(string)')
+        self.add('stloc', hash_local)
+        self.msil_gen_int_dispatch(hash_local, switch.case_intervals(
+            [(h, h, label) for h, label in bucket_labels.items()]), default_label)
+        for h, bucket in buckets.items():
+            self.add('', label=bucket_labels[h])
+            for value, label in bucket:
+                self.add('ldloc', subject)
+                self.add(f'ldstr "{value}"')
+                self.add('call bool [mscorlib]System.String::op_Equality(string, string)')
+                self.add('brtrue', label)
+            self.add('br', default_label)
+
+    def msil_gen_string_hash(self) -> None:
+        """Метод вычисления хэш-кода строки FNV-1a (см. switch.string_hash), для null - начальное значение
+        """
+
+        loop_label = CodeLabel()
+        cond_label = CodeLabel()
+        end_label = CodeLabel()
+        self.add('')
+        self.add(f'.method private static int32 {STRING_HASH_METHOD}(string s) cil managed')
+        self.add('{')
+        self.begin_locals()
+        h = self.add_local(MSIL_TYPE_NAMES[BaseType.INT], '_h')
+        i = self.add_local(MSIL_TYPE_NAMES[BaseType.INT], '_i')
+        self.add('ldc.i4', switch.to_int32(switch.FNV_OFFSET_BASIS))
+        self.add('stloc', h)
+        self.add('ldarg', 0)
         self.add('brfalse', end_label)
-        self.msil_gen(node.body)
-        # self.msil_gen(node.step)
-        self.add('br', start_label)
+        self.add('ldc.i4', 0)
+        self.add('stloc', i)
+        self.add('br', cond_label)
+        self.add('', label=loop_label)
+        self.add('ldloc', h)
+        self.add('ldarg', 0)
+        self.add('ldloc', i)
+        self.add('callvirt instance char [mscorlib]System.String::get_Chars(int32)')
+        self.add('xor')
+        self.add('ldc.i4', switch.FNV_PRIME)
+        self.add('mul')
+        self.add('stloc', h)
+        self.add('ldloc', i)
+        self.add('ldc.i4', 1)
+        self.add('add')
+        self.add('stloc', i)
+        self.add('', label=cond_label)
+        self.add('ldloc', i)
+        self.add('ldarg', 0)
+        self.add('callvirt instance int32 [mscorlib]System.String::get_Length()')
+        self.add('blt', loop_label)
         self.add('', label=end_label)
+        self.add('ldloc', h)
+        self.add('ret')
+        self.end_locals()
+        self.add('}')
 
     @visitor.when(FuncNode)
     def msil_gen(self, func: FuncNode) -> None:
+        name = func.name.name
+        if name in self.memo_kinds:
+            self.msil_gen_memo_wrapper(func, self.memo_kinds[name])
+            name += MEMO_IMPL_SUFFIX
         params = ''
         for p in func.params:
             if len(params) > 0:
                 params += ', '
-            params += f'{MSIL_TYPE_NAMES[p.type.type.base_type]} {str(p.name.name)}'
-        self.add(f'.method public static {MSIL_TYPE_NAMES[func.type.type.base_type]} {func.name}({params}) cil managed')
+            params += f'{msil_type_name(p.type.type)} {str(p.name.name)}'
+        self.add(f'.method public static {msil_type_name(func.type.type)} {name}({params}) cil managed')
+        self.add('{')
+
+        self.begin_locals()
+        local_idents = sorted((ident for ident in find_vars_decls(func) if ident.scope == ScopeType.LOCAL),
+                              key=lambda ident: ident.index)
+        for ident in local_idents:
+            self.add_local(msil_type_name(ident.type), f'_v{ident.index}')
+        self.msil_gen_stmt(func.body)
+        if func.type.type.base_type == BaseType.VOID:
+            self.add('ret')
+        self.end_locals()
+        self.add('}')
+
+    def msil_gen_call_args(self, func: FuncNode, name: str) -> None:
+        for i in range(len(func.params)):
+            self.add('ldarg', i)
+        param_types = ', '.join(msil_type_name(p.type.type) for p in func.params)
+        self.add(f'call {msil_type_name(func.type.type)} class {PROGRAM_CLASS_NAME}::{name}({param_types})')
+
+    def msil_gen_memo_wrapper(self, func: FuncNode, kind: str) -> None:
+        """Генерация функции-обертки с таблицей мемоизации,
+           само тело функции генерируется в метод с суффиксом MEMO_IMPL_SUFFIX
+           (рекурсивные вызовы при этом идут через обертку)
+        """
+
+        name = func.name.name
+        impl_name = name + MEMO_IMPL_SUFFIX
+        ret_type = msil_type_name(func.type.type)
+        types = [p.type.type.base_type for p in func.params]
+        params = ', '.join(f'{msil_type_name(p.type.type)} {p.name.name}' for p in func.params)
+        fill_label = CodeLabel()
+
+        self.add(f'.method public static {ret_type} {name}({params}) cil managed')
         self.add('{')
+        if kind == MEMO_DENSE:
+            direct_label = CodeLabel()
+            self.add(f'.locals init (int32 _k, {ret_type} _r)')
+            for i in range(len(types)):
+                self.add('ldarg', i)
+                if i > 0:
+                    self.add('ldc.i4', i)
+                    self.add('shl')
+                    self.add('or')
+            self.add('stloc', 0)
+            if types == [BaseType.INT]:
+                # отрицательные значения после беззнакового сравнения тоже окажутся вне таблицы
+                self.add('ldloc', 0)
+                self.add('ldc.i4', MEMO_DENSE_SIZE)
+                self.add('bge.un', direct_label)
+            self.add(f'ldsfld bool[] {PROGRAM_CLASS_NAME}::_memo_{name}_f')
+            self.add('ldloc', 0)
+            self.add('ldelem.u1')
+            self.add('brfalse', fill_label)
+            self.add(f'ldsfld {ret_type}[] {PROGRAM_CLASS_NAME}::_memo_{name}_v')
+            self.add('ldloc', 0)
+            self.add(f'ldelem.{MSIL_ELEM_SUFFIXES[func.type.type.base_type]}')
+            self.add('ret')
+            self.add('', label=fill_label)
+            self.msil_gen_call_args(func, impl_name)
+            self.add('stloc', 1)
+            self.add(f'ldsfld {ret_type}[] {PROGRAM_CLASS_NAME}::_memo_{name}_v')
+            self.add('ldloc', 0)
+            self.add('ldloc', 1)
+            elem_suffix = MSIL_ELEM_SUFFIXES[func.type.type.base_type]
+            self.add(f'stelem.{"i1" if elem_suffix == "u1" else elem_suffix}')
+            self.add(f'ldsfld bool[] {PROGRAM_CLASS_NAME}::_memo_{name}_f')
+            self.add('ldloc', 0)
+            self.add('ldc.i4', 1)
+            self.add('stelem.i1')
+            self.add('ldloc', 1)
+            self.add('ret')
+            if types == [BaseType.INT]:
+                self.add('', label=direct_label)
+                self.msil_gen_call_args(func, impl_name)
+                self.add('ret')
+        else:
+            dict_type = f'class {MEMO_DICT_CLASS}<int64, {ret_type}>'
+            self.add(f'.locals init (int64 _k, {ret_type} _r)')
+            offset = 0
+            for i, t in enumerate(types):
+                self.add('ldarg', i)
+                self.add('conv.u8')
+                if offset > 0:
+                    self.add('ldc.i4', offset)
+                    self.add('shl')
+                    self.add('or')
+                offset += 32 if t == BaseType.INT else 1
+            self.add('stloc', 0)
+            self.add(f'ldsfld {dict_type} {PROGRAM_CLASS_NAME}::_memo_{name}')
+            self.add('ldloc', 0)
+            self.add('ldloca', 1)
+            self.add(f'callvirt instance bool {dict_type}::TryGetValue(!0, !1&)')
+            self.add('brfalse', fill_label)
+            self.add('ldloc', 1)
+            self.add('ret')
+            self.add('', label=fill_label)
+            self.msil_gen_call_args(func, impl_name)
+            self.add('stloc', 1)
+            self.add(f'ldsfld {dict_type} {PROGRAM_CLASS_NAME}::_memo_{name}')
+            self.add('ldloc', 0)
+            self.add('ldloc', 1)
+            self.add(f'callvirt instance void {dict_type}::set_Item(!0, !1)')
+            self.add('ldloc', 1)
+            self.add('ret')
+        self.add('}')
 
-        local_vars_decls = find_vars_decls(func)
-        decl = '.locals init ('
-        count = 0
-        for node in local_vars_decls:
-            if node.ident.node_ident.scope in (ScopeType.LOCAL,):
-                if count > 0:
-                    decl += ', '
-                msil_type = get_msil_type(node.type.name)
-                decl += f'{msil_type} _v{node.ident.node_ident.index}'
-                count += 1
-        decl += ')'
-        if count > 0:
-            self.add(decl)
-        self.msil_gen(func.body)
+    def msil_gen_memo_fields(self) -> None:
+        for name, kind in self.memo_kinds.items():
+            func = self.memo_funcs[name]
+            ret_type = msil_type_name(func.type.type)
+            if kind == MEMO_DENSE:
+                self.add(f'.field private static bool[] _memo_{name}_f')
+                self.add(f'.field private static {ret_type}[] _memo_{name}_v')
+            else:
+                self.add(f'.field private static class {MEMO_DICT_CLASS}<int64, {ret_type}> _memo_{name}')
+
+    def msil_gen_memo_init(self) -> None:
+        """Статический конструктор класса программы, создающий таблицы мемоизации
+        """
+
+        self.add('.method private hidebysig specialname rtspecialname static void .cctor() cil managed')
+        self.add('{')
+        for name, kind in self.memo_kinds.items():
+            func = self.memo_funcs[name]
+            ret_type = msil_type_name(func.type.type)
+            if kind == MEMO_DENSE:
+                size = get_memo_size(func)
+                for suffix, elem_type in (('f', 'bool'), ('v', ret_type)):
+                    self.add('ldc.i4', size)
+                    self.add(f'newarr {elem_type}')
+                    self.add(f'stsfld {elem_type}[] {PROGRAM_CLASS_NAME}::_memo_{name}_{suffix}')
+            else:
+                dict_type = f'class {MEMO_DICT_CLASS}<int64, {ret_type}>'
+                self.add(f'newobj instance void {dict_type}::.ctor()')
+                self.add(f'stsfld {dict_type} {PROGRAM_CLASS_NAME}::_memo_{name}')
+        self.add('ret')
+        self.add('}')
+
+    def plan_memoization(self, prog: StmtListNode) -> None:
+        """Выбор функций для мемоизации: чистые рекурсивные функции от Int/Boolean параметров
+        """
+
+        infos = purity.analyze(prog)
+        # таблицы мемоизации не потокобезопасны
+        concurrent = purity.called_from((loop.func.name.name for loop in parallel_.find_loops(prog)), infos)
+        for name, info in infos.items():
+            kind = get_memo_kind(info.func) if info.pure and info.recursive else None
+            if kind and name in concurrent:
+                self.report.append('{}, вызывается в параллельном цикле - без мемоизации'.format(info))
+            elif kind:
+                self.memo_kinds[name] = kind
+                self.memo_funcs[name] = info.func
+                self.report.append('{}, мемоизация ({})'.format(
+                    info, f'{kind}[{get_memo_size(info.func)}]' if kind == MEMO_DENSE else kind))
+            elif info.pure and not info.recursive:
+                self.report.append('{}, не рекурсивная - без мемоизации'.format(info))
+            elif info.pure:
+                self.report.append('{}, типы параметров/результата не поддерживаются для мемоизации'.format(info))
+            else:
+                self.report.append(str(info))
+
+    def msil_gen_stmt(self, stmt: AstNode) -> None:
+        """Оператор (значение вызова функции, используемого как оператор, снимается со стека)
+        """
+
+        self.msil_gen(stmt)
+        if isinstance(stmt, CallNode) and stmt.node_type.base_type != BaseType.VOID:
+            self.add('pop')
 
     @visitor.when(StmtListNode)
     def msil_gen(self, node: StmtListNode) -> None:
         for stmt in node.exprs:
-            self.msil_gen(stmt)
+            self.msil_gen_stmt(stmt)
 
     def msil_gen_program(self, prog: StmtListNode):
+        if self.memoize:
+            self.plan_memoization(prog)
+        if self.string_builders:
+            self.builder_loops = find_string_builders(prog)
+        promoted: List[IdentDesc] = []
+        if self.promote_globals:
+            for ident, usage in escape.analyze_globals(prog).items():
+                if not usage.escapes:
+                    promoted.append(ident)
+                elif not usage.written_in_funcs:
+                    # функции значение только читают, поэтому Main может читать его из локальной переменной
+                    promoted.append(ident)
+                    self.mirrored.add(ident)
         self.start()
-        global_vars_decls = find_vars_decls(prog)
-        for node in global_vars_decls:
-            if node.ident.node_ident.scope in (ScopeType.GLOBAL, ScopeType.GLOBAL_LOCAL):
-                msil_type = get_msil_type(node.type.name)
-                self.add(f'.field public static {msil_type} _gv{node.ident.node_ident.index}')
+        for ident in find_vars_decls(prog):
+            if ident.scope in (ScopeType.GLOBAL, ScopeType.GLOBAL_LOCAL) and \
+                    (ident not in promoted or ident in self.mirrored):
+                self.add(f'.field public static {msil_type_name(ident.type)} _gv{ident.index}')
+        self.msil_gen_memo_fields()
+        if self.memo_kinds:
+            self.msil_gen_memo_init()
         for stmt in prog.exprs:
             if isinstance(stmt, FuncNode):
                 self.msil_gen(stmt)
         self.add('')
-        self.add('.method public static void Main()')
+        stmts = [stmt for stmt in prog.childs if not isinstance(stmt, FuncNode)]
+        start = len(self.code_lines)
+        sizes = self.msil_gen_main(stmts, promoted)
+        if self.main_part_size and sum(sizes) > self.main_part_size:
+            del self.code_lines[start:]
+            self.msil_gen_main_parts(stmts, split.split_parts(sizes, self.main_part_size), promoted)
+        if self.string_hash_used:
+            self.msil_gen_string_hash()
+        self.end()
+        for loop in self.parallel_loops:
+            self.msil_gen_parallel_class(loop)
+
+    def msil_gen_main(self, stmts: List[StmtNode], promoted: List[IdentDesc],
+                      name: str = 'Main', entrypoint: bool = True) -> List[int]:
+        """Генерация метода с "глобальным" кодом программы
+        :param stmts: операторы
+        :param promoted: глобальные переменные, хранящиеся в локальных переменных метода
+        :return: размеры кода операторов (см. split.instr_size)
+        """
+
+        self.add(f'.method {"public" if entrypoint else "private"} static void {name}()')
         self.add('{')
-        self.add('.entrypoint')
-        for stmt in prog.childs:
-            if not isinstance(stmt, FuncNode):
-                self.msil_gen(stmt)
+        if entrypoint:
+            self.add('.entrypoint')
+        self.begin_locals()
+        self.main_slots = {}
+        for ident in promoted:
+            self.main_slots[ident] = self.add_local(msil_type_name(ident.type), f'_gv{ident.index}')
+        self.in_main = True
+        if entrypoint:
+            self.msil_gen_output_begin()
+        sizes = []
+        for stmt in stmts:
+            start = len(self.code_lines)
+            self.msil_gen_stmt(stmt)
+            sizes.append(split.code_size(self.code_lines[start:]))
 
+        if entrypoint:
+            self.msil_gen_output_end()
         # т.к. "глобальный" код будет функцией, обязательно надо добавить ret
         self.add('ret')
+        self.in_main = False
+        self.end_locals()
 
         self.add('}')
-        self.end()
+        return sizes
+
+    def msil_gen_main_parts(self, stmts: List[StmtNode], parts: List[List[int]], promoted: List[IdentDesc]) -> None:
+        """Генерация "глобального" кода программы методами Main_partN (по границам операторов),
+           Main только вызывает их по очереди; глобальные переменные, используемые в нескольких частях,
+           хранятся в полях, остальные - в локальных переменных своей части
+        """
+
+        parts_stmts = [[stmts[i] for i in part] for part in parts]
+        parts_idents = [set().union(*(split.referenced_idents(stmt) for stmt in part)) for part in parts_stmts]
+        shared = [ident for ident in promoted if sum(ident in idents for idents in parts_idents) > 1]
+        for ident in shared:
+            if ident not in self.mirrored:
+                self.add(f'.field public static {msil_type_name(ident.type)} _gv{ident.index}')
+        for n, (part, idents) in enumerate(zip(parts_stmts, parts_idents), 1):
+            self.add('')
+            self.msil_gen_main(part, [ident for ident in promoted if ident in idents and ident not in shared],
+                               f'Main_part{n}', False)
+        self.add('')
+        self.add('.method public static void Main()')
+        self.add('{')
+        self.add('.entrypoint')
+        self.msil_gen_output_begin()
+        for n in range(1, len(parts) + 1):
+            self.add(f'call void class {PROGRAM_CLASS_NAME}::Main_part{n}()')
+        self.msil_gen_output_end()
+        self.add('ret')
+        self.add('}')
+
+    def msil_gen_output_begin(self) -> None:
+        if not self.buffered_output:
+            self.add(f'call void class {self.runtime_class}::unbuffered()')
+
+    def msil_gen_output_end(self) -> None:
+        # явный сброс вывода (обработчики завершения процесса в среде выполнения - на случай исключения)
+        if self.buffered_output:
+            self.add(f'call void class {self.runtime_class}::flush()')
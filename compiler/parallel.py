@@ -0,0 +1,204 @@
+from typing import Dict, List
+
+from .const_eval import INT_MIN, INT_MAX
+from .mel_ast import AstNode, ExprNode, StmtNode, LiteralNode, IdentNode, TypeNode, BinOpNode, CallNode, \
+    IndexNode, MemberNode, StmtListNode, AssignNode, VarNode, ReturnNode, IfNode, ForNode, SeqNode, ParamNode, \
+    FuncNode, ParallelForNode, ParallelReduceNode
+from .semantic import BinOp, TypeDesc, IdentDesc, ScopeType
+
+# имя функции, в которую выносится тело параллельного цикла (к нему добавляется номер цикла),
+# и суффикс имени функции, объединяющей результаты частей диапазона свертки
+FUNC_PREFIX = '_parallel'
+FOLD_SUFFIX = '_fold'
+
+SUM, MIN, MAX = 'parallelSum', 'parallelMin', 'parallelMax'
+
+
+def _literal(literal: str, type_: TypeDesc) -> LiteralNode:
+    node = LiteralNode(literal)
+    node.node_type = type_
+    return node
+
+
+def _ident(ident: IdentDesc) -> IdentNode:
+    node = IdentNode(ident.name)
+    node.node_ident = ident
+    node.node_type = ident.type
+    return node
+
+
+def _type(type_: TypeDesc) -> TypeNode:
+    node = TypeNode(str(type_))
+    # имя типа массива с параметром-типом (Array<String>) не разбирается как имя типа
+    node.type = type_
+    return node
+
+
+def _bin_op(op: BinOp, arg1: ExprNode, arg2: ExprNode, type_: TypeDesc) -> BinOpNode:
+    node = BinOpNode(op, arg1, arg2)
+    node.node_type = type_
+    return node
+
+
+def _stmt(node: StmtNode) -> StmtNode:
+    node.node_type = TypeDesc.VOID
+    return node
+
+
+def _assign(ident: IdentDesc, val: ExprNode) -> AssignNode:
+    node = AssignNode(_ident(ident), val)
+    node.node_type = ident.type
+    return node
+
+
+def _var(ident: IdentDesc, val: ExprNode) -> VarNode:
+    return _stmt(VarNode('var', _ident(ident), ':', _type(ident.type), val))
+
+
+def _for(ident: IdentDesc, start: ExprNode, op: BinOp, end: ExprNode, body: StmtNode) -> ForNode:
+    return _stmt(ForNode(_ident(ident), SeqNode(start, op, end), body))
+
+
+def _find(node: AstNode, cls) -> List[AstNode]:
+    result = []
+    for n in (node.childs or []):
+        if isinstance(n, cls):
+            result.append(n)
+        result.extend(_find(n, cls))
+    return result
+
+
+class _FuncBuilder:
+    """Построение функции: параметры и локальные переменные получают последовательные номера
+       (как при семантическом анализе объявленной в программе функции)
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.params: List[IdentDesc] = []
+        self.local_count = 0
+
+    def param(self, name: str, type_: TypeDesc) -> IdentDesc:
+        ident = IdentDesc(name, type_, ScopeType.PARAM, len(self.params))
+        self.params.append(ident)
+        return ident
+
+    def local(self, name: str, type_: TypeDesc) -> IdentDesc:
+        ident = IdentDesc(name, type_, ScopeType.LOCAL, self.local_count)
+        self.local_count += 1
+        return ident
+
+    def build(self, ret_type: TypeDesc, *stmts: StmtNode) -> FuncNode:
+        params = []
+        for ident in self.params:
+            param = _stmt(ParamNode(_ident(ident), _type(ident.type)))
+            params.append(param)
+        name = IdentNode(self.name)
+        name.node_ident = IdentDesc(self.name, TypeDesc(None, ret_type, tuple(p.type for p in self.params)))
+        name.node_type = name.node_ident.type
+        return _stmt(FuncNode(_type(ret_type), name, tuple(params), _stmt(StmtListNode(*stmts))))
+
+
+def _neutral(op: str, type_: TypeDesc) -> ExprNode:
+    """Начальное значение свертки (для минимума и максимума Float - бесконечность, литерала которой нет)
+    """
+
+    if op == SUM:
+        return _literal('0' if type_ == TypeDesc.INT else '0.0', type_)
+    if type_ == TypeDesc.INT:
+        return _literal(str(INT_MAX if op == MIN else INT_MIN), type_)
+    return _bin_op(BinOp.DIV, _literal('1.0' if op == MIN else '-1.0', type_), _literal('0.0', type_), type_)
+
+
+def _combine(op: str, acc: IdentDesc, value: IdentDesc) -> StmtNode:
+    """Добавление значения к результату свертки
+    """
+
+    if op == SUM:
+        return _assign(acc, _bin_op(BinOp.ADD, _ident(acc), _ident(value), acc.type))
+    cond = _bin_op(BinOp.LT if op == MIN else BinOp.GT, _ident(value), _ident(acc), TypeDesc.BOOL)
+    if acc.type == TypeDesc.FLOAT:
+        # NaN "поглощает" остальные значения (как Math.min и Math.max)
+        cond = _bin_op(BinOp.LOGICAL_OR, cond, _bin_op(BinOp.NEQUALS, _ident(value), _ident(value), TypeDesc.BOOL),
+                       TypeDesc.BOOL)
+    return _stmt(IfNode(cond, _assign(acc, _ident(value))))
+
+
+def _reduce_loop(builder: _FuncBuilder, op: str, type_: TypeDesc, ident: IdentDesc,
+                 start: ExprNode, seq_op: BinOp, end: ExprNode, value: ExprNode) -> List[StmtNode]:
+    acc = builder.local('_acc', type_)
+    item = builder.local('_item', type_)
+    body = _stmt(StmtListNode(_var(item, value), _combine(op, acc, item)))
+    return [_var(acc, _neutral(op, type_)), _for(ident, start, seq_op, end, body), _stmt(ReturnNode(_ident(acc)))]
+
+
+def _lower_loop(node: ParallelForNode, name: str) -> List[FuncNode]:
+    """Вынос тела параллельного цикла в функцию name(захваченные переменные..., first, last), выполняющую цикл
+       по части диапазона first..last. Внешние переменные, которые использует тело, передаются по значению
+       (изменять их в теле нельзя, см. IdentScope.is_shared), переменные тела становятся локальными
+       переменными функции
+    """
+
+    decls = [node.ident.node_ident] + [n.ident.node_ident for n in _find(node.body, (VarNode, ForNode))]
+    # тело свертки - выражение, которое само может быть идентификатором
+    ident_nodes = [node.ident] + [n for n in (node.body, ) if isinstance(n, IdentNode)] + _find(node.body, IdentNode)
+    used: List[IdentDesc] = []
+    for n in ident_nodes:
+        ident = n.node_ident
+        if ident is not None and not ident.type.func and ident not in used:
+            used.append(ident)
+
+    builder = _FuncBuilder(name)
+    mapping: Dict[IdentDesc, IdentDesc] = {}
+    captured = [ident for ident in used if ident not in decls]
+    for ident in captured:
+        mapping[ident] = builder.param(ident.name, ident.type)
+    first = builder.param('_first', TypeDesc.INT)
+    last = builder.param('_last', TypeDesc.INT)
+    for ident in used:
+        if ident in decls:
+            mapping[ident] = builder.local(ident.name, ident.type)
+    for n in ident_nodes:
+        if n.node_ident in mapping:
+            n.node_ident = mapping[n.node_ident]
+    ident = node.ident.node_ident
+
+    funcs = []
+    if isinstance(node, ParallelReduceNode):
+        type_ = node.node_type
+        funcs.append(builder.build(type_, *_reduce_loop(builder, node.op, type_, ident,
+                                                        _ident(first), BinOp.DOTS, _ident(last), node.body)))
+        fold = _FuncBuilder(name + FOLD_SUFFIX)
+        results = fold.param('_results', TypeDesc.array_of(type_))
+        index = fold.local('_k', TypeDesc.INT)
+        item = IndexNode(_ident(results), _ident(index))
+        item.node_type = type_
+        size = MemberNode(_ident(results), IdentNode('size'))
+        size.node_type = TypeDesc.INT
+        node.fold = fold.build(type_, *_reduce_loop(fold, node.op, type_, index,
+                                                    _literal('0', TypeDesc.INT), BinOp.UNTIL, size, item))
+        funcs.append(node.fold)
+    else:
+        funcs.append(builder.build(TypeDesc.VOID, _for(ident, _ident(first), BinOp.DOTS, _ident(last), node.body)))
+
+    node.func = funcs[0]
+    call = CallNode(_ident(node.func.name.node_ident), *(_ident(ident) for ident in captured))
+    call.node_type = node.func.type.type
+    node.call = call
+    return funcs
+
+
+def find_loops(prog: StmtListNode) -> List[ParallelForNode]:
+    return _find(prog, ParallelForNode)
+
+
+def lower(prog: StmtListNode) -> None:
+    """Вынос тел параллельных циклов и сверток программы в функции (после семантического анализа,
+       перед генерацией кода): генераторы создают для каждого цикла класс-наследник ParallelBody среды
+       выполнения, который вызывает функцию для частей диапазона в разных потоках
+    """
+
+    funcs: List[FuncNode] = []
+    for n, node in enumerate(find_loops(prog)):
+        funcs.extend(_lower_loop(node, FUNC_PREFIX + str(n)))
+    prog.exprs = (*prog.exprs, *funcs)
@@ -0,0 +1,1293 @@
+import hashlib
+import re
+import struct
+import sys
+import uuid
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Запись исполняемого файла (PE/CLI) без ilasm: ассемблер текста MSIL (в объеме, который порождает генератор кода,
+# и формата ildasm, в котором хранится runtime.msil), построение таблиц метаданных, тел методов и запись образа
+
+# версия формата записываемых файлов: увеличивается при любом изменении записи, т.к. входит в имя кэшируемого
+# модуля среды выполнения (см. program.runtime_module) и модули, записанные прежней версией, не используются
+WRITER_VERSION = 1
+
+
+class PeException(Exception):
+    """Класс для исключений во время сборки исполняемого файла
+    """
+
+    def __init__(self, message, line: int = None, **kwargs: Any) -> None:
+        if line:
+            message += ' (строка: {})'.format(line)
+        self.message = message
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Инструкции
+
+NONE, I1, I4, I8, R4, R8, VAR, BR, SWITCH, METHOD, FIELD, TYPE, STRING = range(13)
+
+# операция -> (код операции, тип операнда); коды операций из двух байт записываются как 0xFExx
+OPCODES: Dict[str, Tuple[int, int]] = {
+    'nop': (0x00, NONE), 'break': (0x01, NONE),
+    'ldarg.0': (0x02, NONE), 'ldarg.1': (0x03, NONE), 'ldarg.2': (0x04, NONE), 'ldarg.3': (0x05, NONE),
+    'ldloc.0': (0x06, NONE), 'ldloc.1': (0x07, NONE), 'ldloc.2': (0x08, NONE), 'ldloc.3': (0x09, NONE),
+    'stloc.0': (0x0A, NONE), 'stloc.1': (0x0B, NONE), 'stloc.2': (0x0C, NONE), 'stloc.3': (0x0D, NONE),
+    'ldarg.s': (0x0E, VAR), 'ldarga.s': (0x0F, VAR), 'starg.s': (0x10, VAR),
+    'ldloc.s': (0x11, VAR), 'ldloca.s': (0x12, VAR), 'stloc.s': (0x13, VAR),
+    'ldnull': (0x14, NONE), 'ldc.i4.m1': (0x15, NONE), 'ldc.i4.M1': (0x15, NONE),
+    'ldc.i4.0': (0x16, NONE), 'ldc.i4.1': (0x17, NONE), 'ldc.i4.2': (0x18, NONE), 'ldc.i4.3': (0x19, NONE),
+    'ldc.i4.4': (0x1A, NONE), 'ldc.i4.5': (0x1B, NONE), 'ldc.i4.6': (0x1C, NONE), 'ldc.i4.7': (0x1D, NONE),
+    'ldc.i4.8': (0x1E, NONE), 'ldc.i4.s': (0x1F, I1), 'ldc.i4': (0x20, I4), 'ldc.i8': (0x21, I8),
+    'ldc.r4': (0x22, R4), 'ldc.r8': (0x23, R8), 'dup': (0x25, NONE), 'pop': (0x26, NONE),
+    'jmp': (0x27, METHOD), 'call': (0x28, METHOD), 'ret': (0x2A, NONE),
+    'br.s': (0x2B, BR), 'brfalse.s': (0x2C, BR), 'brtrue.s': (0x2D, BR), 'beq.s': (0x2E, BR), 'bge.s': (0x2F, BR),
+    'bgt.s': (0x30, BR), 'ble.s': (0x31, BR), 'blt.s': (0x32, BR), 'bne.un.s': (0x33, BR), 'bge.un.s': (0x34, BR),
+    'bgt.un.s': (0x35, BR), 'ble.un.s': (0x36, BR), 'blt.un.s': (0x37, BR),
+    'br': (0x38, BR), 'brfalse': (0x39, BR), 'brtrue': (0x3A, BR), 'beq': (0x3B, BR), 'bge': (0x3C, BR),
+    'bgt': (0x3D, BR), 'ble': (0x3E, BR), 'blt': (0x3F, BR), 'bne.un': (0x40, BR), 'bge.un': (0x41, BR),
+    'bgt.un': (0x42, BR), 'ble.un': (0x43, BR), 'blt.un': (0x44, BR), 'switch': (0x45, SWITCH),
+    'ldind.i1': (0x46, NONE), 'ldind.u1': (0x47, NONE), 'ldind.i2': (0x48, NONE), 'ldind.u2': (0x49, NONE),
+    'ldind.i4': (0x4A, NONE), 'ldind.u4': (0x4B, NONE), 'ldind.i8': (0x4C, NONE), 'ldind.i': (0x4D, NONE),
+    'ldind.r4': (0x4E, NONE), 'ldind.r8': (0x4F, NONE), 'ldind.ref': (0x50, NONE), 'stind.ref': (0x51, NONE),
+    'stind.i1': (0x52, NONE), 'stind.i2': (0x53, NONE), 'stind.i4': (0x54, NONE), 'stind.i8': (0x55, NONE),
+    'stind.r4': (0x56, NONE), 'stind.r8': (0x57, NONE),
+    'add': (0x58, NONE), 'sub': (0x59, NONE), 'mul': (0x5A, NONE), 'div': (0x5B, NONE), 'div.un': (0x5C, NONE),
+    'rem': (0x5D, NONE), 'rem.un': (0x5E, NONE), 'and': (0x5F, NONE), 'or': (0x60, NONE), 'xor': (0x61, NONE),
+    'shl': (0x62, NONE), 'shr': (0x63, NONE), 'shr.un': (0x64, NONE), 'neg': (0x65, NONE), 'not': (0x66, NONE),
+    'conv.i1': (0x67, NONE), 'conv.i2': (0x68, NONE), 'conv.i4': (0x69, NONE), 'conv.i8': (0x6A, NONE),
+    'conv.r4': (0x6B, NONE), 'conv.r8': (0x6C, NONE), 'conv.u4': (0x6D, NONE), 'conv.u8': (0x6E, NONE),
+    'callvirt': (0x6F, METHOD), 'ldobj': (0x71, TYPE), 'ldstr': (0x72, STRING), 'newobj': (0x73, METHOD),
+    'castclass': (0x74, TYPE), 'isinst': (0x75, TYPE), 'conv.r.un': (0x76, NONE), 'unbox': (0x79, TYPE),
+    'throw': (0x7A, NONE), 'ldfld': (0x7B, FIELD), 'ldflda': (0x7C, FIELD), 'stfld': (0x7D, FIELD),
+    'ldsfld': (0x7E, FIELD), 'ldsflda': (0x7F, FIELD), 'stsfld': (0x80, FIELD), 'stobj': (0x81, TYPE),
+    'box': (0x8C, TYPE), 'newarr': (0x8D, TYPE), 'ldlen': (0x8E, NONE), 'ldelema': (0x8F, TYPE),
+    'ldelem.i1': (0x90, NONE), 'ldelem.u1': (0x91, NONE), 'ldelem.i2': (0x92, NONE), 'ldelem.u2': (0x93, NONE),
+    'ldelem.i4': (0x94, NONE), 'ldelem.u4': (0x95, NONE), 'ldelem.i8': (0x96, NONE), 'ldelem.i': (0x97, NONE),
+    'ldelem.r4': (0x98, NONE), 'ldelem.r8': (0x99, NONE), 'ldelem.ref': (0x9A, NONE), 'stelem.i': (0x9B, NONE),
+    'stelem.i1': (0x9C, NONE), 'stelem.i2': (0x9D, NONE), 'stelem.i4': (0x9E, NONE), 'stelem.i8': (0x9F, NONE),
+    'stelem.r4': (0xA0, NONE), 'stelem.r8': (0xA1, NONE), 'stelem.ref': (0xA2, NONE),
+    'ldelem': (0xA3, TYPE), 'stelem': (0xA4, TYPE), 'unbox.any': (0xA5, TYPE),
+    'conv.ovf.i1': (0xB3, NONE), 'conv.ovf.u1': (0xB4, NONE), 'conv.ovf.i2': (0xB5, NONE),
+    'conv.ovf.u2': (0xB6, NONE), 'conv.ovf.i4': (0xB7, NONE), 'conv.ovf.u4': (0xB8, NONE),
+    'conv.ovf.i8': (0xB9, NONE), 'conv.ovf.u8': (0xBA, NONE), 'ckfinite': (0xC3, NONE),
+    'ldtoken': (0xD0, TYPE), 'conv.u2': (0xD1, NONE), 'conv.u1': (0xD2, NONE), 'conv.i': (0xD3, NONE),
+    'conv.ovf.i': (0xD4, NONE), 'conv.ovf.u': (0xD5, NONE), 'add.ovf': (0xD6, NONE), 'add.ovf.un': (0xD7, NONE),
+    'mul.ovf': (0xD8, NONE), 'mul.ovf.un': (0xD9, NONE), 'sub.ovf': (0xDA, NONE), 'sub.ovf.un': (0xDB, NONE),
+    'endfinally': (0xDC, NONE), 'leave': (0xDD, BR), 'leave.s': (0xDE, BR), 'stind.i': (0xDF, NONE),
+    'conv.u': (0xE0, NONE),
+    'ceq': (0xFE01, NONE), 'cgt': (0xFE02, NONE), 'cgt.un': (0xFE03, NONE), 'clt': (0xFE04, NONE),
+    'clt.un': (0xFE05, NONE), 'ldftn': (0xFE06, METHOD), 'ldvirtftn': (0xFE07, METHOD),
+    'ldarg': (0xFE09, VAR), 'ldarga': (0xFE0A, VAR), 'starg': (0xFE0B, VAR),
+    'ldloc': (0xFE0C, VAR), 'ldloca': (0xFE0D, VAR), 'stloc': (0xFE0E, VAR),
+    'initobj': (0xFE15, TYPE), 'rethrow': (0xFE1A, NONE), 'sizeof': (0xFE1C, TYPE),
+}
+
+# короткие формы переходов (форма выбирается при записи кода по расстоянию до метки)
+SHORT_BRANCHES = {op: op + '.s' for op in ('br', 'brfalse', 'brtrue', 'beq', 'bge', 'bgt', 'ble', 'blt', 'bne.un',
+                                           'bge.un', 'bgt.un', 'ble.un', 'blt.un', 'leave')}
+LONG_BRANCHES = {short: op for op, short in SHORT_BRANCHES.items()}
+BRANCH_ALIASES = {'brnull': 'brfalse', 'brzero': 'brfalse', 'brinst': 'brtrue',
+                  'brnull.s': 'brfalse.s', 'brzero.s': 'brfalse.s', 'brinst.s': 'brtrue.s'}
+
+# инструкции для переменных и аргументов: общая форма -> (формы с номером 0..3, короткая форма)
+VAR_FORMS = {
+    'ldloc': ('ldloc.{}', 'ldloc.s'),
+    'stloc': ('stloc.{}', 'stloc.s'),
+    'ldarg': ('ldarg.{}', 'ldarg.s'),
+    'starg': (None, 'starg.s'),
+    'ldloca': (None, 'ldloca.s'),
+    'ldarga': (None, 'ldarga.s'),
+}
+VAR_SHORT_FORMS = {short: op for op, (_, short) in VAR_FORMS.items()}
+VAR_NUMBERED_FORMS = {numbered.format(i): (op, i) for op, (numbered, _) in VAR_FORMS.items() if numbered
+                      for i in range(4)}
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Типы и сигнатуры
+
+ELEMENT_TYPES = {
+    'void': 0x01, 'bool': 0x02, 'char': 0x03, 'int8': 0x04, 'uint8': 0x05, 'int16': 0x06, 'uint16': 0x07,
+    'int32': 0x08, 'uint32': 0x09, 'int64': 0x0A, 'uint64': 0x0B, 'float32': 0x0C, 'float64': 0x0D,
+    'string': 0x0E, 'typedref': 0x16, 'native int': 0x18, 'native uint': 0x19, 'object': 0x1C,
+}
+ELEMENT_TYPE_PTR, ELEMENT_TYPE_BYREF, ELEMENT_TYPE_VALUETYPE, ELEMENT_TYPE_CLASS = 0x0F, 0x10, 0x11, 0x12
+ELEMENT_TYPE_VAR, ELEMENT_TYPE_GENERICINST, ELEMENT_TYPE_SZARRAY, ELEMENT_TYPE_MVAR = 0x13, 0x15, 0x1D, 0x1E
+SIG_HASTHIS, SIG_FIELD, SIG_LOCALS = 0x20, 0x06, 0x07
+
+# типы библиотеки, соответствующие встроенным типам (для инструкций с операндом-типом, например, newarr int32)
+SYSTEM_TYPES = {
+    'bool': 'System.Boolean', 'char': 'System.Char', 'int8': 'System.SByte', 'uint8': 'System.Byte',
+    'int16': 'System.Int16', 'uint16': 'System.UInt16', 'int32': 'System.Int32', 'uint32': 'System.UInt32',
+    'int64': 'System.Int64', 'uint64': 'System.UInt64', 'float32': 'System.Single', 'float64': 'System.Double',
+    'string': 'System.String', 'object': 'System.Object', 'native int': 'System.IntPtr',
+    'native uint': 'System.UIntPtr',
+}
+
+CORLIB = 'mscorlib'
+CORLIB_VERSION = (4, 0, 0, 0)
+CORLIB_PUBLIC_KEY_TOKEN = bytes.fromhex('B77A5C561934E089')
+
+# Тип представляется кортежем:
+#   ('prim', имя)                           - встроенный тип
+#   ('class' | 'valuetype', область, имя)   - класс (область: None - текущий модуль, ('assembly', имя), ('module', имя))
+#   ('szarray' | 'byref' | 'ptr', тип)
+#   ('generic', тип класса, (аргументы, ...))
+#   ('var' | 'mvar', номер)                 - параметр-тип класса или метода
+Type = Tuple[Any, ...]
+
+TYPE_ATTRS = {
+    'private': 0x0, 'public': 0x1, 'auto': 0x0, 'ansi': 0x0, 'sequential': 0x8, 'explicit': 0x10,
+    'interface': 0x20, 'abstract': 0x80, 'sealed': 0x100, 'specialname': 0x400, 'serializable': 0x2000,
+    'beforefieldinit': 0x100000, 'rtspecialname': 0x800,
+}
+FIELD_ATTRS = {
+    'privatescope': 0x0, 'private': 0x1, 'famandassem': 0x2, 'assembly': 0x3, 'family': 0x4, 'famorassem': 0x5,
+    'public': 0x6, 'static': 0x10, 'initonly': 0x20, 'literal': 0x40, 'notserialized': 0x80,
+    'specialname': 0x200, 'rtspecialname': 0x400,
+}
+METHOD_ATTRS = {
+    'privatescope': 0x0, 'private': 0x1, 'famandassem': 0x2, 'assembly': 0x3, 'family': 0x4, 'famorassem': 0x5,
+    'public': 0x6, 'static': 0x10, 'final': 0x20, 'virtual': 0x40, 'hidebysig': 0x80, 'newslot': 0x100,
+    'strict': 0x200, 'abstract': 0x400, 'specialname': 0x800, 'rtspecialname': 0x1000,
+}
+METHOD_IMPL_ATTRS = {
+    'cil': 0x0, 'managed': 0x0, 'native': 0x1, 'runtime': 0x3, 'unmanaged': 0x4, 'forwardref': 0x10,
+    'preservesig': 0x80, 'internalcall': 0x1000, 'synchronized': 0x20, 'noinlining': 0x8,
+    'aggressiveinlining': 0x100, 'nooptimization': 0x40,
+}
+
+
+class FieldDef:
+    def __init__(self, flags: int, name: str, type_: Type) -> None:
+        self.flags = flags
+        self.name = name
+        self.type = type_
+
+
+class MethodDef:
+    def __init__(self, flags: int, name: str, instance: bool, ret: Type, params: List[Tuple[Type, Optional[str]]],
+                 impl_flags: int = 0) -> None:
+        self.flags = flags
+        self.impl_flags = impl_flags
+        self.name = name
+        self.instance = instance
+        self.ret = ret
+        self.params = params
+        self.max_stack = 8
+        self.locals: List[Tuple[Type, Optional[str]]] = []
+        self.init_locals = False
+        self.entrypoint = False
+        # инструкции (операция, операнд, номер строки) и метки (имя -> номер инструкции)
+        self.instrs: List[Tuple[str, Any, int]] = []
+        self.labels: Dict[str, int] = {}
+
+
+class ClassDef:
+    def __init__(self, flags: int, name: str, extends: Optional[Type]) -> None:
+        self.flags = flags
+        self.name = name
+        self.extends = extends
+        self.fields: List[FieldDef] = []
+        self.methods: List[MethodDef] = []
+
+
+class Module:
+    """Содержимое собираемого модуля (объединение всех исходных текстов, как при вызове ilasm с несколькими файлами)
+    """
+
+    def __init__(self) -> None:
+        self.assembly: Optional[str] = None
+        self.assembly_version = (0, 0, 0, 0)
+        # внешние сборки: имя -> (версия, public key token)
+        self.assembly_refs: Dict[str, Tuple[Tuple[int, int, int, int], bytes]] = {}
+        # внешние модули (.module extern) и файлы сборки (.file): (имя, флаги, хэш содержимого)
+        self.module_refs: List[str] = []
+        self.files: List[Tuple[str, int, bytes]] = []
+        self.classes: List[ClassDef] = []
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Разбор текста MSIL
+
+TOKEN_RE = re.compile(r'''
+    (?P<space>\s+|//[^\n]*|/\*.*?\*/)
+    |(?P<str>"(?:[^"\\]|\\.)*")
+    |(?P<qid>'(?:[^'\\]|\\.)*')
+    |(?P<num>[-+]?(?:0[xX][0-9A-Fa-f]+|\d+(?:\.\d*)?(?:[eE][-+]?\d+)?))
+    |(?P<id>[A-Za-z_$@.`?][\w$@.`?]*)
+    |(?P<punct>::|[{}()\[\]<>,:=&*!+/])
+''', re.X | re.S)
+
+STRING_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', 'a': '\a', 'b': '\b', 'f': '\f', 'v': '\v', '0': '\0'}
+STRING_ESCAPE_RE = re.compile(r'\\([0-7]{3}|.)', re.S)
+
+Token = Tuple[str, str, int]
+
+
+def tokenize(text: str) -> List[Token]:
+    tokens: List[Token] = []
+    line = 1
+    pos = 0
+    while pos < len(text):
+        m = TOKEN_RE.match(text, pos)
+        if m is None:
+            raise PeException('Неизвестный символ "{}"'.format(text[pos]), line)
+        kind = m.lastgroup
+        if kind == 'space':
+            line += m.group().count('\n')
+        else:
+            tokens.append((kind, m.group(), line))
+        pos = m.end()
+    return tokens
+
+
+def unescape(literal: str) -> str:
+    def replace(m: re.Match) -> str:
+        c = m.group(1)
+        if len(c) == 3:
+            return chr(int(c, 8))
+        return STRING_ESCAPES.get(c, c)
+
+    return STRING_ESCAPE_RE.sub(replace, literal[1:-1])
+
+
+class Parser:
+    """Разбор текста MSIL (директивы .assembly, .module, .class, .field, .method и инструкции)
+    """
+
+    def __init__(self, module: Module, text: str) -> None:
+        self.module = module
+        self.tokens = tokenize(text)
+        self.pos = 0
+
+    # --- токены
+
+    def peek(self, offset: int = 0) -> str:
+        pos = self.pos + offset
+        return self.tokens[pos][1] if pos < len(self.tokens) else ''
+
+    def line(self) -> int:
+        return self.tokens[min(self.pos, len(self.tokens) - 1)][2] if self.tokens else 0
+
+    def next(self) -> str:
+        if self.pos >= len(self.tokens):
+            raise PeException('Неожиданный конец текста', self.line())
+        self.pos += 1
+        return self.tokens[self.pos - 1][1]
+
+    def accept(self, text: str) -> bool:
+        if self.peek() == text:
+            self.pos += 1
+            return True
+        return False
+
+    def expect(self, text: str) -> None:
+        if not self.accept(text):
+            raise PeException('Ожидается "{}", найдено "{}"'.format(text, self.peek()), self.line())
+
+    def name(self) -> str:
+        kind = self.tokens[self.pos][0] if self.pos < len(self.tokens) else None
+        if kind == 'qid':
+            return unescape(self.next())
+        if kind != 'id':
+            raise PeException('Ожидается имя, найдено "{}"'.format(self.peek()), self.line())
+        return self.next()
+
+    def integer(self) -> int:
+        text = self.next()
+        try:
+            digits = text.lstrip('+-')
+            value = int(digits, 16) if digits[:2].lower() == '0x' else int(digits)
+        except ValueError:
+            raise PeException('Ожидается целое число, найдено "{}"'.format(text), self.line())
+        return -value if text.startswith('-') else value
+
+    def byte_list(self) -> bytes:
+        # байты вида ( 01 00 4E ... ): лексемы склеиваются, т.к. часть байтов разбивается на число и имя
+        self.expect('(')
+        text = ''
+        while not self.accept(')'):
+            text += self.next()
+        try:
+            return bytes.fromhex(text)
+        except ValueError:
+            raise PeException('Неверный список байтов', self.line())
+
+    def skip_block(self) -> None:
+        self.expect('{')
+        depth = 1
+        while depth:
+            token = self.next()
+            depth += token == '{'
+            depth -= token == '}'
+
+    def skip_custom(self) -> None:
+        # .custom [(владелец)] конструктор = ( байты )
+        while not self.accept('='):
+            self.next()
+        self.byte_list()
+
+    # --- типы
+
+    def class_name(self) -> Tuple[Any, str]:
+        scope = None
+        if self.accept('['):
+            if self.accept('.module'):
+                scope = ('module', self.name())
+            else:
+                scope = ('assembly', self.name())
+            self.expect(']')
+        name = self.name()
+        while self.accept('/'):
+            name += '/' + self.name()
+        return scope, name
+
+    def type_(self) -> Type:
+        token = self.peek()
+        if token in ('class', 'valuetype'):
+            self.next()
+            result: Type = (token, *self.class_name())
+        elif token == '!':
+            self.next()
+            kind = 'mvar' if self.accept('!') else 'var'
+            result = (kind, self.integer())
+        elif token == 'native':
+            self.next()
+            unsigned = self.accept('unsigned')
+            name = self.next()
+            result = ('prim', 'native uint' if unsigned or name == 'uint' else 'native int')
+        elif token == 'unsigned':
+            self.next()
+            result = ('prim', 'u' + self.next())
+        elif token in ELEMENT_TYPES:
+            self.next()
+            result = ('prim', token)
+        else:
+            result = ('class', *self.class_name())
+        while True:
+            if self.peek() == '<' and result[0] in ('class', 'valuetype'):
+                self.next()
+                args = [self.type_()]
+                while self.accept(','):
+                    args.append(self.type_())
+                self.expect('>')
+                result = ('generic', result, tuple(args))
+            elif self.peek() == '[' and self.peek(1) == ']':
+                self.pos += 2
+                result = ('szarray', result)
+            elif self.accept('&'):
+                result = ('byref', result)
+            elif self.accept('*'):
+                result = ('ptr', result)
+            else:
+                return result
+
+    def params(self, named: bool) -> List[Tuple[Type, Optional[str]]]:
+        self.expect('(')
+        params: List[Tuple[Type, Optional[str]]] = []
+        while not self.accept(')'):
+            if params:
+                self.expect(',')
+            while self.accept('['):
+                # атрибуты параметров ([in], [out], [opt]) и номера ([0]) не используются
+                self.next()
+                self.expect(']')
+            type_ = self.type_()
+            name = None
+            if self.peek() not in (',', ')'):
+                name = self.name()
+            if not named:
+                name = None
+            params.append((type_, name))
+        return params
+
+    # --- операнды инструкций
+
+    def method_ref(self) -> Tuple[Any, ...]:
+        instance = False
+        while self.peek() in ('instance', 'explicit', 'default'):
+            instance |= self.next() == 'instance'
+        ret = self.type_()
+        owner = self.type_()
+        self.expect('::')
+        name = self.name()
+        params = tuple(type_ for type_, _ in self.params(named=False))
+        return owner, name, instance, ret, params
+
+    def field_ref(self) -> Tuple[Any, ...]:
+        type_ = self.type_()
+        owner = self.type_()
+        self.expect('::')
+        return owner, self.name(), type_
+
+    def string(self) -> str:
+        if self.accept('bytearray'):
+            return self.byte_list().decode('utf-16-le')
+        kind = self.tokens[self.pos][0] if self.pos < len(self.tokens) else None
+        if kind != 'str':
+            raise PeException('Ожидается строка, найдено "{}"'.format(self.peek()), self.line())
+        value = unescape(self.next())
+        while self.peek() == '+' and self.pos + 1 < len(self.tokens) and self.tokens[self.pos + 1][0] == 'str':
+            self.next()
+            value += unescape(self.next())
+        return value
+
+    def float_(self, fmt: str) -> float:
+        if self.peek() == '(':
+            return struct.unpack('<' + fmt, self.byte_list())[0]
+        if self.peek() in ('float32', 'float64'):
+            self.next()
+            self.expect('(')
+            value = self.integer()
+            self.expect(')')
+            size = 4 if fmt == 'f' else 8
+            return struct.unpack('<' + fmt, (value & (1 << 8 * size) - 1).to_bytes(size, 'little'))[0]
+        text = self.next()
+        try:
+            return float(text)
+        except ValueError:
+            raise PeException('Ожидается число, найдено "{}"'.format(text), self.line())
+
+    def instr(self, method: MethodDef) -> None:
+        line = self.line()
+        op = self.next()
+        op = BRANCH_ALIASES.get(op, op)
+        _, kind = OPCODES[op]
+        operand: Any = None
+        if kind in (I1, I4, I8):
+            operand = self.integer()
+        elif kind in (R4, R8):
+            operand = self.float_('f' if kind == R4 else 'd')
+        elif kind == VAR:
+            token_kind = self.tokens[self.pos][0] if self.pos < len(self.tokens) else None
+            operand = self.integer() if token_kind == 'num' else self.name()
+        elif kind == BR:
+            operand = self.name()
+        elif kind == SWITCH:
+            self.expect('(')
+            operand = []
+            while not self.accept(')'):
+                if operand:
+                    self.expect(',')
+                operand.append(self.name())
+        elif kind == METHOD:
+            operand = self.method_ref()
+        elif kind == FIELD:
+            operand = self.field_ref()
+        elif kind == TYPE:
+            operand = self.type_()
+        elif kind == STRING:
+            operand = self.string()
+        method.instrs.append((op, operand, line))
+
+    # --- директивы
+
+    def method(self, cls: ClassDef) -> MethodDef:
+        flags = 0
+        while self.peek() in METHOD_ATTRS:
+            flags |= METHOD_ATTRS[self.next()]
+        # метод без атрибута static - метод экземпляра (даже без instance)
+        instance = not flags & METHOD_ATTRS['static']
+        while self.peek() in ('instance', 'explicit', 'default', 'vararg'):
+            instance |= self.next() == 'instance'
+        ret = self.type_()
+        name = self.name()
+        params = self.params(named=True)
+        impl_flags = 0
+        while self.peek() in METHOD_IMPL_ATTRS:
+            impl_flags |= METHOD_IMPL_ATTRS[self.next()]
+        method = MethodDef(flags, name, instance, ret, params, impl_flags)
+        self.expect('{')
+        while not self.accept('}'):
+            line = self.line()
+            token = self.peek()
+            if token == '.maxstack':
+                self.next()
+                method.max_stack = self.integer()
+            elif token == '.entrypoint':
+                self.next()
+                method.entrypoint = True
+            elif token == '.locals':
+                self.next()
+                method.init_locals |= self.accept('init')
+                method.locals.extend(self.params(named=True))
+            elif token == '.custom':
+                self.skip_custom()
+            elif token in OPCODES or token in BRANCH_ALIASES:
+                self.instr(method)
+            elif self.peek(1) == ':' and self.tokens[self.pos][0] in ('id', 'qid'):
+                label = self.name()
+                self.next()
+                if label in method.labels:
+                    raise PeException('Повторное объявление метки {}'.format(label), line)
+                method.labels[label] = len(method.instrs)
+            else:
+                raise PeException('Неизвестная инструкция или директива "{}"'.format(token), line)
+        return method
+
+    def class_(self) -> None:
+        flags = 0
+        while self.peek() in TYPE_ATTRS:
+            flags |= TYPE_ATTRS[self.next()]
+        name = self.name()
+        extends = None
+        if self.accept('extends'):
+            extends = self.type_()
+        elif not flags & TYPE_ATTRS['interface']:
+            extends = ('class', ('assembly', CORLIB), 'System.Object')
+        cls = ClassDef(flags, name, extends)
+        self.expect('{')
+        while not self.accept('}'):
+            line = self.line()
+            token = self.next()
+            if token == '.field':
+                field_flags = 0
+                while self.peek() in FIELD_ATTRS:
+                    field_flags |= FIELD_ATTRS[self.next()]
+                type_ = self.type_()
+                cls.fields.append(FieldDef(field_flags, self.name(), type_))
+            elif token == '.method':
+                cls.methods.append(self.method(cls))
+            elif token == '.custom':
+                self.skip_custom()
+            elif token in ('.pack', '.size'):
+                self.integer()
+            else:
+                raise PeException('Неподдерживаемая директива "{}"'.format(token), line)
+        self.module.classes.append(cls)
+
+    def assembly(self) -> None:
+        if self.accept('extern'):
+            name = self.name()
+            version, token = (0, 0, 0, 0), b''
+            self.expect('{')
+            while not self.accept('}'):
+                directive = self.next()
+                if directive == '.ver':
+                    version = self.version()
+                elif directive in ('.publickeytoken', '.publickey', '.hash'):
+                    self.expect('=')
+                    value = self.byte_list()
+                    if directive != '.hash':
+                        token = value
+                elif directive == '.custom':
+                    self.skip_custom()
+                else:
+                    raise PeException('Неподдерживаемая директива "{}"'.format(directive), self.line())
+            self.module.assembly_refs[name] = (version, token)
+            return
+        while self.peek() in ('retargetable', 'legacy', 'library', 'noplatform'):
+            self.next()
+        self.module.assembly = self.name()
+        self.expect('{')
+        while not self.accept('}'):
+            directive = self.next()
+            if directive == '.ver':
+                self.module.assembly_version = self.version()
+            elif directive == '.hash':
+                self.expect('algorithm')
+                self.expect('=')
+                self.integer()
+            elif directive == '.custom':
+                self.skip_custom()
+            else:
+                raise PeException('Неподдерживаемая директива "{}"'.format(directive), self.line())
+
+    def file(self) -> None:
+        # .file [nometadata] имя [.hash = ( байты )] - модуль сборки, находящийся в отдельном файле
+        flags = FILE_NO_METADATA if self.accept('nometadata') else 0
+        name = self.name()
+        hash_ = b''
+        if self.accept('.hash'):
+            self.expect('=')
+            hash_ = self.byte_list()
+        if self.accept('.entrypoint'):
+            raise PeException('Точка входа в другом модуле не поддерживается', self.line())
+        self.module.files.append((name, flags, hash_))
+
+    def version(self) -> Tuple[int, int, int, int]:
+        parts = [self.integer()]
+        while self.accept(':'):
+            parts.append(self.integer())
+        return tuple((parts + [0, 0, 0])[:4])
+
+    def parse(self) -> None:
+        while self.pos < len(self.tokens):
+            line = self.line()
+            token = self.next()
+            if token == '.assembly':
+                self.assembly()
+            elif token == '.class':
+                self.class_()
+            elif token == '.module':
+                if self.accept('extern'):
+                    name = self.name()
+                    if name not in self.module.module_refs:
+                        self.module.module_refs.append(name)
+                else:
+                    # имя модуля определяется именем выходного файла
+                    self.name()
+            elif token in ('.imagebase', '.stackreserve', '.subsystem', '.corflags'):
+                self.integer()
+            elif token == '.file':
+                if self.accept('alignment'):
+                    self.integer()
+                else:
+                    self.file()
+            elif token == '.custom':
+                self.skip_custom()
+            else:
+                raise PeException('Неподдерживаемая директива "{}"'.format(token), line)
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Метаданные
+
+MODULE, TYPEREF, TYPEDEF, FIELD_TABLE, METHODDEF, PARAM, MEMBERREF = 0x00, 0x01, 0x02, 0x04, 0x06, 0x08, 0x0A
+STANDALONESIG, MODULEREF, TYPESPEC, ASSEMBLY, ASSEMBLYREF, FILE = 0x11, 0x1A, 0x1B, 0x20, 0x23, 0x26
+STRING_TOKEN = 0x70
+
+# кодированные индексы: имя -> (кол-во бит признака, таблицы)
+CODED_INDEXES = {
+    'TypeDefOrRef': (2, (TYPEDEF, TYPEREF, TYPESPEC)),
+    'ResolutionScope': (2, (MODULE, MODULEREF, ASSEMBLYREF, TYPEREF)),
+    'MemberRefParent': (3, (TYPEDEF, TYPEREF, MODULEREF, METHODDEF, TYPESPEC)),
+}
+
+# столбцы таблиц: 'u2', 'u4', 'str', 'guid', 'blob', номер таблицы (индекс строки таблицы), имя кодированного индекса
+TABLE_SCHEMAS: Dict[int, Tuple[Any, ...]] = {
+    MODULE: ('u2', 'str', 'guid', 'guid', 'guid'),
+    TYPEREF: ('ResolutionScope', 'str', 'str'),
+    TYPEDEF: ('u4', 'str', 'str', 'TypeDefOrRef', FIELD_TABLE, METHODDEF),
+    FIELD_TABLE: ('u2', 'str', 'blob'),
+    METHODDEF: ('u4', 'u2', 'u2', 'str', 'blob', PARAM),
+    PARAM: ('u2', 'u2', 'str'),
+    MEMBERREF: ('MemberRefParent', 'str', 'blob'),
+    STANDALONESIG: ('blob',),
+    MODULEREF: ('str',),
+    TYPESPEC: ('blob',),
+    ASSEMBLY: ('u4', 'u2', 'u2', 'u2', 'u2', 'u4', 'blob', 'str', 'str'),
+    ASSEMBLYREF: ('u2', 'u2', 'u2', 'u2', 'u4', 'blob', 'str', 'str', 'blob'),
+    FILE: ('u4', 'str', 'blob'),
+}
+
+SORTED_TABLES = 0x000016003301FA00
+ASSEMBLY_HASH_SHA1 = 0x8004
+FILE_NO_METADATA = 0x1
+METADATA_VERSION = 'v4.0.30319'
+
+
+def compressed(value: int) -> bytes:
+    if value < 0x80:
+        return bytes((value,))
+    if value < 0x4000:
+        return struct.pack('>H', 0x8000 | value)
+    return struct.pack('>I', 0xC0000000 | value)
+
+
+def split_name(name: str) -> Tuple[str, str]:
+    namespace, _, name = name.rpartition('.')
+    return namespace, name
+
+
+def align(value: int, alignment: int) -> int:
+    return (value + alignment - 1) // alignment * alignment
+
+
+class Heap:
+    """Куча строк, blob или пользовательских строк (значения не повторяются)
+    """
+
+    def __init__(self) -> None:
+        self.data = bytearray(1)
+        self.offsets: Dict[Any, int] = {}
+
+    def add(self, key: Any, data: bytes) -> int:
+        offset = self.offsets.get(key)
+        if offset is None:
+            offset = self.offsets[key] = len(self.data)
+            self.data += data
+        return offset
+
+
+class MetadataBuilder:
+    """Построение таблиц метаданных и тел методов модуля
+    """
+
+    def __init__(self, module: Module, file_name: str, executable: bool = True) -> None:
+        self.module = module
+        self.executable = executable
+        self.tables: Dict[int, List[Tuple[int, ...]]] = {table: [] for table in TABLE_SCHEMAS}
+        self.strings = Heap()
+        self.blobs = Heap()
+        self.user_strings = Heap()
+        self.guids = bytearray()
+        self.typedefs: Dict[str, int] = {}
+        self.fields: Dict[Tuple[str, str], int] = {}
+        self.methods: Dict[Tuple[str, str, bytes], int] = {}
+        self.refs: Dict[Tuple[Any, ...], int] = {}
+        self.entry_point = 0
+        self.il = bytearray()
+        self.file_name = file_name
+
+    # --- кучи
+
+    def string(self, value: str) -> int:
+        if not value:
+            return 0
+        return self.strings.add(value, value.encode('utf-8') + b'\0')
+
+    def blob(self, value: bytes) -> int:
+        return self.blobs.add(value, compressed(len(value)) + value)
+
+    def user_string(self, value: str) -> int:
+        data = value.encode('utf-16-le')
+        special = any(ord(c) > 0xFF or 0x01 <= ord(c) <= 0x08 or 0x0E <= ord(c) <= 0x1F or ord(c) in (0x27, 0x2D, 0x7F)
+                      for c in value)
+        return self.user_strings.add(value, compressed(len(data) + 1) + data + bytes((special,)))
+
+    def add_row(self, table: int, *row: int) -> int:
+        self.tables[table].append(row)
+        return len(self.tables[table])
+
+    def ref(self, key: Tuple[Any, ...], table: int, *row: int) -> int:
+        # строки таблиц ссылок (TypeRef, MemberRef и т.п.) не повторяются
+        index = self.refs.get(key)
+        if index is None:
+            index = self.refs[key] = self.add_row(table, *row)
+        return index
+
+    # --- типы
+
+    def assembly_ref(self, name: str) -> int:
+        if name not in self.module.assembly_refs and name == CORLIB:
+            self.module.assembly_refs[name] = (CORLIB_VERSION, CORLIB_PUBLIC_KEY_TOKEN)
+        version, token = self.module.assembly_refs.get(name, ((0, 0, 0, 0), b''))
+        return self.ref(('assemblyref', name), ASSEMBLYREF, *version, 0, self.blob(token) if token else 0,
+                        self.string(name), 0, 0)
+
+    def type_def_or_ref(self, scope: Any, name: str) -> Tuple[int, int]:
+        """Таблица и номер строки (TypeDef или TypeRef) для класса
+        """
+
+        if scope is None:
+            if name not in self.typedefs:
+                raise PeException('Неизвестный тип {}'.format(name))
+            return TYPEDEF, self.typedefs[name]
+        if scope[0] == 'module':
+            resolution = self.ref(('moduleref', scope[1]), MODULEREF, self.string(scope[1])) << 2 | 1
+        else:
+            resolution = self.assembly_ref(scope[1]) << 2 | 2
+        if '/' in name:
+            outer, _, name = name.rpartition('/')
+            resolution = self.type_def_or_ref(scope, outer)[1] << 2 | 3
+        namespace, short_name = split_name(name)
+        return TYPEREF, self.ref(('typeref', scope, name), TYPEREF, resolution,
+                                 self.string(short_name), self.string(namespace))
+
+    def type_spec(self, type_: Type) -> int:
+        sig = self.type_sig(type_)
+        return self.ref(('typespec', sig), TYPESPEC, self.blob(sig))
+
+    def coded_type(self, type_: Type) -> int:
+        """Кодированный индекс TypeDefOrRef для типа
+        """
+
+        if type_[0] in ('class', 'valuetype'):
+            table, index = self.type_def_or_ref(type_[1], type_[2])
+            return index << 2 | (0 if table == TYPEDEF else 1)
+        return self.type_spec(type_) << 2 | 2
+
+    def type_sig(self, type_: Type) -> bytes:
+        kind = type_[0]
+        if kind == 'prim':
+            return bytes((ELEMENT_TYPES[type_[1]],))
+        if kind in ('class', 'valuetype'):
+            if type_[1] == ('assembly', CORLIB) and type_[2] in ('System.String', 'System.Object'):
+                return bytes((ELEMENT_TYPES['string' if type_[2] == 'System.String' else 'object'],))
+            element = ELEMENT_TYPE_CLASS if kind == 'class' else ELEMENT_TYPE_VALUETYPE
+            return bytes((element,)) + compressed(self.coded_type(type_))
+        if kind == 'szarray':
+            return bytes((ELEMENT_TYPE_SZARRAY,)) + self.type_sig(type_[1])
+        if kind == 'byref':
+            return bytes((ELEMENT_TYPE_BYREF,)) + self.type_sig(type_[1])
+        if kind == 'ptr':
+            return bytes((ELEMENT_TYPE_PTR,)) + self.type_sig(type_[1])
+        if kind == 'generic':
+            base, args = type_[1], type_[2]
+            element = ELEMENT_TYPE_CLASS if base[0] == 'class' else ELEMENT_TYPE_VALUETYPE
+            return bytes((ELEMENT_TYPE_GENERICINST, element)) + compressed(self.coded_type(base)) + \
+                compressed(len(args)) + b''.join(self.type_sig(arg) for arg in args)
+        element = ELEMENT_TYPE_VAR if kind == 'var' else ELEMENT_TYPE_MVAR
+        return bytes((element,)) + compressed(type_[1])
+
+    def method_sig(self, instance: bool, ret: Type, params: Iterable[Type]) -> bytes:
+        params = list(params)
+        return bytes((SIG_HASTHIS if instance else 0,)) + compressed(len(params)) + self.type_sig(ret) + \
+            b''.join(self.type_sig(p) for p in params)
+
+    def type_token(self, type_: Type) -> int:
+        if type_[0] == 'prim' and type_[1] in SYSTEM_TYPES:
+            type_ = ('class', ('assembly', CORLIB), SYSTEM_TYPES[type_[1]])
+        if type_[0] in ('class', 'valuetype'):
+            table, index = self.type_def_or_ref(type_[1], type_[2])
+            return table << 24 | index
+        return TYPESPEC << 24 | self.type_spec(type_)
+
+    def parent(self, owner: Type) -> Tuple[int, Optional[str]]:
+        """Кодированный индекс MemberRefParent и имя класса (для классов текущего модуля)
+        """
+
+        if owner[0] in ('class', 'valuetype'):
+            table, index = self.type_def_or_ref(owner[1], owner[2])
+            if table == TYPEDEF:
+                return index << 3, owner[2]
+            return index << 3 | 1, None
+        return self.type_spec(owner) << 3 | 4, None
+
+    def method_token(self, ref: Tuple[Any, ...], line: int) -> int:
+        owner, name, instance, ret, params = ref
+        sig = self.method_sig(instance, ret, params)
+        parent, own_class = self.parent(owner)
+        if own_class is not None:
+            if (own_class, name, sig) not in self.methods:
+                raise PeException('Неизвестный метод {}::{}'.format(own_class, name), line)
+            return METHODDEF << 24 | self.methods[(own_class, name, sig)]
+        return MEMBERREF << 24 | self.ref(('memberref', parent, name, sig), MEMBERREF, parent,
+                                          self.string(name), self.blob(sig))
+
+    def field_token(self, ref: Tuple[Any, ...], line: int) -> int:
+        owner, name, type_ = ref
+        parent, own_class = self.parent(owner)
+        if own_class is not None:
+            if (own_class, name) not in self.fields:
+                raise PeException('Неизвестное поле {}::{}'.format(own_class, name), line)
+            return FIELD_TABLE << 24 | self.fields[(own_class, name)]
+        sig = bytes((SIG_FIELD,)) + self.type_sig(type_)
+        return MEMBERREF << 24 | self.ref(('memberref', parent, name, sig), MEMBERREF, parent,
+                                          self.string(name), self.blob(sig))
+
+    # --- тела методов
+
+    def body(self, method: MethodDef) -> bytes:
+        """Заголовок и код метода (для переходов выбирается короткая форма, если метка достаточно близко)
+        """
+
+        instrs = []
+        for op, operand, line in method.instrs:
+            instrs.append(self.resolve(method, op, operand, line))
+        labels = method.labels
+
+        def target(label: str, line: int) -> int:
+            if label not in labels:
+                raise PeException('Неизвестная метка {}'.format(label), line)
+            return labels[label]
+
+        targets = [None] * len(instrs)
+        short = [False] * len(instrs)
+        for i, (op, operand, line) in enumerate(instrs):
+            if op in SHORT_BRANCHES:
+                targets[i] = target(operand, line)
+                short[i] = True
+            elif op == 'switch':
+                targets[i] = [target(label, line) for label in operand]
+
+        def size(i: int) -> int:
+            op, operand, _ = instrs[i]
+            code, kind = OPCODES[op]
+            result = 2 if code > 0xFF else 1
+            if kind == BR:
+                return result + (1 if short[i] else 4)
+            if kind == SWITCH:
+                return result + 4 + 4 * len(operand)
+            if kind == VAR:
+                return result + (1 if op in VAR_SHORT_FORMS else 2)
+            return result + {NONE: 0, I1: 1, I4: 4, I8: 8, R4: 4, R8: 8}.get(kind, 4)
+
+        # переходы удлиняются, пока все смещения коротких переходов не поместятся в байт
+        while True:
+            offsets = [0]
+            for i in range(len(instrs)):
+                offsets.append(offsets[-1] + size(i))
+            changed = False
+            for i in range(len(instrs)):
+                if short[i] and not -128 <= offsets[targets[i]] - offsets[i + 1] <= 127:
+                    short[i] = False
+                    changed = True
+            if not changed:
+                break
+
+        code = bytearray()
+        for i, (op, operand, _) in enumerate(instrs):
+            if op in SHORT_BRANCHES and short[i]:
+                op = SHORT_BRANCHES[op]
+            opcode, kind = OPCODES[op]
+            code += struct.pack('>H', opcode) if opcode > 0xFF else bytes((opcode,))
+            end = offsets[i + 1]
+            if kind == BR:
+                code += struct.pack('<b' if short[i] else '<i', offsets[targets[i]] - end)
+            elif kind == SWITCH:
+                code += struct.pack('<I', len(operand))
+                code += b''.join(struct.pack('<i', offsets[t] - end) for t in targets[i])
+            elif kind == VAR:
+                code += struct.pack('<B' if op in VAR_SHORT_FORMS else '<H', operand)
+            elif kind == I1:
+                code += struct.pack('<b', operand)
+            elif kind == I8:
+                code += struct.pack('<q', operand)
+            elif kind == R4:
+                code += struct.pack('<f', operand)
+            elif kind == R8:
+                code += struct.pack('<d', operand)
+            elif kind != NONE:
+                code += struct.pack('<I' if kind != I4 else '<i', operand)
+
+        local_sig = 0
+        if method.locals:
+            sig = bytes((SIG_LOCALS,)) + compressed(len(method.locals)) + \
+                b''.join(self.type_sig(type_) for type_, _ in method.locals)
+            local_sig = STANDALONESIG << 24 | self.ref(('sig', sig), STANDALONESIG, self.blob(sig))
+        if len(code) < 64 and method.max_stack <= 8 and not local_sig:
+            return bytes((len(code) << 2 | 0x2,)) + code
+        flags = 0x3003 | (0x10 if method.init_locals else 0)
+        return struct.pack('<HHII', flags, method.max_stack, len(code), local_sig) + code
+
+    def resolve(self, method: MethodDef, op: str, operand: Any, line: int) -> Tuple[str, Any, int]:
+        """Инструкция в общей форме с операндом-токеном или номером (короткие формы для
+           констант и переменных выбираются здесь, для переходов - при записи кода)
+        """
+
+        op = LONG_BRANCHES.get(op, op)
+        if op in VAR_NUMBERED_FORMS:
+            op, operand = VAR_NUMBERED_FORMS[op]
+        op = VAR_SHORT_FORMS.get(op, op)
+        if op in VAR_FORMS:
+            if isinstance(operand, str):
+                operand = self.var_index(method, op, operand, line)
+            numbered, short = VAR_FORMS[op]
+            if numbered and operand <= 3:
+                return numbered.format(operand), None, line
+            return (short if operand <= 0xFF else op), operand, line
+        if op.startswith('ldc.i4'):
+            if op != 'ldc.i4' and op != 'ldc.i4.s':
+                return op, None, line
+            operand = to_int32(operand)
+            if -1 <= operand <= 8:
+                return 'ldc.i4.m1' if operand == -1 else 'ldc.i4.{}'.format(operand), None, line
+            return ('ldc.i4.s' if -128 <= operand <= 127 else 'ldc.i4'), operand, line
+        if op == 'ldc.i8':
+            operand = (operand + (1 << 63)) % (1 << 64) - (1 << 63)
+        _, kind = OPCODES[op]
+        if kind == METHOD:
+            operand = self.method_token(operand, line)
+        elif kind == FIELD:
+            operand = self.field_token(operand, line)
+        elif kind == TYPE:
+            operand = self.type_token(operand)
+        elif kind == STRING:
+            operand = STRING_TOKEN << 24 | self.user_string(operand)
+        return op, operand, line
+
+    @staticmethod
+    def var_index(method: MethodDef, op: str, name: str, line: int) -> int:
+        if op in ('ldarg', 'starg', 'ldarga'):
+            names = [param_name for _, param_name in method.params]
+            if name in names:
+                return names.index(name) + (1 if method.instance else 0)
+        else:
+            names = [local_name for _, local_name in method.locals]
+            if name in names:
+                return names.index(name)
+        raise PeException('Неизвестная переменная {}'.format(name), line)
+
+    # --- сборка
+
+    def build(self, il_rva: int) -> None:
+        module = self.module
+        self.add_row(MODULE, 0, self.string(self.file_name), 1, 0, 0)
+        if module.assembly:
+            self.add_row(ASSEMBLY, ASSEMBLY_HASH_SHA1, *module.assembly_version, 0, 0,
+                         self.string(module.assembly), 0)
+        self.assembly_ref(CORLIB)
+        for name in module.module_refs:
+            self.ref(('moduleref', name), MODULEREF, self.string(name))
+        for name, flags, hash_ in module.files:
+            self.add_row(FILE, flags, self.string(name), self.blob(hash_) if hash_ else 0)
+
+        # классы, поля и методы модуля (номера строк известны до кодирования сигнатур и тел методов)
+        for i, cls in enumerate(module.classes):
+            if cls.name in self.typedefs:
+                raise PeException('Повторное объявление класса {}'.format(cls.name))
+            self.typedefs[cls.name] = i + 2
+        field_index, method_index = 1, 1
+        for cls in module.classes:
+            for field in cls.fields:
+                self.fields[(cls.name, field.name)] = field_index
+                field_index += 1
+            for method in cls.methods:
+                sig = self.method_sig(method.instance, method.ret, (type_ for type_, _ in method.params))
+                key = (cls.name, method.name, sig)
+                if key in self.methods:
+                    raise PeException('Повторное объявление метода {}::{}'.format(cls.name, method.name))
+                self.methods[key] = method_index
+                method_index += 1
+
+        self.add_row(TYPEDEF, 0, self.string('<Module>'), 0, 0, 1, 1)
+        field_index, method_index, param_index = 1, 1, 1
+        for cls in module.classes:
+            namespace, name = split_name(cls.name)
+            extends = self.coded_type(cls.extends) if cls.extends else 0
+            self.add_row(TYPEDEF, cls.flags, self.string(name), self.string(namespace), extends,
+                         field_index, method_index)
+            for field in cls.fields:
+                self.add_row(FIELD_TABLE, field.flags, self.string(field.name),
+                             self.blob(bytes((SIG_FIELD,)) + self.type_sig(field.type)))
+                field_index += 1
+            for method in cls.methods:
+                sig = self.method_sig(method.instance, method.ret, (type_ for type_, _ in method.params))
+                rva = 0
+                if not method.flags & METHOD_ATTRS['abstract']:
+                    if len(self.il) % 4:
+                        # заголовок fat выравнивается на 4 байта
+                        self.il += bytes(4 - len(self.il) % 4)
+                    rva = il_rva + len(self.il)
+                    self.il += self.body(method)
+                self.add_row(METHODDEF, rva, method.impl_flags, method.flags, self.string(method.name),
+                             self.blob(sig), param_index)
+                for seq, (_, param_name) in enumerate(method.params, 1):
+                    if param_name:
+                        self.add_row(PARAM, 0, seq, self.string(param_name))
+                        param_index += 1
+                if method.entrypoint:
+                    if self.entry_point:
+                        raise PeException('Несколько точек входа (.entrypoint)')
+                    self.entry_point = METHODDEF << 24 | method_index
+                method_index += 1
+        if not self.entry_point and self.executable:
+            raise PeException('Не найдена точка входа (.entrypoint)')
+
+        # идентификатор модуля (MVID) зависит только от содержимого, сборка воспроизводима
+        digest = hashlib.md5(bytes(self.il) + bytes(self.strings.data) + bytes(self.blobs.data) +
+                             bytes(self.user_strings.data)).digest()
+        self.guids += uuid.UUID(bytes=digest, version=4).bytes
+
+    def table_stream(self) -> bytes:
+        heap_sizes = (len(self.strings.data) >= 0x10000) | (len(self.guids) >= 0x10000) << 1 | \
+            (len(self.blobs.data) >= 0x10000) << 2
+        rows = {table: len(self.tables[table]) for table in TABLE_SCHEMAS}
+
+        def column_size(column: Any) -> int:
+            if column == 'u2':
+                return 2
+            if column == 'u4':
+                return 4
+            if column in ('str', 'guid', 'blob'):
+                bit = {'str': 1, 'guid': 2, 'blob': 4}[column]
+                return 4 if heap_sizes & bit else 2
+            if isinstance(column, int):
+                return 2 if rows[column] < 0x10000 else 4
+            bits, tables = CODED_INDEXES[column]
+            return 2 if max(rows.get(t, 0) for t in tables) < 1 << (16 - bits) else 4
+
+        present = [table for table in sorted(TABLE_SCHEMAS) if rows[table]]
+        data = bytearray(struct.pack('<IBBBBQQ', 0, 2, 0, heap_sizes, 1, sum(1 << t for t in present),
+                                     SORTED_TABLES))
+        data += b''.join(struct.pack('<I', rows[table]) for table in present)
+        for table in present:
+            formats = ''.join('H' if column_size(column) == 2 else 'I' for column in TABLE_SCHEMAS[table])
+            for row in self.tables[table]:
+                data += struct.pack('<' + formats, *row)
+        return bytes(data)
+
+    def metadata(self) -> bytes:
+        streams = [
+            ('#~', self.table_stream()),
+            ('#Strings', bytes(self.strings.data)),
+            ('#US', bytes(self.user_strings.data)),
+            ('#GUID', bytes(self.guids)),
+            ('#Blob', bytes(self.blobs.data)),
+        ]
+        version = METADATA_VERSION.encode('ascii')
+        version += bytes(align(len(version) + 1, 4) - len(version))
+        header = struct.pack('<IHHII', 0x424A5342, 1, 1, 0, len(version)) + version + \
+            struct.pack('<HH', 0, len(streams))
+        headers_size = len(header) + sum(8 + align(len(name) + 1, 4) for name, _ in streams)
+        offset = headers_size
+        data = bytearray(header)
+        for name, stream in streams:
+            size = align(len(stream), 4)
+            data += struct.pack('<II', offset, size)
+            data += name.encode('ascii') + bytes(align(len(name) + 1, 4) - len(name))
+            offset += size
+        for _, stream in streams:
+            data += stream + bytes(align(len(stream), 4) - len(stream))
+        return bytes(data)
+
+
+def to_int32(value: int) -> int:
+    value &= 0xFFFFFFFF
+    return value - (1 << 32) if value >= 1 << 31 else value
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Образ PE
+
+IMAGE_BASE = 0x400000
+SECTION_ALIGNMENT = 0x2000
+FILE_ALIGNMENT = 0x200
+TEXT_RVA = SECTION_ALIGNMENT
+CLI_HEADER_SIZE = 72
+IAT_SIZE = 8
+
+DOS_STUB = bytes.fromhex('0E1FBA0E00B409CD21B8014CCD21') + b'This program cannot be run in DOS mode.\r\r\n$'
+
+
+def dos_header() -> bytes:
+    header = bytearray(64)
+    header[0:2] = b'MZ'
+    struct.pack_into('<HHHHHHHHH', header, 2, 0x90, 3, 0, 4, 0, 0xFFFF, 0, 0xB8, 0)
+    struct.pack_into('<H', header, 24, 0x40)
+    struct.pack_into('<I', header, 60, 0x80)
+    return bytes(header) + DOS_STUB + bytes(0x80 - 64 - len(DOS_STUB))
+
+
+def image(builder: MetadataBuilder) -> bytes:
+    """Образ исполняемого файла: секция .text (таблица импорта, заголовок CLI, тела методов, метаданные,
+       заглушка точки входа, вызывающая _CorExeMain или _CorDllMain из mscoree.dll) и секция .reloc
+       (поправка адреса в заглушке)
+    """
+
+    il_rva = TEXT_RVA + IAT_SIZE + CLI_HEADER_SIZE
+    builder.build(il_rva)
+    il = bytes(builder.il)
+    metadata = builder.metadata()
+    metadata_rva = align(il_rva + len(il), 4)
+
+    import_rva = align(metadata_rva + len(metadata), 4)
+    lookup_rva = import_rva + 40
+    hint_rva = lookup_rva + 8
+    dll_rva = hint_rva + 14
+    import_end = dll_rva + 12
+    # операнд инструкции jmp [IAT] выравнивается на 4 байта
+    stub_rva = align(import_end + 2, 4) - 2
+    text_end = stub_rva + 6
+
+    text = bytearray(text_end - TEXT_RVA)
+
+    def put(rva: int, data: bytes) -> None:
+        text[rva - TEXT_RVA:rva - TEXT_RVA + len(data)] = data
+
+    put(TEXT_RVA, struct.pack('<II', hint_rva, 0))
+    put(TEXT_RVA + IAT_SIZE, struct.pack('<IHHIIII', CLI_HEADER_SIZE, 2, 5, metadata_rva, len(metadata), 1,
+                                         builder.entry_point) + bytes(CLI_HEADER_SIZE - 24))
+    put(il_rva, il)
+    put(metadata_rva, metadata)
+    put(import_rva, struct.pack('<IIIII', lookup_rva, 0, 0, dll_rva, TEXT_RVA))
+    put(lookup_rva, struct.pack('<II', hint_rva, 0))
+    put(hint_rva, struct.pack('<H', 0) + (b'_CorExeMain\0' if builder.executable else b'_CorDllMain\0'))
+    put(dll_rva, b'mscoree.dll\0')
+    put(stub_rva, b'\xFF\x25' + struct.pack('<I', IMAGE_BASE + TEXT_RVA))
+
+    reloc_rva = align(text_end, SECTION_ALIGNMENT)
+    page = (stub_rva + 2) & ~0xFFF
+    reloc = struct.pack('<IIHH', page, 12, 3 << 12 | (stub_rva + 2 - page), 0)
+
+    headers_size = align(0x80 + 4 + 20 + 224 + 2 * 40, FILE_ALIGNMENT)
+    text_raw = align(len(text), FILE_ALIGNMENT)
+    reloc_raw = align(len(reloc), FILE_ALIGNMENT)
+    image_size = reloc_rva + align(len(reloc), SECTION_ALIGNMENT)
+
+    coff = struct.pack('<HHIIIHH', 0x14C, 2, 0, 0, 0, 224, 0x010E if builder.executable else 0x210E)
+    directories = [(0, 0)] * 16
+    directories[1] = (import_rva, import_end - import_rva)
+    directories[5] = (reloc_rva, len(reloc))
+    directories[12] = (TEXT_RVA, IAT_SIZE)
+    directories[14] = (TEXT_RVA + IAT_SIZE, CLI_HEADER_SIZE)
+    optional = struct.pack('<HBBIIIIIIIIIHHHHHHIIIIHHIIIIII', 0x10B, 8, 0, text_raw, reloc_raw, 0, stub_rva,
+                           TEXT_RVA, reloc_rva, IMAGE_BASE, SECTION_ALIGNMENT, FILE_ALIGNMENT, 4, 0, 0, 0, 4, 0, 0,
+                           image_size, headers_size, 0, 3, 0x8540, 0x100000, 0x1000, 0x100000, 0x1000, 0, 16)
+    optional += b''.join(struct.pack('<II', rva, size) for rva, size in directories)
+    sections = struct.pack('<8sIIIIIIHHI', b'.text', len(text), TEXT_RVA, text_raw, headers_size, 0, 0, 0, 0,
+                           0x60000020)
+    sections += struct.pack('<8sIIIIIIHHI', b'.reloc', len(reloc), reloc_rva, reloc_raw, headers_size + text_raw,
+                            0, 0, 0, 0, 0x42000040)
+
+    headers = dos_header() + b'PE\0\0' + coff + optional + sections
+    return headers + bytes(headers_size - len(headers)) + \
+        bytes(text) + bytes(text_raw - len(text)) + reloc + bytes(reloc_raw - len(reloc))
+
+
+def assemble(sources: Iterable[str], file_name: str, executable: bool = True) -> bytes:
+    """Сборка исполняемого файла или модуля (.netmodule, как ilasm /dll для текста без .assembly) из текстов MSIL
+    :param sources: тексты (код программы, код библиотеки времени выполнения)
+    :param file_name: имя исполняемого файла (имя модуля в метаданных)
+    :param executable: собирается исполняемый файл (иначе - модуль без точки входа)
+    :return: содержимое файла
+    """
+
+    module = Module()
+    for text in sources:
+        Parser(module, text).parse()
+    return image(MetadataBuilder(module, file_name, executable))
+
+
+def listing(text: str) -> List[str]:
+    """Листинг методов текста MSIL в общей форме для сравнения (короткие формы инструкций, номера и имена
+       переменных, имена меток не влияют на результат; текст ildasm и текст компилятора для одного
+       исполняемого файла дают одинаковые листинги)
+    :param text: текст MSIL
+    :return: строки листинга
+    """
+
+    module = Module()
+    Parser(module, text).parse()
+    result = []
+    for cls in module.classes:
+        for method in cls.methods:
+            result.append('{} {}::{}({})'.format(method.ret, cls.name, method.name,
+                                                 ', '.join(str(type_) for type_, _ in method.params)))
+            result.append('  .maxstack {}{}'.format(method.max_stack, ' .entrypoint' if method.entrypoint else ''))
+            result.append('  .locals ({})'.format(', '.join(str(type_) for type_, _ in method.locals)))
+            labels = method.labels
+            for op, operand, line in method.instrs:
+                op = LONG_BRANCHES.get(op, op)
+                if op in VAR_NUMBERED_FORMS:
+                    op, operand = VAR_NUMBERED_FORMS[op]
+                op = VAR_SHORT_FORMS.get(op, op)
+                if op in VAR_FORMS and isinstance(operand, str):
+                    operand = MetadataBuilder.var_index(method, op, operand, line)
+                elif op == 'ldc.i4.m1':
+                    op, operand = 'ldc.i4', -1
+                elif op.startswith('ldc.i4.') and op != 'ldc.i4.s':
+                    op, operand = 'ldc.i4', int(op[len('ldc.i4.'):])
+                elif op in ('ldc.i4', 'ldc.i4.s'):
+                    op, operand = 'ldc.i4', to_int32(operand)
+                elif op in SHORT_BRANCHES:
+                    operand = labels.get(operand, operand)
+                elif op == 'switch':
+                    operand = [labels.get(label, label) for label in operand]
+                elif OPCODES[op][1] == TYPE:
+                    # как в MetadataBuilder.type_token: newarr int32 и newarr [mscorlib]System.Int32 - один токен
+                    if operand[0] == 'prim' and operand[1] in SYSTEM_TYPES:
+                        operand = ('class', ('assembly', CORLIB), SYSTEM_TYPES[operand[1]])
+                    if operand[0] == 'valuetype':
+                        operand = ('class', *operand[1:])
+                result.append('  {}{}'.format(op, '' if operand is None else ' {!r}'.format(operand)))
+    return result
+
+
+def read_text(file_name: str) -> str:
+    """Текст MSIL из файла (ildasm пишет текст в UTF-8 или UTF-16, образцы test/*.msil хранятся в UTF-16)
+    """
+
+    with open(file_name, 'rb') as f:
+        data = f.read()
+    return data.decode('utf-16' if data[:2] in (b'\xff\xfe', b'\xfe\xff') else 'utf-8-sig')
+
+
+if __name__ == "__main__":
+    # листинг для сравнения вывода ildasm с текстом компилятора (см. check-net.sh)
+    for listing_line in listing(read_text(sys.argv[1])):
+        print(listing_line)
@@ -0,0 +1,287 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .code_buffer import CodeBuffer, NO_LABEL
+
+# безусловные переходы, после которых код без меток недостижим
+UNCONDITIONAL_OPS = ('br', 'ret', 'throw', 'rethrow', 'leave')
+
+BRANCH_OPS = ('br', 'brtrue', 'brfalse', 'beq', 'bne.un', 'blt', 'ble', 'bgt', 'bge',
+              'blt.un', 'ble.un', 'bgt.un', 'bge.un', 'leave')
+
+# пары взаимообратных условных переходов (корректных для любых типов операндов)
+INVERTED_BRANCHES = {
+    'brtrue': 'brfalse',
+    'brfalse': 'brtrue',
+    'beq': 'bne.un',
+    'bne.un': 'beq',
+}
+
+# операции, результат которых всегда 0 или 1
+COMPARE_OPS = ('ceq', 'cgt', 'clt', 'cgt.un', 'clt.un')
+
+# короткие формы инструкций работы с переменными и аргументами: операция -> (макс. индекс для формы .N)
+VAR_OPS = {
+    'ldloc': 3,
+    'stloc': 3,
+    'ldarg': 3,
+    'starg': -1,
+    'ldloca': -1,
+    'ldarga': -1,
+}
+
+
+class Instr:
+    """Инструкция MSIL (метки, операция и аргументы) для оконной оптимизации
+    """
+
+    def __init__(self, op: str, args: List[Any], labels: List[Any] = None, indent: str = '') -> None:
+        self.op = op
+        self.args = args
+        self.labels = labels or []
+        self.indent = indent
+
+    def target(self) -> Any:
+        return self.args[0] if self.op in BRANCH_OPS else None
+
+    def targets(self) -> List[Any]:
+        # switch - переход по таблице меток
+        if self.op == 'switch':
+            return list(self.args)
+        return [self.args[0]] if self.op in BRANCH_OPS else []
+
+    def int_arg(self) -> Optional[int]:
+        try:
+            return int(str(self.args[0]))
+        except (IndexError, ValueError):
+            return None
+
+    def __str__(self) -> str:
+        return ' '.join([self.op, *(str(a) for a in self.args)])
+
+
+class Window:
+    """Окно инструкций (последовательность инструкций одного метода) с поиском по меткам
+    """
+
+    def __init__(self, instrs: List[Instr]) -> None:
+        self.instrs = instrs
+
+    def find(self, label: Any) -> Optional[Instr]:
+        for instr in self.instrs:
+            if label in instr.labels:
+                return instr
+        return None
+
+    def no_labels(self, start: int, count: int) -> bool:
+        if start + count > len(self.instrs):
+            return False
+        return all(not self.instrs[j].labels for j in range(start, start + count))
+
+    def ops(self, start: int, count: int) -> Tuple[str, ...]:
+        return tuple(instr.op for instr in self.instrs[start:start + count])
+
+
+Rule = Callable[[Window, int], Optional[Tuple[int, List[Instr]]]]
+
+
+def _new(instr: Instr, op: str, *args: Any) -> Instr:
+    return Instr(op, list(args), indent=instr.indent)
+
+
+def _short_ldc(w: Window, i: int) -> Optional[Tuple[int, List[Instr]]]:
+    instr = w.instrs[i]
+    value = instr.int_arg() if instr.op == 'ldc.i4' else None
+    if value is None:
+        return None
+    if value == -1:
+        return 1, [_new(instr, 'ldc.i4.m1')]
+    if 0 <= value <= 8:
+        return 1, [_new(instr, f'ldc.i4.{value}')]
+    if -128 <= value <= 127:
+        return 1, [_new(instr, 'ldc.i4.s', value)]
+    return None
+
+
+def _short_var(w: Window, i: int) -> Optional[Tuple[int, List[Instr]]]:
+    instr = w.instrs[i]
+    index = instr.int_arg() if instr.op in VAR_OPS else None
+    if index is None:
+        return None
+    if index <= VAR_OPS[instr.op]:
+        return 1, [_new(instr, f'{instr.op}.{index}')]
+    if index <= 255:
+        return 1, [_new(instr, f'{instr.op}.s', index)]
+    return None
+
+
+def _br_to_next(w: Window, i: int) -> Optional[Tuple[int, List[Instr]]]:
+    instr = w.instrs[i]
+    if instr.op == 'br' and i + 1 < len(w.instrs) and instr.args[0] in w.instrs[i + 1].labels:
+        return 1, []
+    return None
+
+
+def _unreachable(w: Window, i: int) -> Optional[Tuple[int, List[Instr]]]:
+    if w.instrs[i].op in UNCONDITIONAL_OPS and w.no_labels(i + 1, 1) and w.instrs[i + 1].op:
+        return 2, [w.instrs[i]]
+    return None
+
+
+def _jump_chain(w: Window, i: int) -> Optional[Tuple[int, List[Instr]]]:
+    instr = w.instrs[i]
+    label = instr.target()
+    if label is None:
+        return None
+    target = w.find(label)
+    if target is None:
+        return None
+    if target.op == 'br' and target.args[0] is not label:
+        return 1, [_new(instr, instr.op, target.args[0], *instr.args[1:])]
+    if instr.op == 'br' and target.op == 'ret':
+        return 1, [_new(instr, 'ret')]
+    return None
+
+
+def _branch_over_br(w: Window, i: int) -> Optional[Tuple[int, List[Instr]]]:
+    # brtrue L1; br L2; L1: ...  ->  brfalse L2; L1: ...
+    instr = w.instrs[i]
+    if instr.op in INVERTED_BRANCHES and w.no_labels(i + 1, 1) and w.instrs[i + 1].op == 'br' and \
+            i + 2 < len(w.instrs) and instr.args[0] in w.instrs[i + 2].labels:
+        return 2, [_new(instr, INVERTED_BRANCHES[instr.op], w.instrs[i + 1].args[0])]
+    return None
+
+
+def _double_negation(w: Window, i: int) -> Optional[Tuple[int, List[Instr]]]:
+    # ceq; ldc.i4.0; ceq; ldc.i4.0; ceq  ->  ceq
+    if w.instrs[i].op in COMPARE_OPS and w.no_labels(i + 1, 4) and \
+            w.ops(i + 1, 4) == ('ldc.i4.0', 'ceq', 'ldc.i4.0', 'ceq'):
+        return 5, [w.instrs[i]]
+    return None
+
+
+def _negated_branch(w: Window, i: int) -> Optional[Tuple[int, List[Instr]]]:
+    # ldc.i4.0; ceq; brfalse L  ->  brtrue L
+    if w.ops(i, 2) == ('ldc.i4.0', 'ceq') and w.no_labels(i + 1, 2) and w.instrs[i + 2].op in ('brtrue', 'brfalse'):
+        branch = w.instrs[i + 2]
+        return 3, [_new(branch, INVERTED_BRANCHES[branch.op], *branch.args)]
+    return None
+
+
+def _store_load(w: Window, i: int) -> Optional[Tuple[int, List[Instr]]]:
+    # stsfld f; ldsfld f  ->  dup; stsfld f
+    if w.ops(i, 2) == ('stsfld', 'ldsfld') and w.no_labels(i + 1, 1) and \
+            str(w.instrs[i].args[0]) == str(w.instrs[i + 1].args[0]):
+        return 2, [_new(w.instrs[i], 'dup'), w.instrs[i]]
+    return None
+
+
+# таблица правил (порядок важен: правила применяются к позиции по очереди до первого срабатывания)
+RULES: List[Tuple[str, Rule]] = [
+    ('short ldc.i4', _short_ldc),
+    ('short ldloc/stloc/ldarg/starg', _short_var),
+    ('br to next instruction', _br_to_next),
+    ('unreachable code', _unreachable),
+    ('jump to jump/ret', _jump_chain),
+    ('branch over br', _branch_over_br),
+    ('double negation', _double_negation),
+    ('negated branch', _negated_branch),
+    ('store/load to dup', _store_load),
+]
+
+MERGED_LABELS_STAT = 'empty label line'
+UNUSED_LABELS_STAT = 'unused label'
+
+
+def _is_instr_line(code: str, label: Any) -> bool:
+    if not code:
+        return label is not None
+    return not (code.startswith('.') or code.startswith('//') or code in ('{', '}'))
+
+
+def _optimize_method(instrs: List[Instr], stats: Dict[str, int]) -> List[Instr]:
+    w = Window(instrs)
+    changed = True
+    while changed:
+        changed = False
+        i = 0
+        while i < len(instrs):
+            for name, rule in RULES:
+                repl = rule(w, i)
+                if repl is None:
+                    continue
+                count, new = repl
+                labels = [label for instr in instrs[i:i + count] for label in instr.labels]
+                if new:
+                    new[0].labels = labels + [label for label in new[0].labels if label not in labels]
+                elif labels:
+                    if i + count < len(instrs):
+                        instrs[i + count].labels = labels + instrs[i + count].labels
+                    else:
+                        new = [Instr('', [], labels, instrs[i].indent)]
+                instrs[i:i + count] = new
+                stats[name] += 1
+                changed = True
+                break
+            else:
+                i += 1
+
+    used = {target for instr in instrs for target in instr.targets()}
+    result = []
+    for instr in instrs:
+        unused = [label for label in instr.labels if label not in used]
+        stats[UNUSED_LABELS_STAT] += len(unused)
+        instr.labels = [label for label in instr.labels if label in used]
+        if instr.op or instr.labels:
+            result.append(instr)
+    return result
+
+
+def optimize(buffer: CodeBuffer) -> Tuple[CodeBuffer, Dict[str, int]]:
+    """Оконная (peephole) оптимизация кода MSIL: строки читаются непосредственно из массивов буфера,
+       результат записывается в новый буфер (в объекты Instr разбираются только инструкции текущего метода)
+    :param buffer: буфер кода
+    :return: буфер оптимизированного кода и статистика срабатываний правил
+    """
+
+    stats = {name: 0 for name, _ in RULES}
+    stats[MERGED_LABELS_STAT] = 0
+    stats[UNUSED_LABELS_STAT] = 0
+    result = CodeBuffer(buffer.line_format)
+    method: List[Instr] = []
+    pending_labels: List[Any] = []
+
+    def flush() -> None:
+        nonlocal method, pending_labels
+        if pending_labels:
+            method.append(Instr('', [], pending_labels))
+            pending_labels = []
+        for instr in _optimize_method(method, stats):
+            *extra_labels, label = instr.labels or [None]
+            for extra in extra_labels:
+                result.add(instr.indent, label=extra)
+            result.add(instr.indent + instr.op, *instr.args, label=label)
+        method = []
+
+    texts, ops, indents, labels = buffer.texts, buffer.ops, buffer.indents, buffer.labels
+    param_starts, param_counts, operands = buffer.param_starts, buffer.param_counts, buffer.operands
+    for i in range(len(ops)):
+        code = texts[ops[i]].strip()
+        label = buffer.label_table[labels[i]] if labels[i] != NO_LABEL else None
+        if not _is_instr_line(code, label):
+            flush()
+            result.copy(buffer, i)
+            continue
+        if label is not None:
+            pending_labels.append(label)
+        if not code:
+            continue
+        op, *rest = code.split(None, 1)
+        if pending_labels and not label:
+            stats[MERGED_LABELS_STAT] += len(pending_labels)
+        elif len(pending_labels) > 1:
+            stats[MERGED_LABELS_STAT] += len(pending_labels) - 1
+        start = param_starts[i]
+        method.append(Instr(op, rest + operands[start:start + param_counts[i]], pending_labels, ' ' * indents[i]))
+        pending_labels = []
+    flush()
+    return result, stats
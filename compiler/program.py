@@ -1,37 +1,378 @@
+import hashlib
+import io
 import os
 import sys
-import traceback
+import threading
+import time
+from typing import Dict, List, Optional, TextIO, Tuple, Union
+
+import pyparsing
 
 from . import mel_parser
 from . import semantic
 from . import mel_ast
 from . import msil
+from . import jvm
+from . import classfile
+from . import pe
+from . import split
+from . import const_eval as const_eval_
+from . import unroll as unroll_
+from . import parallel
+
+
+# среды выполнения из каталога компилятора (как в main.py)
+_ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_RUNTIME = os.path.join(_ROOT_DIR, 'runtime-net', 'runtime.msil')
+DEFAULT_JAVA_RUNTIME = os.path.join(_ROOT_DIR, 'runtime-java')
+
+
+def runtime_module(runtime: str, directory: str) -> Tuple[str, bytes]:
+    """Модуль среды выполнения (.netmodule), собранный из текста MSIL: собирается один раз и хранится в каталоге
+       исполняемых файлов под именем с хэшем текста и версией записи pe (при изменении текста или записи
+       собирается новый модуль)
+    :param runtime: файл с кодом среды выполнения (runtime.msil)
+    :param directory: каталог исполняемых файлов
+    :return: имя файла модуля и SHA-1 его содержимого (для директивы .file)
+    """
+
+    with open(runtime, mode='rb') as f:
+        text = f.read()
+    name = 'runtime_{}_v{}.netmodule'.format(hashlib.sha1(text).hexdigest()[:16], pe.WRITER_VERSION)
+    path = os.path.join(directory, name)
+    if os.path.exists(path):
+        with open(path, mode='rb') as f:
+            data = f.read()
+    else:
+        data = pe.assemble([text.decode('utf-8')], name, executable=False)
+        # запись через временный файл: модуль могут одновременно собирать несколько компиляций
+        temp_path = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+        with open(temp_path, mode='wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    return name, hashlib.sha1(data).digest()
+
+
+# классы среды выполнения JVM, на которые ссылается сгенерированный код
+JAVA_RUNTIME_CLASSES = ('Runtime', 'ParallelBody')
+
+
+def check_java_runtime(runtime_dir: str) -> None:
+    """Проверка class-файлов среды выполнения JVM: каждый должен быть собран и не старше своего исходника
+       (иначе jar-архив падает при запуске с NoSuchMethodError или NoClassDefFoundError)
+    :param runtime_dir: каталог CompilerDemo с исходниками и class-файлами среды выполнения
+    """
+
+    for name in JAVA_RUNTIME_CLASSES:
+        class_path = os.path.join(runtime_dir, name + '.class')
+        java_path = os.path.join(runtime_dir, name + '.java')
+        if not os.path.exists(class_path):
+            raise classfile.JvmException('Класс среды выполнения {} не собран (runtime-java/build)'.format(class_path))
+        if os.path.exists(java_path) and os.path.getmtime(class_path) < os.path.getmtime(java_path):
+            raise classfile.JvmException('Класс среды выполнения {} старше исходника {} (runtime-java/build)'.format(
+                class_path, java_path))
+
+
+class CompileOptions:
+    """Параметры компиляции (по умолчанию - как при запуске main.py без ключей)
+    """
+
+    # результат компиляции: текст MSIL, исполняемый файл, листинг байт-кода JVM, jar-архив
+    TARGETS = ('msil', 'exe', 'jbc', 'jar')
+
+    def __init__(self, target: str = 'msil', tree: bool = False,
+                 memoize: bool = False, const_eval: bool = False,
+                 unroll: int = 0, unroll_budget: int = unroll_.DEFAULT_BUDGET,
+                 peephole: bool = True, peephole_stats: bool = False, promote_globals: bool = True,
+                 reuse_locals: bool = True, string_builders: bool = True,
+                 main_part_size: int = split.DEFAULT_PART_SIZE, buffered_output: bool = True,
+                 exe_name: str = 'program.exe', runtime: str = DEFAULT_RUNTIME, runtime_dir: str = None,
+                 java_runtime: str = DEFAULT_JAVA_RUNTIME) -> None:
+        if target not in self.TARGETS:
+            raise ValueError('Неизвестный результат компиляции {}'.format(target))
+        self.target = target
+        # дерево программы в текстовом виде (до выноса тел параллельных циклов, т.е. соответствует исходнику)
+        self.tree = tree
+        self.memoize = memoize
+        self.const_eval = const_eval
+        self.unroll = unroll
+        self.unroll_budget = unroll_budget
+        self.peephole = peephole
+        self.peephole_stats = peephole_stats
+        self.promote_globals = promote_globals
+        self.reuse_locals = reuse_locals
+        self.string_builders = string_builders
+        self.main_part_size = main_part_size
+        self.buffered_output = buffered_output
+        # имя исполняемого файла (имя модуля в метаданных)
+        self.exe_name = exe_name
+        # код среды выполнения .NET (runtime.msil) и каталог, в котором хранится собранный из него модуль
+        # (программа ссылается на модуль; без каталога для 'exe' код среды выполнения собирается вместе с программой
+        # в один файл, для 'msil' - не выводится)
+        self.runtime = runtime
+        self.runtime_dir = runtime_dir
+        # каталог с class-файлами среды выполнения JVM (для 'jar')
+        self.java_runtime = java_runtime
+
+
+class Diagnostic:
+    """Ошибка компиляции: этап (options, parse, semantic, optimize, lower, codegen, assemble), сообщение
+       и позиция в исходном тексте
+    """
+
+    def __init__(self, phase: str, message: str, row: int = None, col: int = None) -> None:
+        self.phase = phase
+        self.message = message
+        self.row = row
+        self.col = col
+
+    def __str__(self) -> str:
+        return 'Ошибка: {}'.format(self.message)
+
+
+class CompileResult:
+    """Результат компиляции
+    """
+
+    def __init__(self) -> None:
+        # дерево программы (после семантического анализа и оптимизаций, с вынесенными телами параллельных циклов)
+        self.ast: Optional[mel_ast.StmtListNode] = None
+        self.tree: Optional[Tuple[str, ...]] = None
+        # генератор кода (для 'msil' и 'jbc'): код хранится в его буфере и выводится в поток без построения
+        # списка строк (см. write_code), список строится только при обращении к code
+        self.generator: Optional[Union[msil.CodeGenerator, jvm.CodeGenerator]] = None
+        self._code: Optional[List[str]] = None
+        # содержимое исполняемого файла или jar-архива (для 'exe' и 'jar')
+        self.image: Optional[bytes] = None
+        self.diagnostics: List[Diagnostic] = []
+        # отчеты оптимизаций (вычисление вызовов, развертывание циклов, мемоизация, оконная оптимизация)
+        self.report: List[str] = []
+        # время этапов компиляции в секундах (этап -> время)
+        self.timings: Dict[str, float] = {}
+
+    @property
+    def ok(self) -> bool:
+        return not self.diagnostics
+
+    @property
+    def code(self) -> Optional[List[str]]:
+        """Строки MSIL или листинга байт-кода JVM (для 'msil' и 'jbc')
+        """
+
+        if self._code is None and self.generator is not None:
+            self._code = self.generator.code
+        return self._code
+
+    def write_code(self, out: TextIO) -> None:
+        """Вывод кода в поток за один проход по буферу генератора (для 'msil' и 'jbc')
+        """
+
+        self.generator.write(out)
 
 
-def execute(prog: str, msil_only: bool = False, jbc_only: bool = False, file_name: str = None) -> None:
+class _Timer:
+    def __init__(self, result: CompileResult, phase: str) -> None:
+        self.result = result
+        self.phase = phase
+
+    def __enter__(self) -> None:
+        self.start = time.perf_counter()
+
+    def __exit__(self, *args) -> None:
+        timings = self.result.timings
+        timings[self.phase] = timings.get(self.phase, 0.0) + time.perf_counter() - self.start
+
+
+def check_options(options: CompileOptions) -> Optional[str]:
+    """Проверка путей к средам выполнения, которые нужны для результата компиляции
+    :return: сообщение об ошибке (None, если ошибок нет)
+    """
+
+    if options.target == 'jar':
+        runtime_dir = os.path.join(options.java_runtime or '', 'CompilerDemo')
+        if not os.path.isdir(runtime_dir):
+            return 'Не найден каталог среды выполнения JVM {}'.format(runtime_dir)
+    if options.runtime_dir is not None and not os.path.isdir(options.runtime_dir):
+        return 'Не найден каталог модуля среды выполнения {}'.format(options.runtime_dir)
+    if (options.target == 'exe' or options.runtime_dir is not None) and \
+            not os.path.isfile(options.runtime or ''):
+        return 'Не найден код среды выполнения .NET {}'.format(options.runtime)
+    return None
+
+
+def compile(source: str, options: CompileOptions = None) -> CompileResult:
+    """Компиляция программы в процессе вызывающего кода: ошибки возвращаются в результате
+       (не выводятся и не завершают процесс), в стандартный вывод ничего не пишется
+       (файлы пишутся только в каталог модуля среды выполнения .NET, см. runtime_module)
+    :param source: текст программы
+    :param options: параметры компиляции
+    :return: результат компиляции
+    """
+
+    options = options or CompileOptions()
+    result = CompileResult()
+    message = check_options(options)
+    if message:
+        result.diagnostics.append(Diagnostic('options', message))
+        return result
+
+    with _Timer(result, 'parse'):
+        try:
+            prog = mel_parser.parse(source)
+        except pyparsing.ParseBaseException as e:
+            result.diagnostics.append(Diagnostic('parse', str(e), e.lineno, e.col))
+            return result
+        except Exception as e:
+            result.diagnostics.append(Diagnostic('parse', str(e)))
+            return result
+    result.ast = prog
+
+    phase = 'semantic'
     try:
-        prog = mel_parser.parse(prog)
+        with _Timer(result, phase):
+            scope = semantic.prepare_global_scope()
+            prog.semantic_check(scope)
+        phase = 'optimize'
+        with _Timer(result, phase):
+            if options.const_eval:
+                result.report.extend(const_eval_.fold_calls(prog))
+            if options.unroll > 0:
+                result.report.extend(unroll_.unroll_loops(prog, options.unroll, options.unroll_budget))
+        if options.tree:
+            result.tree = prog.tree
+        # тела параллельных циклов выносятся в функции после построения дерева (дерево соответствует исходнику)
+        phase = 'lower'
+        with _Timer(result, phase):
+            parallel.lower(prog)
+    except semantic.SemanticException as e:
+        result.diagnostics.append(Diagnostic('semantic', e.message, e.row, e.col))
+        return result
     except Exception as e:
-        # print('Ошибка: {}'.format(e.message), file=sys.stderr)
-        traceback.print_exc(file=sys.stderr)
-        exit(1)
+        # внутренняя ошибка этапа (не ошибка в программе) тоже возвращается в результате
+        result.diagnostics.append(Diagnostic(phase, getattr(e, 'message', None) or repr(e)))
+        return result
+
+    if options.target in ('jbc', 'jar'):
+        _compile_jvm(prog, options, result)
+    else:
+        _compile_msil(prog, options, result)
+    return result
 
+
+def _compile_jvm(prog: mel_ast.StmtListNode, options: CompileOptions, result: CompileResult) -> None:
     try:
-        scope = semantic.prepare_global_scope()
-        prog.semantic_check(scope)
-        # print(*prog.tree, sep=os.linesep)
-        if not (msil_only or jbc_only):
-            print(*prog.tree, sep=os.linesep)
-            # print()
-    except semantic.SemanticException as e:
-        # print('Ошибка: {}'.format(e.message), file=sys.stderr)
-        exit(2)
+        with _Timer(result, 'codegen'):
+            gen = jvm.CodeGenerator(promote_globals=options.promote_globals, string_builders=options.string_builders,
+                                    main_part_size=options.main_part_size, buffered_output=options.buffered_output)
+            gen.jbc_gen_program(prog)
+            if options.target == 'jbc':
+                result.generator = gen
+                return
+        with _Timer(result, 'assemble'):
+            # jar-архив строится без ассемблера и jar
+            runtime_dir = os.path.join(options.java_runtime, 'CompilerDemo')
+            check_java_runtime(runtime_dir)
+            runtime_classes = sorted(name for name in os.listdir(runtime_dir) if name.endswith('.class'))
+            jar = io.BytesIO()
+            classfile.write_jar(jar, gen.class_files(), jvm.PROGRAM_CLASS_NAME,
+                                [('CompilerDemo/' + name, os.path.join(runtime_dir, name))
+                                 for name in runtime_classes])
+            result.image = jar.getvalue()
+    except classfile.JvmException as e:
+        result.diagnostics.append(Diagnostic('assemble', e.message))
+    except Exception as e:
+        result.diagnostics.append(Diagnostic('codegen', getattr(e, 'message', None) or repr(e)))
 
-    if not jbc_only:
-        try:
-            gen = msil.CodeGenerator()
+
+def _compile_msil(prog: mel_ast.StmtListNode, options: CompileOptions, result: CompileResult) -> None:
+    try:
+        with _Timer(result, 'codegen'):
+            runtime_dir = options.runtime_dir
+            # программа ссылается на модуль среды выполнения, собранный заранее (собирается только код программы)
+            module = runtime_module(options.runtime, runtime_dir) if runtime_dir else None
+            gen = msil.CodeGenerator(memoize=options.memoize, peephole=options.peephole,
+                                     promote_globals=options.promote_globals, reuse_locals=options.reuse_locals,
+                                     string_builders=options.string_builders,
+                                     main_part_size=options.main_part_size, buffered_output=options.buffered_output,
+                                     runtime_module=module)
             gen.msil_gen_program(prog)
-            print(*gen.code, sep=os.linesep)
-        except msil.MsilException or Exception as e:
-            print('Ошибка: {}'.format(e.message), file=sys.stderr)
-            exit(3)
+            # оконная оптимизация и .maxstack (ошибки - этапа генерации кода, а не вывода)
+            gen.finish()
+        result.report.extend(gen.report)
+        if options.peephole_stats and gen.peephole_stats:
+            for name, count in gen.peephole_stats.items():
+                result.report.append('peephole, {}: {}'.format(name, count))
+        if options.target == 'msil':
+            result.generator = gen
+            return
+        with _Timer(result, 'assemble'):
+            # исполняемый файл строится без ilasm; без каталога модуля код среды выполнения собирается вместе
+            # с программой (исполняемый файл не зависит от других файлов)
+            text = io.StringIO()
+            gen.write(text)
+            texts = [text.getvalue()]
+            if module is None:
+                with open(options.runtime, mode='r', encoding='utf-8') as f:
+                    texts.append(f.read())
+            result.image = pe.assemble(texts, options.exe_name)
+    except pe.PeException as e:
+        result.diagnostics.append(Diagnostic('assemble', e.message))
+    except Exception as e:
+        result.diagnostics.append(Diagnostic('codegen', getattr(e, 'message', None) or repr(e)))
+
+
+# коды завершения main.py для этапов, на которых произошла ошибка
+EXIT_CODES = {
+    'options': 5,
+    'parse': 1,
+    'semantic': 2,
+    'codegen': 3,
+    'assemble': 4,
+    'optimize': 6,
+    'lower': 7,
+}
+
+
+def execute(prog: str, msil_only: bool = False, jbc_only: bool = False, file_name: str = None,
+            memoize: bool = False, const_eval: bool = False,
+            unroll: int = 0, unroll_budget: int = unroll_.DEFAULT_BUDGET,
+            peephole: bool = True, peephole_stats: bool = False, promote_globals: bool = True,
+            reuse_locals: bool = True, string_builders: bool = True,
+            main_part_size: int = split.DEFAULT_PART_SIZE, buffered_output: bool = True,
+            exe: str = None, runtime: str = DEFAULT_RUNTIME, runtime_dir: str = None,
+            jar: str = None, java_runtime: str = DEFAULT_JAVA_RUNTIME) -> None:
+    """Компиляция из командной строки (см. main.py): дерево программы и код выводятся в стандартный вывод,
+       отчеты и ошибки - в стандартный поток ошибок, при ошибке процесс завершается с кодом из EXIT_CODES
+    """
+
+    if jar:
+        target = 'jar'
+    elif jbc_only:
+        target = 'jbc'
+    elif exe:
+        target = 'exe'
+        runtime_dir = os.path.dirname(os.path.abspath(exe))
+    else:
+        target = 'msil'
+    options = CompileOptions(target, tree=not (msil_only or jbc_only or exe or jar),
+                             memoize=memoize, const_eval=const_eval, unroll=unroll, unroll_budget=unroll_budget,
+                             peephole=peephole, peephole_stats=peephole_stats, promote_globals=promote_globals,
+                             reuse_locals=reuse_locals, string_builders=string_builders,
+                             main_part_size=main_part_size, buffered_output=buffered_output,
+                             exe_name=os.path.basename(exe) if exe else 'program.exe',
+                             runtime=runtime, runtime_dir=runtime_dir, java_runtime=java_runtime)
+    result = compile(prog, options)
+
+    if result.tree:
+        print(*result.tree, sep=os.linesep)
+    if result.generator is not None:
+        # код выводится из буфера генератора по мере форматирования строк
+        result.write_code(sys.stdout)
+    if result.image is not None:
+        with open(exe or jar, mode='wb') as f:
+            f.write(result.image)
+    if result.report:
+        print(*result.report, sep=os.linesep, file=sys.stderr)
+    for diagnostic in result.diagnostics:
+        print(diagnostic, file=sys.stderr)
+        exit(EXIT_CODES[diagnostic.phase])
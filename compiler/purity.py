@@ -0,0 +1,108 @@
+from typing import Dict, Iterable, List, Optional, Set
+
+from .mel_ast import AstNode, StmtListNode, FuncNode, CallNode, IdentNode, IndexAssignNode
+from .semantic import ScopeType
+
+
+class PurityInfo:
+    """Результат анализа "чистоты" одной функции программы
+    """
+
+    def __init__(self, func: FuncNode) -> None:
+        self.func = func
+        self.name = func.name.name
+        self.pure = True
+        self.reason: Optional[str] = None
+        self.calls: Set[str] = set()
+        self.recursive = False
+
+    def set_impure(self, reason: str) -> None:
+        if self.pure:
+            self.pure = False
+            self.reason = reason
+
+    def __str__(self) -> str:
+        if self.pure:
+            return '{}: чистая{}'.format(self.name, ', рекурсивная' if self.recursive else '')
+        return '{}: не чистая ({})'.format(self.name, self.reason)
+
+
+def _check_body(info: PurityInfo, node: AstNode) -> None:
+    for n in (node.childs or []):
+        if isinstance(n, CallNode):
+            ident = n.func.node_ident
+            if ident is None or ident.built_in:
+                info.set_impure('вызов {}'.format(n.func.name))
+            else:
+                info.calls.add(n.func.name)
+        elif isinstance(n, IndexAssignNode):
+            # массив может быть параметром (изменение видно вызывающему коду)
+            info.set_impure('запись в элемент массива')
+        elif isinstance(n, IdentNode) and n.node_ident is not None and not n.node_ident.type.func:
+            if n.node_ident.scope in (ScopeType.GLOBAL, ScopeType.GLOBAL_LOCAL):
+                info.set_impure('обращение к глобальной переменной {}'.format(n.name))
+        _check_body(info, n)
+
+
+def _is_recursive(name: str, infos: Dict[str, PurityInfo]) -> bool:
+    visited: Set[str] = set()
+    stack: List[str] = list(infos[name].calls)
+    while stack:
+        curr = stack.pop()
+        if curr == name:
+            return True
+        if curr in visited or curr not in infos:
+            continue
+        visited.add(curr)
+        stack.extend(infos[curr].calls)
+    return False
+
+
+def called_from(names: Iterable[str], infos: Dict[str, PurityInfo]) -> Set[str]:
+    """Функции, вызываемые (непосредственно или через другие функции) из функций names
+    """
+
+    result: Set[str] = set()
+    stack: List[str] = [callee for name in names for callee in infos[name].calls]
+    while stack:
+        curr = stack.pop()
+        if curr in result or curr not in infos:
+            continue
+        result.add(curr)
+        stack.extend(infos[curr].calls)
+    return result
+
+
+def analyze(prog: StmtListNode) -> Dict[str, PurityInfo]:
+    """Анализ "чистоты" функций программы (после семантического анализа).
+
+       Функция считается чистой, если читает только свои параметры и локальные переменные,
+       не обращается к глобальным переменным, не изменяет элементы массивов, не вызывает встроенные функции
+       (print, readLine, конструкторы массивов и т.п.) и вызывает только чистые функции (рекурсия допускается)
+    :param prog: программа (корень AST-дерева)
+    :return: словарь имя функции -> результат анализа (в порядке объявления)
+    """
+
+    infos: Dict[str, PurityInfo] = {}
+    for stmt in prog.exprs:
+        if isinstance(stmt, FuncNode):
+            info = PurityInfo(stmt)
+            _check_body(info, stmt.body)
+            infos[info.name] = info
+
+    # "нечистота" распространяется по графу вызовов до неподвижной точки
+    changed = True
+    while changed:
+        changed = False
+        for info in infos.values():
+            if not info.pure:
+                continue
+            for callee in info.calls:
+                if callee not in infos or not infos[callee].pure:
+                    info.set_impure('вызов не чистой функции {}'.format(callee))
+                    changed = True
+                    break
+
+    for name, info in infos.items():
+        info.recursive = _is_recursive(name, infos)
+    return infos
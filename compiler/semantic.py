@@ -1,4 +1,5 @@
-from typing import Tuple, Any, Dict, Optional
+import threading
+from typing import Tuple, Any, Dict, List, Optional
 from enum import Enum
 
 
@@ -42,6 +43,10 @@ class BinOp(Enum):
         return self.value
 
 
+# операции построения диапазонов (допустимы только в цикле for)
+RANGE_OPS = (BinOp.DOTS, BinOp.UNTIL, BinOp.DOWNTO)
+
+
 class BaseType(Enum):
     """Перечисление для базовых типов данных
     """
@@ -61,11 +66,20 @@ class BaseType(Enum):
 VOID, INT, FLOAT, BOOL, STR = BaseType.VOID, BaseType.INT, BaseType.FLOAT, BaseType.BOOL, BaseType.STR
 
 
+# массивы примитивных типов: тип элементов -> имя типа массива (для String - Array<String>)
+ARRAY_TYPE_NAMES = {
+    BaseType.INT: 'IntArray',
+    BaseType.FLOAT: 'DoubleArray',
+    BaseType.BOOL: 'BooleanArray',
+}
+GENERIC_ARRAY_TYPE_NAME = 'Array'
+
+
 class TypeDesc:
     """Класс для описания типа данных.
 
-       Сейчас поддерживаются только примитивные типы данных и функции.
-       При поддержки сложных типов (массивы и т.п.) должен быть рассширен
+       Поддерживаются примитивные типы данных, функции и одномерные массивы примитивных типов
+       (IntArray, DoubleArray, BooleanArray, Array<String>)
     """
 
     VOID: 'TypeDesc'
@@ -75,22 +89,30 @@ class TypeDesc:
     STR: 'TypeDesc'
 
     def __init__(self, base_type_: Optional[BaseType] = None,
-                 return_type: Optional['TypeDesc'] = None, params: Optional[Tuple['TypeDesc']] = None) -> None:
+                 return_type: Optional['TypeDesc'] = None, params: Optional[Tuple['TypeDesc']] = None,
+                 elem_type: Optional['TypeDesc'] = None) -> None:
         self.base_type = base_type_
         self.return_type = return_type
         self.params = params
+        self.elem_type = elem_type
 
     @property
     def func(self) -> bool:
         return self.return_type is not None
 
+    @property
+    def array(self) -> bool:
+        return self.elem_type is not None
+
     @property
     def is_simple(self) -> bool:
-        return not self.func
+        return not self.func and not self.array
 
     def __eq__(self, other: 'TypeDesc'):
-        if self.func != other.func:
+        if self.func != other.func or self.array != other.array:
             return False
+        if self.array:
+            return self.elem_type == other.elem_type
         if not self.func:
             return self.base_type == other.base_type
         else:
@@ -108,7 +130,22 @@ class TypeDesc:
         return getattr(TypeDesc, base_type_.name)
 
     @staticmethod
-    def from_str(str_decl: str) -> 'TypeDesc':
+    def array_of(elem_type: 'TypeDesc') -> 'TypeDesc':
+        return TypeDesc(elem_type=elem_type)
+
+    @staticmethod
+    def from_str(str_decl: str, generic: Optional['TypeDesc'] = None) -> 'TypeDesc':
+        for base_type_, name in ARRAY_TYPE_NAMES.items():
+            if str_decl == name and generic is None:
+                return TypeDesc.array_of(TypeDesc.from_base_type(base_type_))
+        if str_decl == GENERIC_ARRAY_TYPE_NAME and generic is not None:
+            if generic != TypeDesc.STR:
+                raise SemanticException('Тип {}<{}> не поддерживается{}'.format(
+                    str_decl, generic, ' (используйте {})'.format(ARRAY_TYPE_NAMES[generic.base_type])
+                    if generic.is_simple and generic.base_type in ARRAY_TYPE_NAMES else ''))
+            return TypeDesc.array_of(generic)
+        if generic is not None:
+            raise SemanticException('Тип {} не может иметь параметра-типа'.format(str_decl))
         try:
             base_type_ = BaseType(str_decl)
             return TypeDesc.from_base_type(base_type_)
@@ -116,6 +153,10 @@ class TypeDesc:
             raise SemanticException('Неизвестный тип {}'.format(str_decl))
 
     def __str__(self) -> str:
+        if self.array:
+            if self.elem_type.is_simple and self.elem_type.base_type in ARRAY_TYPE_NAMES:
+                return ARRAY_TYPE_NAMES[self.elem_type.base_type]
+            return '{}<{}>'.format(GENERIC_ARRAY_TYPE_NAME, self.elem_type)
         if not self.func:
             return str(self.base_type)
         else:
@@ -156,6 +197,12 @@ class IdentDesc:
         self.scope = scope
         self.index = index
         self.built_in = False
+        # значение не может изменяться присваиванием (переменная цикла for)
+        self.const = False
+        # перегрузки встроенной функции (с другими типами параметров)
+        self.overloads: List['IdentDesc'] = []
+        # функция изменяет глобальные переменные (непосредственно или через вызовы других функций)
+        self.writes_globals = False
 
     def __str__(self) -> str:
         return '{}, {}, {}'.format(self.type, self.scope, 'built-in' if self.built_in else self.index)
@@ -171,6 +218,8 @@ class IdentScope:
         self.parent = parent
         self.var_index = 0
         self.param_index = 0
+        # область видимости тела параллельного цикла (parallelFor, parallelSum и т.п.)
+        self.parallel = False
 
     @property
     def is_global(self) -> bool:
@@ -190,6 +239,27 @@ class IdentScope:
             curr = curr.parent
         return curr
 
+    @property
+    def in_parallel(self) -> bool:
+        curr = self
+        while curr and not curr.parallel:
+            curr = curr.parent
+        return curr is not None
+
+    def is_shared(self, name: str) -> bool:
+        """Переменная объявлена вне тела параллельного цикла, в котором находится область видимости
+           (значение такой переменной общее для всех потоков, выполняющих цикл)
+        """
+
+        curr = self
+        parallel = False
+        while curr:
+            if name in curr.idents:
+                return parallel
+            parallel = parallel or curr.parallel
+            curr = curr.parent
+        return False
+
     def add_ident(self, ident: IdentDesc) -> IdentDesc:
         func_scope = self.curr_func
         global_scope = self.curr_global
@@ -246,10 +316,12 @@ class SemanticException(Exception):
                 message += 'строка: {}'.format(row)
                 if col:
                     message += ', '
-            if row:
+            if col:
                 message += 'позиция: {}'.format(col)
             message += ")"
         self.message = message
+        self.row = row
+        self.col = col
 
 
 TYPE_CONVERTIBILITY = {
@@ -335,14 +407,32 @@ BIN_OP_TYPE_COMPATIBILITY = {
 }
 
 
+# конструкторы массивов создают массив заданного размера (элементы - 0, 0.0, false, для Array<String> - "")
 BUILT_IN_OBJECTS = '''
     fun readLine(): String { }
+    fun readWord(): String { }
+    fun readInt(): Int { }
+    fun readDouble(): Float { }
     fun print(p0: String) { }
     fun println(p0: String) { }
+    fun IntArray(size: Int): IntArray { }
+    fun DoubleArray(size: Int): DoubleArray { }
+    fun BooleanArray(size: Int): BooleanArray { }
+    fun Array(size: Int): Array<String> { }
+'''
+
+# перегрузки встроенных функций, в Runtime реализуются без промежуточного преобразования в строку
+BUILT_IN_OVERLOADS = '''
+    fun print(p0: Int) { }
+    fun print(p0: Float) { }
+    fun print(p0: Boolean) { }
+    fun println(p0: Int) { }
+    fun println(p0: Float) { }
+    fun println(p0: Boolean) { }
 '''
 
 
-def prepare_global_scope() -> IdentScope:
+def _prepare_built_in_scope() -> IdentScope:
     from .mel_parser import parse
 
     prog = parse(BUILT_IN_OBJECTS)
@@ -350,5 +440,30 @@ def prepare_global_scope() -> IdentScope:
     prog.semantic_check(scope)
     for name, ident in scope.idents.items():
         ident.built_in = True
+    for func in parse(BUILT_IN_OVERLOADS).childs:
+        # повторное объявление в общей области видимости недопустимо, поэтому проверка в отдельной
+        func.semantic_check(IdentScope())
+        ident = func.name.node_ident
+        ident.built_in = True
+        scope.idents[ident.name].overloads.append(ident)
     scope.var_index = 0
     return scope
+
+
+_built_in_scope: Optional[IdentScope] = None
+_built_in_scope_lock = threading.Lock()
+
+
+def prepare_global_scope() -> IdentScope:
+    """Глобальная область видимости со встроенными функциями: встроенные функции разбираются один раз
+       (при первом вызове), каждая программа получает свою копию области (описания встроенных функций общие,
+       при анализе программ они не изменяются)
+    """
+
+    global _built_in_scope
+    with _built_in_scope_lock:
+        if _built_in_scope is None:
+            _built_in_scope = _prepare_built_in_scope()
+    scope = IdentScope()
+    scope.idents = dict(_built_in_scope.idents)
+    return scope
@@ -0,0 +1,131 @@
+from typing import Any, Dict, List, Optional
+
+from .peephole import UNCONDITIONAL_OPS
+
+LOAD_OPS = ('ldloc', )
+STORE_OPS = ('stloc', )
+# переменные, адрес которых берется, не объединяются с другими
+ADDRESS_OPS = ('ldloca', )
+
+# вес обращения к переменной умножается на LOOP_WEIGHT для каждого уровня вложенности циклов
+LOOP_WEIGHT = 10
+MAX_LOOP_DEPTH = 6
+
+
+def _local_index(line: Any) -> Optional[int]:
+    if not line.params or isinstance(line.params[0], bool) or not isinstance(line.params[0], int):
+        return None
+    return line.params[0]
+
+
+def _bits(mask: int) -> List[int]:
+    result = []
+    index = 0
+    while mask:
+        if mask & 1:
+            result.append(index)
+        mask >>= 1
+        index += 1
+    return result
+
+
+def allocate(lines: List[Any], types: List[str]) -> List[Optional[int]]:
+    """Распределение локальных переменных метода по слотам на основе анализа живучести:
+       переменные одного типа с непересекающимися временами жизни занимают общий слот,
+       слоты упорядочиваются по частоте обращений (с учетом вложенности циклов),
+       чтобы к "горячим" переменным применялись короткие формы ldloc.N/stloc.N
+    :param lines: строки кода метода (объекты с атрибутами code, params и label)
+    :param types: типы локальных переменных метода
+    :return: новый номер слота для каждой переменной (None для переменных без обращений)
+    """
+
+    count = len(lines)
+    ops: List[str] = []
+    labels: Dict[Any, int] = {}
+    for i, line in enumerate(lines):
+        code = line.code.strip()
+        ops.append(code.split(None, 1)[0] if code else '')
+        if line.label is not None:
+            labels[line.label] = i
+
+    uses = [0] * count
+    defs = [0] * count
+    succs: List[List[int]] = []
+    referenced = 0
+    fixed = 0
+    depth = [0] * count
+    for i, line in enumerate(lines):
+        op = ops[i]
+        index = _local_index(line) if op in LOAD_OPS + STORE_OPS + ADDRESS_OPS else None
+        if index is not None:
+            referenced |= 1 << index
+            if op in LOAD_OPS or op in ADDRESS_OPS:
+                uses[i] = 1 << index
+            if op in STORE_OPS:
+                defs[i] = 1 << index
+            if op in ADDRESS_OPS:
+                fixed |= 1 << index
+        targets = [labels[p] for p in line.params if p in labels] if op else []
+        succ = [] if op in UNCONDITIONAL_OPS or i + 1 >= count else [i + 1]
+        succ.extend(t for t in targets if t not in succ)
+        succs.append(succ)
+        for t in targets:
+            # обратный переход - цикл
+            if t <= i:
+                for j in range(t, i + 1):
+                    depth[j] += 1
+
+    live_in = [0] * count
+    changed = True
+    while changed:
+        changed = False
+        for i in reversed(range(count)):
+            live_out = 0
+            for s in succs[i]:
+                live_out |= live_in[s]
+            live = uses[i] | (live_out & ~defs[i])
+            if live != live_in[i]:
+                live_in[i] = live
+                changed = True
+
+    # граф интерференции: переменная, в которую записывается значение, конфликтует со всеми живыми после записи
+    interference = [0] * len(types)
+    weights = [0] * len(types)
+    for i in range(count):
+        if uses[i] or defs[i]:
+            weight = LOOP_WEIGHT ** min(depth[i], MAX_LOOP_DEPTH)
+            for index in _bits(uses[i] | defs[i]):
+                weights[index] += weight
+        if defs[i]:
+            index = _bits(defs[i])[0]
+            live_out = 0
+            for s in succs[i]:
+                live_out |= live_in[s]
+            live_out &= ~defs[i]
+            interference[index] |= live_out
+            for other in _bits(live_out):
+                interference[other] |= defs[i]
+
+    slot_types: List[str] = []
+    slot_members: List[int] = []
+    slot_weights: List[int] = []
+    assigned: List[Optional[int]] = [None] * len(types)
+    for index in sorted(_bits(referenced), key=lambda index: (-weights[index], index)):
+        slot = None
+        if not fixed & (1 << index):
+            for s in range(len(slot_types)):
+                if slot_types[s] == types[index] and not slot_members[s] & (interference[index] | fixed):
+                    slot = s
+                    break
+        if slot is None:
+            slot = len(slot_types)
+            slot_types.append(types[index])
+            slot_members.append(0)
+            slot_weights.append(0)
+        slot_members[slot] |= 1 << index
+        slot_weights[slot] += weights[index]
+        assigned[index] = slot
+
+    order = sorted(range(len(slot_types)), key=lambda s: (-slot_weights[s], s))
+    numbers = {s: n for n, s in enumerate(order)}
+    return [numbers[slot] if slot is not None else None for slot in assigned]
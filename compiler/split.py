@@ -0,0 +1,93 @@
+from typing import Any, List, Set
+
+from .mel_ast import AstNode, IdentNode
+from .semantic import IdentDesc
+
+# размер кода Main (в байтах IL), при превышении которого код Main разбивается на методы Main_partN
+# (JIT для больших методов отключает оптимизации и долго их компилирует)
+DEFAULT_PART_SIZE = 8192
+
+# размеры инструкций с операндом-токеном (метод, поле, строка, тип)
+TOKEN_OPS = ('call', 'callvirt', 'newobj', 'ldstr', 'ldsfld', 'stsfld', 'ldsflda', 'ldfld', 'stfld', 'ldflda', 'newarr',
+             'box', 'unbox.any', 'castclass', 'isinst', 'ldelema')
+# инструкции с двухбайтовым кодом операции
+PREFIXED_OPS = ('ceq', 'cgt', 'cgt.un', 'clt', 'clt.un')
+# переходы (длинная форма, короткие формы подбирает ассемблер)
+BRANCH_OPS = ('br', 'brtrue', 'brfalse', 'beq', 'bne.un', 'blt', 'ble', 'bgt', 'bge',
+              'blt.un', 'ble.un', 'bgt.un', 'bge.un', 'leave')
+
+
+def _int_operand(args: List[str]) -> int:
+    try:
+        return int(args[0])
+    except (IndexError, ValueError):
+        return 0
+
+
+def instr_size(line: Any) -> int:
+    """Размер инструкции в байтах IL (с учетом коротких форм, которые выберет оконная оптимизация)
+    :param line: строка кода (объект с атрибутами code и params)
+    :return: размер (0 для директив и пустых строк)
+    """
+
+    code = line.code.strip()
+    if not code or code.startswith('.') or code.startswith('//') or code in ('{', '}'):
+        return 0
+    op, *rest = code.split(None, 1)
+    args = rest + [str(p) for p in line.params]
+    if op in TOKEN_OPS or op in BRANCH_OPS:
+        return 5
+    if op == 'switch':
+        return 5 + 4 * len(line.params)
+    if op in PREFIXED_OPS:
+        return 2
+    if op == 'ldc.i4':
+        value = _int_operand(args)
+        return 1 if -1 <= value <= 8 else 2 if -128 <= value <= 127 else 5
+    if op in ('ldc.r8', 'ldc.i8'):
+        return 9
+    if op in ('ldloc', 'stloc', 'ldarg', 'starg', 'ldloca', 'ldarga'):
+        index = _int_operand(args)
+        return 1 if index <= 3 and op in ('ldloc', 'stloc', 'ldarg') else 2 if index <= 255 else 4
+    if op.endswith('.s'):
+        return 2
+    return 1
+
+
+def code_size(lines: List[Any]) -> int:
+    return sum(instr_size(line) for line in lines)
+
+
+def split_parts(sizes: List[int], part_size: int) -> List[List[int]]:
+    """Разбиение последовательности операторов на части (без изменения порядка)
+       размером не более part_size (оператор большего размера образует отдельную часть)
+    :param sizes: размеры кода операторов
+    :param part_size: максимальный размер части
+    :return: номера операторов каждой части
+    """
+
+    parts: List[List[int]] = []
+    curr_size = 0
+    for i, size in enumerate(sizes):
+        if not parts or curr_size + size > part_size:
+            parts.append([])
+            curr_size = 0
+        parts[-1].append(i)
+        curr_size += size
+    return parts
+
+
+def referenced_idents(node: AstNode) -> Set[IdentDesc]:
+    """Переменные, к которым есть обращения (чтение, запись или объявление) в поддереве node
+    """
+
+    idents: Set[IdentDesc] = set()
+
+    def find(node: AstNode) -> None:
+        if isinstance(node, IdentNode) and node.node_ident is not None:
+            idents.add(node.node_ident)
+        for n in (node.childs or []):
+            find(n)
+
+    find(node)
+    return idents
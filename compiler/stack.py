@@ -0,0 +1,201 @@
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from .peephole import UNCONDITIONAL_OPS
+
+# влияние инструкций на стек вычислений: операция -> (снимается со стека, кладется на стек);
+# вызовы, ret и инструкции с короткими формами (.N, .s) обрабатываются в stack_effect
+STACK_EFFECTS: Dict[str, Tuple[int, int]] = {
+    'nop': (0, 0),
+    'ldc.i4': (0, 1),
+    'ldc.i8': (0, 1),
+    'ldc.r8': (0, 1),
+    'ldstr': (0, 1),
+    'ldnull': (0, 1),
+    'ldloc': (0, 1),
+    'ldloca': (0, 1),
+    'ldarg': (0, 1),
+    'ldarga': (0, 1),
+    'ldsfld': (0, 1),
+    'ldsflda': (0, 1),
+    'ldfld': (1, 1),
+    'ldflda': (1, 1),
+    'stloc': (1, 0),
+    'starg': (1, 0),
+    'stsfld': (1, 0),
+    'stfld': (2, 0),
+    'pop': (1, 0),
+    'dup': (1, 2),
+    'add': (2, 1),
+    'sub': (2, 1),
+    'mul': (2, 1),
+    'div': (2, 1),
+    'div.un': (2, 1),
+    'rem': (2, 1),
+    'rem.un': (2, 1),
+    'and': (2, 1),
+    'or': (2, 1),
+    'xor': (2, 1),
+    'shl': (2, 1),
+    'shr': (2, 1),
+    'shr.un': (2, 1),
+    'ceq': (2, 1),
+    'cgt': (2, 1),
+    'cgt.un': (2, 1),
+    'clt': (2, 1),
+    'clt.un': (2, 1),
+    'neg': (1, 1),
+    'not': (1, 1),
+    'br': (0, 0),
+    'brtrue': (1, 0),
+    'brfalse': (1, 0),
+    'beq': (2, 0),
+    'bne.un': (2, 0),
+    'blt': (2, 0),
+    'ble': (2, 0),
+    'bgt': (2, 0),
+    'bge': (2, 0),
+    'blt.un': (2, 0),
+    'ble.un': (2, 0),
+    'bgt.un': (2, 0),
+    'bge.un': (2, 0),
+    'switch': (1, 0),
+    'throw': (1, 0),
+    'newarr': (1, 1),
+    'ldlen': (1, 1),
+    'ldelem': (2, 1),
+    'ldelema': (2, 1),
+    'stelem': (3, 0),
+    'box': (1, 1),
+    'unbox.any': (1, 1),
+    'castclass': (1, 1),
+    'isinst': (1, 1),
+}
+
+CALL_OPS = ('call', 'callvirt', 'newobj')
+
+_SHORT_FORM = re.compile(r'^(.*?)(\.(s|m1|\d))$')
+
+
+class StackException(Exception):
+    """Исключение при анализе глубины стека вычислений
+    """
+
+    def __init__(self, message: str) -> None:
+        self.message = message
+
+
+def _split_params(params: str) -> List[str]:
+    result, depth, curr = [], 0, ''
+    for ch in params:
+        if ch in '<[(':
+            depth += 1
+        elif ch in '>])':
+            depth -= 1
+        if ch == ',' and depth == 0:
+            result.append(curr.strip())
+            curr = ''
+        else:
+            curr += ch
+    if curr.strip():
+        result.append(curr.strip())
+    return result
+
+
+def call_effect(op: str, operand: str) -> Tuple[int, int]:
+    """Влияние на стек вызова метода по его сигнатуре
+       (например, call int32 class Program::fib(int32))
+    """
+
+    tokens = operand.split()
+    instance = bool(tokens) and tokens[0] == 'instance'
+    if instance:
+        tokens = tokens[1:]
+    if not tokens or '::' not in operand or '(' not in operand:
+        raise StackException('не удалось разобрать сигнатуру: {} {}'.format(op, operand))
+    ret_type = tokens[0]
+    name_params = operand[operand.rindex('::') + 2:]
+    params = _split_params(name_params[name_params.index('(') + 1:name_params.rindex(')')])
+    if op == 'newobj':
+        return len(params), 1
+    return len(params) + (1 if instance else 0), 0 if ret_type == 'void' else 1
+
+
+def stack_effect(op: str, operand: str, returns_value: bool) -> Tuple[int, int]:
+    if op in CALL_OPS:
+        return call_effect(op, operand)
+    if op == 'ret':
+        return (1 if returns_value else 0), 0
+    if op in STACK_EFFECTS:
+        return STACK_EFFECTS[op]
+    # ldc.i4.0, ldloc.s, ldarg.1, ldelem.i4, conv.r8, stelem.ref и т.п.
+    if op.startswith('conv.'):
+        return 1, 1
+    match = _SHORT_FORM.match(op)
+    if match and match.group(1) in STACK_EFFECTS:
+        return STACK_EFFECTS[match.group(1)]
+    base = op.split('.')[0]
+    if base in STACK_EFFECTS:
+        return STACK_EFFECTS[base]
+    raise StackException('неизвестная инструкция {}'.format(op))
+
+
+def max_stack(lines: List[Any], returns_value: bool) -> int:
+    """Вычисление максимальной глубины стека вычислений метода (анализ потока данных
+       по инструкциям и переходам, глубина стека в каждой точке должна быть одинакова
+       по всем путям, иначе StackException)
+    :param lines: строки кода тела метода (объекты с атрибутами code, params и label)
+    :param returns_value: метод возвращает значение
+    :return: максимальная глубина стека
+    """
+
+    instrs: List[Tuple[str, str, List[Any]]] = []
+    labels: Dict[Any, int] = {}
+    for line in lines:
+        code = line.code.strip()
+        if line.label is not None:
+            labels[line.label] = len(instrs)
+        if code.startswith('.') or code.startswith('//') or code in ('{', '}'):
+            continue
+        op, *rest = code.split(None, 1) if code else ['nop']
+        # операнд может быть как в самой строке, так и в параметрах (после оконной оптимизации)
+        operand = ' '.join(rest + [str(p) for p in line.params])
+        instrs.append((op, operand, list(line.params)))
+
+    heights: List[Optional[int]] = [None] * (len(instrs) + 1)
+    result = 0
+    work = [(0, 0)]
+    while work:
+        i, height = work.pop()
+        while i < len(instrs):
+            if heights[i] is not None:
+                if heights[i] != height:
+                    raise StackException('несогласованная глубина стека ({} и {}) перед инструкцией {} {}'.format(
+                        heights[i], height, instrs[i][0], instrs[i][1]).rstrip())
+                break
+            heights[i] = height
+            op, operand, params = instrs[i]
+            pop, push = stack_effect(op, operand, returns_value)
+            if height < pop:
+                raise StackException('недостаточно значений в стеке для инструкции {} {}'.format(op, operand).rstrip())
+            height = height - pop + push
+            result = max(result, height)
+            if op == 'ret' and height != 0:
+                raise StackException('стек не пуст при выходе из метода ({} значений)'.format(height))
+            for p in params:
+                if p in labels:
+                    work.append((labels[p], height))
+            if op in UNCONDITIONAL_OPS:
+                break
+            i += 1
+        else:
+            raise StackException('выполнение метода может дойти до конца без ret')
+    return result
+
+
+def method_return_type(header: str) -> str:
+    """Тип результата по заголовку метода (.method public static int32 fib(int32 n) cil managed)
+    """
+
+    match = re.search(r'\s(\S+)\s+[^\s(]+\(', header)
+    return match.group(1) if match else 'void'
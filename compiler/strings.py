@@ -0,0 +1,95 @@
+from typing import Dict, List, Optional, Set
+
+from . import escape
+from .mel_ast import AstNode, ExprNode, StmtListNode, IdentNode, BinOpNode, AssignNode, VarNode, \
+    WhileNode, DoWhileNode, ForNode
+from .semantic import BinOp, TypeDesc, IdentDesc, ScopeType
+
+LOOP_NODES = (WhileNode, DoWhileNode, ForNode)
+
+
+def flatten_concat(node: ExprNode) -> List[ExprNode]:
+    """Операнды цепочки конкатенаций строк (a + b + c ..., в т.ч. со скобками) в порядке вычисления
+    """
+
+    if isinstance(node, BinOpNode) and node.op == BinOp.ADD and node.node_type == TypeDesc.STR:
+        return flatten_concat(node.arg1) + flatten_concat(node.arg2)
+    return [node]
+
+
+def append_args(node: AstNode, ident: IdentDesc) -> Optional[List[ExprNode]]:
+    """Добавляемые к строке значения для присваивания вида s = s + a + b ... (None, если это не добавление)
+    """
+
+    if not isinstance(node, AssignNode) or node.var.node_ident is not ident:
+        return None
+    args = flatten_concat(node.val)
+    if len(args) < 2 or not isinstance(args[0], IdentNode) or args[0].node_ident is not ident:
+        return None
+    if any(_refers(arg, ident) for arg in args[1:]):
+        return None
+    return args[1:]
+
+
+def _refers(node: AstNode, ident: IdentDesc) -> bool:
+    if isinstance(node, IdentNode) and node.node_ident is ident:
+        return True
+    return any(_refers(n, ident) for n in (node.childs or []))
+
+
+def _only_appended(node: AstNode, ident: IdentDesc) -> bool:
+    # все обращения к переменной внутри node - добавления к ней
+    for n in (node.childs or []):
+        if append_args(n, ident) is not None:
+            continue
+        if isinstance(n, AssignNode) and n.var.node_ident is ident:
+            return False
+        if isinstance(n, VarNode) and n.ident.node_ident is ident:
+            return False
+        if isinstance(n, IdentNode) and n.node_ident is ident:
+            return False
+        if not _only_appended(n, ident):
+            return False
+    return True
+
+
+def _appended_idents(node: AstNode) -> List[IdentDesc]:
+    idents: List[IdentDesc] = []
+
+    def find(node: AstNode) -> None:
+        for n in (node.childs or []):
+            if isinstance(n, AssignNode) and n.var.node_type == TypeDesc.STR and \
+                    append_args(n, n.var.node_ident) is not None and n.var.node_ident not in idents:
+                idents.append(n.var.node_ident)
+            find(n)
+
+    find(node)
+    return idents
+
+
+def find_string_builders(prog: StmtListNode) -> Dict[AstNode, List[IdentDesc]]:
+    """Поиск строковых переменных, к которым в цикле значения только добавляются (s = s + ...),
+       такие переменные на время цикла заменяются на StringBuilder
+       (для вложенных циклов выбирается самый внешний подходящий цикл)
+    :param prog: программа (корень AST-дерева, после семантического анализа)
+    :return: словарь цикл -> переменные
+    """
+
+    usages = escape.analyze_globals(prog)
+    result: Dict[AstNode, List[IdentDesc]] = {}
+
+    def find(node: AstNode, done: Set[IdentDesc]) -> None:
+        for n in (node.childs or []):
+            if isinstance(n, LOOP_NODES):
+                idents = [ident for ident in _appended_idents(n) if ident not in done and _only_appended(n, ident)]
+                # глобальная переменная, используемая в функциях, может быть прочитана при вызове функции из цикла
+                idents = [ident for ident in idents if ident.scope in (ScopeType.LOCAL, ScopeType.PARAM) or
+                          (ident in usages and not usages[ident].escapes)]
+                if idents:
+                    result[n] = idents
+                find(n, done | set(idents))
+            else:
+                find(n, done)
+
+    find(prog, set())
+    return result
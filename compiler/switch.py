@@ -0,0 +1,110 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .mel_ast import ExprNode, LiteralNode, WhenInNode
+from .semantic import BinOp
+
+# минимальное кол-во интервалов значений для таблицы переходов switch
+SWITCH_MIN_CASES = 4
+# максимальный размер таблицы switch на один интервал значений (таблица для редких значений слишком велика)
+SWITCH_MAX_SPARSENESS = 3
+# кол-во интервалов, проверяемых последовательно (для большего - бинарный поиск)
+LINEAR_MAX_CASES = 3
+# минимальное кол-во различных строк для выбора ветви по хэш-коду строки
+STRING_HASH_MIN_CASES = 6
+
+# FNV-1a (32 бита) по кодовым единицам UTF-16, тот же алгоритм реализуется в генерируемом коде
+FNV_OFFSET_BASIS = 2166136261
+FNV_PRIME = 16777619
+
+Interval = Tuple[int, int, Any]
+
+
+def to_int32(value: int) -> int:
+    value &= 0xFFFFFFFF
+    return value - (1 << 32) if value >= 1 << 31 else value
+
+
+def string_hash(value: str) -> int:
+    h = FNV_OFFSET_BASIS
+    data = value.encode('utf-16-le')
+    for i in range(0, len(data), 2):
+        h = ((h ^ (data[i] | data[i + 1] << 8)) * FNV_PRIME) & 0xFFFFFFFF
+    return to_int32(h)
+
+
+def java_string_hash(value: str) -> int:
+    """Хэш-код строки, как его вычисляет String.hashCode() в JVM (по кодовым единицам UTF-16)
+    """
+
+    h = 0
+    data = value.encode('utf-16-le', 'surrogatepass')
+    for i in range(0, len(data), 2):
+        h = (h * 31 + (data[i] | data[i + 1] << 8)) & 0xFFFFFFFF
+    return to_int32(h)
+
+
+def cond_bounds(cond: ExprNode) -> Optional[Tuple[int, int]]:
+    """Границы значений (включительно), удовлетворяющих условию ветви when
+       (None, если условие не константа; для пустого диапазона нижняя граница больше верхней)
+    """
+
+    if isinstance(cond, LiteralNode):
+        return cond.value, cond.value
+    if isinstance(cond, WhenInNode):
+        start, end = cond.range.startArg, cond.range.endArg
+        if not isinstance(start, LiteralNode) or not isinstance(end, LiteralNode):
+            return None
+        if cond.range.seqOp == BinOp.DOWNTO:
+            return end.value, start.value
+        return start.value, end.value - (1 if cond.range.seqOp == BinOp.UNTIL else 0)
+    return None
+
+
+def case_intervals(cases: List[Interval]) -> List[Interval]:
+    """Непересекающиеся интервалы значений по условиям ветвей
+    :param cases: интервалы (нижняя граница, верхняя граница, ветвь) в порядке проверки условий
+                  (при пересечении выбирается ветвь более раннего условия)
+    :return: упорядоченные по значениям непересекающиеся интервалы (соседние интервалы одной ветви объединены)
+    """
+
+    result: List[Interval] = []
+    for lo, hi, target in cases:
+        # из интервала исключаются уже занятые значения
+        parts = [(lo, hi)]
+        for a, b, _ in result:
+            parts = [p for start, end in parts
+                     for p in ((start, min(end, a - 1)), (max(start, b + 1), end)) if p[0] <= p[1]]
+        result.extend((start, end, target) for start, end in parts)
+    result.sort(key=lambda interval: interval[0])
+    merged: List[Interval] = []
+    for lo, hi, target in result:
+        if merged and merged[-1][2] is target and merged[-1][1] + 1 == lo:
+            merged[-1] = (merged[-1][0], hi, target)
+        else:
+            merged.append((lo, hi, target))
+    return merged
+
+
+def is_dense(intervals: List[Interval]) -> bool:
+    """Выбор ветви по интервалам реализуется таблицей переходов switch
+    """
+
+    if len(intervals) < SWITCH_MIN_CASES:
+        return False
+    span = intervals[-1][1] - intervals[0][0] + 1
+    return span <= len(intervals) * SWITCH_MAX_SPARSENESS
+
+
+def string_buckets(cases: List[Tuple[str, Any]],
+                   hash_func: Callable[[str], int] = string_hash) -> Dict[int, List[Tuple[str, Any]]]:
+    """Группировка строк-констант по хэш-кодам (для повторяющихся строк остается первая ветвь)
+    """
+
+    buckets: Dict[int, List[Tuple[str, Any]]] = {}
+    seen = set()
+    for value, target in cases:
+        if value in seen:
+            continue
+        seen.add(value)
+        buckets.setdefault(hash_func(value), []).append((value, target))
+    return buckets
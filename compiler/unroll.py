@@ -0,0 +1,372 @@
+from typing import List, Optional, Set, Tuple
+
+from . import purity
+from .const_eval import to_int32, INT_MIN, INT_MAX
+from .mel_ast import AstNode, ExprNode, LiteralNode, IdentNode, BinOpNode, CallNode, StmtListNode, AssignNode, \
+    VarsNode, VarNode, WhileNode, ForNode, SeqNode, StmtNode
+from .semantic import BinOp, TypeDesc, IdentDesc, ScopeType
+from .msil import get_progression_bounds
+
+DEFAULT_FACTOR = 4
+# циклы с не большим кол-вом итераций (и известным начальным значением) разворачиваются полностью
+FULL_UNROLL_MAX_TRIPS = 16
+# ограничение кол-ва узлов AST-дерева, добавляемых при развертывании (на всю программу)
+DEFAULT_BUDGET = 1000
+
+COMPARE_OPS = {
+    BinOp.LT: lambda a, b: a < b,
+    BinOp.LE: lambda a, b: a <= b,
+    BinOp.GT: lambda a, b: a > b,
+    BinOp.GE: lambda a, b: a >= b,
+}
+
+
+def _int_literal(value: int) -> LiteralNode:
+    node = LiteralNode(str(value))
+    node.node_type = TypeDesc.INT
+    return node
+
+
+def _ident(ident: IdentDesc) -> IdentNode:
+    node = IdentNode(ident.name)
+    node.node_ident = ident
+    node.node_type = ident.type
+    return node
+
+
+def _bin_op(op: BinOp, arg1: ExprNode, arg2: ExprNode, type_: TypeDesc) -> BinOpNode:
+    node = BinOpNode(op, arg1, arg2)
+    node.node_type = type_
+    return node
+
+
+def _size(node: AstNode) -> int:
+    return 1 + sum(_size(n) for n in (node.childs or []))
+
+
+def _find(node: AstNode, cls) -> List[AstNode]:
+    result = []
+    for n in (node.childs or []):
+        if isinstance(n, cls):
+            result.append(n)
+        result.extend(_find(n, cls))
+    return result
+
+
+def _is_global(ident: IdentDesc) -> bool:
+    return ident.scope in (ScopeType.GLOBAL, ScopeType.GLOBAL_LOCAL)
+
+
+class NotCountedLoop(Exception):
+    def __init__(self, message: str) -> None:
+        self.message = message
+
+
+class CountedLoop:
+    """Описание цикла while со счетчиком: while (i op bound) { ...; i = i + step; ... }
+    """
+
+    def __init__(self, loop: WhileNode, ident: IdentDesc, op: BinOp, bound: ExprNode, step: int) -> None:
+        self.loop = loop
+        self.ident = ident
+        self.op = op
+        self.bound = bound
+        self.step = step
+
+    def trip_count(self, start: int, limit: int) -> Optional[int]:
+        """Кол-во итераций при начальном значении счетчика start (None, если больше limit)
+        """
+
+        if not isinstance(self.bound, LiteralNode):
+            return None
+        i, count = start, 0
+        while COMPARE_OPS[self.op](i, self.bound.value):
+            count += 1
+            if count > limit:
+                return None
+            i = to_int32(i + self.step)
+        return count
+
+
+def match_counted_loop(loop: WhileNode, impure_funcs: Set[str]) -> CountedLoop:
+    """Распознавание цикла со счетчиком (NotCountedLoop с причиной, если цикл не подходит)
+    """
+
+    cond = loop.cond
+    if not isinstance(cond, BinOpNode) or cond.op not in COMPARE_OPS:
+        raise NotCountedLoop('условие не является сравнением')
+    if not isinstance(cond.arg1, IdentNode) or cond.arg1.node_type != TypeDesc.INT:
+        raise NotCountedLoop('слева в условии не Int-переменная')
+    ident = cond.arg1.node_ident
+    bound = cond.arg2
+    if not (isinstance(bound, LiteralNode) or isinstance(bound, IdentNode)) or bound.node_type != TypeDesc.INT or \
+            (isinstance(bound, IdentNode) and bound.node_ident is ident):
+        raise NotCountedLoop('граница не является Int-литералом или переменной')
+    if not isinstance(loop.body, StmtListNode):
+        raise NotCountedLoop('тело цикла не является блоком')
+    if _find(loop.body, (VarNode, VarsNode, ForNode)):
+        raise NotCountedLoop('в теле цикла объявляются переменные')
+
+    assigns = [n for n in _find(loop.body, AssignNode) if n.var.node_ident is ident]
+    if len(assigns) != 1 or assigns[0] not in loop.body.exprs:
+        raise NotCountedLoop('счетчик изменяется не одним присваиванием')
+    val = assigns[0].val
+    if not (isinstance(val, BinOpNode) and val.op in (BinOp.ADD, BinOp.SUB) and
+            isinstance(val.arg1, IdentNode) and val.arg1.node_ident is ident and
+            isinstance(val.arg2, LiteralNode) and val.arg2.node_type == TypeDesc.INT):
+        raise NotCountedLoop('шаг счетчика не является константой')
+    step = val.arg2.value if val.op == BinOp.ADD else -val.arg2.value
+    if step == 0 or (step > 0) != (cond.op in (BinOp.LT, BinOp.LE)):
+        raise NotCountedLoop('направление шага не соответствует условию')
+    if isinstance(bound, IdentNode) and any(n.var.node_ident is bound.node_ident for n in _find(loop.body, AssignNode)):
+        raise NotCountedLoop('граница изменяется в теле цикла')
+    if _is_global(ident) or (isinstance(bound, IdentNode) and _is_global(bound.node_ident)):
+        # не чистые функции могут изменить глобальные переменные
+        for call in _find(loop.body, CallNode):
+            if call.func.name in impure_funcs and not call.func.node_ident.built_in:
+                raise NotCountedLoop('в теле цикла вызывается функция {}'.format(call.func.name))
+    return CountedLoop(loop, ident, cond.op, bound, step)
+
+
+class RangeLoop:
+    """Описание цикла for по диапазону с литеральными границами и шагом: for (i in first..last step step)
+    """
+
+    def __init__(self, loop: ForNode, ident: IdentDesc, first: int, last: int, step: int, down: bool) -> None:
+        self.loop = loop
+        self.ident = ident
+        self.first = first
+        self.last = last
+        self.step = step
+        self.down = down
+
+    @property
+    def trips(self) -> int:
+        return abs(self.last - self.first) // self.step + 1
+
+    def value(self, n: int) -> int:
+        """Значение переменной цикла на итерации n
+        """
+
+        return self.first - n * self.step if self.down else self.first + n * self.step
+
+    @property
+    def stmts(self) -> Tuple[StmtNode, ...]:
+        body = self.loop.body
+        return body.exprs if isinstance(body, StmtListNode) else (body, )
+
+
+def match_range_loop(loop: ForNode) -> Optional[RangeLoop]:
+    """Распознавание цикла for по диапазону с литеральными границами (NotCountedLoop с причиной,
+       если цикл не подходит; None, если диапазон пуст)
+    """
+
+    seq: SeqNode = loop.range
+    step = seq.stepArg if seq.stepArg is not None else _int_literal(1)
+    if not all(isinstance(n, LiteralNode) for n in (seq.startArg, seq.endArg, step)):
+        raise NotCountedLoop('границы или шаг диапазона не являются литералами')
+    # переменная цикла не изменяется в теле (объявлена как val), но объявления в теле дублировались бы при копировании
+    if _find(loop.body, (VarNode, VarsNode, ForNode)):
+        raise NotCountedLoop('в теле цикла объявляются переменные')
+    bounds = get_progression_bounds(seq.startArg.value, seq.endArg.value, step.value, seq.seqOp)
+    if bounds is None:
+        return None
+    return RangeLoop(loop, loop.ident.node_ident, bounds[0], bounds[1], step.value, seq.seqOp == BinOp.DOWNTO)
+
+
+def _substitute(stmts: Tuple[StmtNode, ...], ident: IdentDesc, make_value) -> List[StmtNode]:
+    """Копии операторов, в которых обращения к переменной ident заменены на make_value()
+    """
+
+    def replace(node: AstNode) -> AstNode:
+        return make_value() if isinstance(node, IdentNode) and node.node_ident is ident else node
+
+    block = StmtListNode(*(stmt.clone() for stmt in stmts))
+    block.transform(replace)
+    return list(block.exprs)
+
+
+def _initial_value(prev: Optional[AstNode], ident: IdentDesc) -> Optional[int]:
+    if isinstance(prev, VarNode) and prev.ident.node_ident is ident:
+        val = prev.var
+    elif isinstance(prev, AssignNode) and prev.var.node_ident is ident:
+        val = prev.val
+    else:
+        return None
+    return val.value if isinstance(val, LiteralNode) and val.node_type == TypeDesc.INT else None
+
+
+class Unroller:
+    """Развертывание циклов со счетчиком и циклов по диапазонам (после семантического анализа)
+    """
+
+    def __init__(self, prog: StmtListNode, factor: int = DEFAULT_FACTOR, budget: int = DEFAULT_BUDGET) -> None:
+        self.prog = prog
+        self.factor = factor
+        self.budget = budget
+        self.impure_funcs = {name for name, info in purity.analyze(prog).items() if not info.pure}
+        self.report: List[str] = []
+
+    def unroll_full(self, counted: CountedLoop, trips: int) -> AstNode:
+        exprs = []
+        for _ in range(trips):
+            exprs.extend(stmt.clone() for stmt in counted.loop.body.exprs)
+        result = StmtListNode(*exprs, row=counted.loop.row, col=counted.loop.col)
+        result.node_type = TypeDesc.VOID
+        return result
+
+    def unroll_partial(self, counted: CountedLoop) -> Optional[AstNode]:
+        loop = counted.loop
+        # в основном цикле за одну проверку условия должно гарантированно выполняться factor итераций:
+        # i + (factor - 1) * step op bound  <=>  i op bound - (factor - 1) * step
+        delta = (self.factor - 1) * counted.step
+        if isinstance(counted.bound, LiteralNode):
+            value = counted.bound.value - delta
+            if not INT_MIN <= value <= INT_MAX:
+                return None
+            cond = _bin_op(counted.op, _ident(counted.ident), _int_literal(value), TypeDesc.BOOL)
+        else:
+            bound = counted.bound.node_ident
+
+            def new_bound():
+                return _bin_op(BinOp.SUB, _ident(bound), _int_literal(delta), TypeDesc.INT)
+
+            # при переполнении bound - delta основной цикл пропускается, все итерации выполнит остаточный цикл
+            no_overflow = _bin_op(BinOp.LT if delta > 0 else BinOp.GT, new_bound(), _ident(bound), TypeDesc.BOOL)
+            cond = _bin_op(BinOp.LOGICAL_AND, no_overflow,
+                           _bin_op(counted.op, _ident(counted.ident), new_bound(), TypeDesc.BOOL), TypeDesc.BOOL)
+        exprs = []
+        for _ in range(self.factor):
+            exprs.extend(stmt.clone() for stmt in loop.body.exprs)
+        body = StmtListNode(*exprs, row=loop.body.row, col=loop.body.col)
+        body.node_type = TypeDesc.VOID
+        main = WhileNode(cond, body, row=loop.row, col=loop.col)
+        main.node_type = TypeDesc.VOID
+        # остаточный цикл - исходный
+        result = StmtListNode(main, loop, row=loop.row, col=loop.col)
+        result.node_type = TypeDesc.VOID
+        return result
+
+    def unroll(self, loop: WhileNode, prev: Optional[AstNode]) -> AstNode:
+        try:
+            counted = match_counted_loop(loop, self.impure_funcs)
+        except NotCountedLoop as e:
+            self.report.append('строка {}: цикл не развернут ({})'.format(loop.row, e.message))
+            return loop
+        body_size = _size(loop.body)
+
+        start = _initial_value(prev, counted.ident)
+        trips = counted.trip_count(start, FULL_UNROLL_MAX_TRIPS) if start is not None else None
+        if trips is not None and (trips - 1) * body_size <= self.budget:
+            self.budget -= max(trips - 1, 0) * body_size
+            self.report.append('строка {}: цикл по {} развернут полностью ({} итераций)'.format(
+                loop.row, counted.ident.name, trips))
+            return self.unroll_full(counted, trips)
+
+        if self.factor > 1 and (self.factor - 1) * body_size <= self.budget:
+            result = self.unroll_partial(counted)
+            if result is not None:
+                self.budget -= (self.factor - 1) * body_size
+                self.report.append('строка {}: цикл по {} развернут в {} раза с остаточным циклом'.format(
+                    loop.row, counted.ident.name, self.factor))
+                return result
+        self.report.append('строка {}: цикл по {} не развернут (превышен бюджет размера кода)'.format(
+            loop.row, counted.ident.name))
+        return loop
+
+    def unroll_range_full(self, range_loop: RangeLoop, trips: int) -> AstNode:
+        exprs = []
+        for n in range(trips):
+            value = range_loop.value(n)
+            exprs.extend(_substitute(range_loop.stmts, range_loop.ident, lambda: _int_literal(value)))
+        loop = range_loop.loop
+        result = StmtListNode(*exprs, row=loop.row, col=loop.col)
+        result.node_type = TypeDesc.VOID
+        return result
+
+    def unroll_range_partial(self, range_loop: RangeLoop) -> AstNode:
+        # основной цикл - по каждому factor-ому значению диапазона, в теле - factor копий с i, i + step, ...;
+        # оставшиеся (меньше factor) итерации разворачиваются полностью после него
+        loop = range_loop.loop
+        ident = range_loop.ident
+        main_trips = range_loop.trips // self.factor
+        exprs = []
+        for k in range(self.factor):
+            delta = k * range_loop.step
+            if delta == 0:
+                exprs.extend(stmt.clone() for stmt in range_loop.stmts)
+            else:
+                exprs.extend(_substitute(range_loop.stmts, ident, lambda: _bin_op(
+                    BinOp.SUB if range_loop.down else BinOp.ADD, _ident(ident), _int_literal(delta), TypeDesc.INT)))
+        body = StmtListNode(*exprs, row=loop.body.row, col=loop.body.col)
+        body.node_type = TypeDesc.VOID
+        seq = SeqNode(_int_literal(range_loop.first), BinOp.DOWNTO if range_loop.down else BinOp.DOTS,
+                      _int_literal(range_loop.value((main_trips - 1) * self.factor)),
+                      _int_literal(self.factor * range_loop.step), row=loop.range.row, col=loop.range.col)
+        main = ForNode(loop.ident, seq, body, row=loop.row, col=loop.col)
+        main.node_type = TypeDesc.VOID
+        rest = []
+        for n in range(main_trips * self.factor, range_loop.trips):
+            value = range_loop.value(n)
+            rest.extend(_substitute(range_loop.stmts, ident, lambda: _int_literal(value)))
+        result = StmtListNode(main, *rest, row=loop.row, col=loop.col)
+        result.node_type = TypeDesc.VOID
+        return result
+
+    def unroll_range(self, loop: ForNode) -> AstNode:
+        try:
+            range_loop = match_range_loop(loop)
+        except NotCountedLoop as e:
+            self.report.append('строка {}: цикл не развернут ({})'.format(loop.row, e.message))
+            return loop
+        if range_loop is None:
+            self.report.append('строка {}: цикл не развернут (пустой диапазон)'.format(loop.row))
+            return loop
+        body_size = sum(_size(stmt) for stmt in range_loop.stmts)
+        trips = range_loop.trips
+        if trips <= FULL_UNROLL_MAX_TRIPS and (trips - 1) * body_size <= self.budget:
+            self.budget -= (trips - 1) * body_size
+            self.report.append('строка {}: цикл по {} развернут полностью ({} итераций)'.format(
+                loop.row, range_loop.ident.name, trips))
+            return self.unroll_range_full(range_loop, trips)
+
+        # копии тела в основном цикле и остаточные итерации (меньше factor)
+        extra = (self.factor - 1 + trips % self.factor) * body_size
+        if self.factor > 1 and trips >= self.factor and extra <= self.budget:
+            self.budget -= extra
+            self.report.append('строка {}: цикл по {} развернут в {} раза с {} остаточными итерациями'.format(
+                loop.row, range_loop.ident.name, self.factor, trips % self.factor))
+            return self.unroll_range_partial(range_loop)
+        self.report.append('строка {}: цикл по {} не развернут (превышен бюджет размера кода)'.format(
+            loop.row, range_loop.ident.name))
+        return loop
+
+    def process(self, node: AstNode) -> AstNode:
+        if isinstance(node, StmtListNode):
+            exprs = []
+            for i, stmt in enumerate(node.exprs):
+                if isinstance(stmt, WhileNode):
+                    stmt = self.unroll(stmt, node.exprs[i - 1] if i > 0 else None)
+                elif isinstance(stmt, ForNode) and isinstance(stmt.range, SeqNode):
+                    stmt = self.unroll_range(stmt)
+                exprs.append(stmt)
+            node.exprs = tuple(exprs)
+        return node
+
+    def run(self) -> List[str]:
+        self.prog.transform(self.process)
+        self.process(self.prog)
+        return self.report
+
+
+def unroll_loops(prog: StmtListNode, factor: int = DEFAULT_FACTOR, budget: int = DEFAULT_BUDGET) -> List[str]:
+    """Развертывание циклов while со счетчиком и циклов for по диапазонам с литеральными границами:
+       полное для циклов с малым известным кол-вом итераций, частичное (в factor раз с остаточным циклом
+       или остаточными итерациями) для циклов с известным шагом счетчика
+    :param prog: программа (корень AST-дерева)
+    :param factor: коэффициент частичного развертывания
+    :param budget: ограничение кол-ва добавляемых узлов AST-дерева
+    :return: отчет о развертывании циклов
+    """
+
+    return Unroller(prog, factor, budget).run()
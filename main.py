@@ -1,18 +1,60 @@
 import argparse
 
-from compiler import program
+from compiler import program, unroll, split
 
 
 def main() -> None:
     parser = argparse.ArgumentParser(description='Compiler demo program (msil)')
     parser.add_argument('src', type=str, help='source code file')
     parser.add_argument('--msil-only', default=False, action='store_true', help='print only msil code (no ast)')
+    parser.add_argument('--jbc-only', default=False, action='store_true',
+                        help='print only jvm bytecode listing (no ast)')
+    parser.add_argument('--memoize', default=False, action='store_true',
+                        help='memoize pure recursive functions (report to stderr)')
+    parser.add_argument('--const-eval', default=False, action='store_true',
+                        help='evaluate calls of pure functions with constant arguments at compile time')
+    parser.add_argument('--unroll', type=int, default=0, metavar='FACTOR',
+                        help='unroll counted loops (small constant loops fully, others FACTOR times)')
+    parser.add_argument('--unroll-budget', type=int, default=unroll.DEFAULT_BUDGET, metavar='NODES',
+                        help='max number of AST nodes added by loop unrolling')
+    parser.add_argument('--no-peephole', default=False, action='store_true',
+                        help='disable peephole optimization of msil code')
+    parser.add_argument('--peephole-stats', default=False, action='store_true',
+                        help='print peephole rules statistics (to stderr)')
+    parser.add_argument('--no-promote-globals', default=False, action='store_true',
+                        help='keep all global variables in static fields')
+    parser.add_argument('--no-reuse-locals', default=False, action='store_true',
+                        help='one local variable slot per declared variable (no liveness-based slot sharing)')
+    parser.add_argument('--no-string-builders', default=False, action='store_true',
+                        help='do not replace strings appended to in loops with StringBuilder')
+    parser.add_argument('--main-part-size', type=int, default=split.DEFAULT_PART_SIZE, metavar='BYTES',
+                        help='split top-level code into Main_partN methods of about BYTES of IL (0 - no splitting)')
+    parser.add_argument('--no-buffered-output', default=False, action='store_true',
+                        help='flush program output after each write (for interactive programs)')
+    parser.add_argument('--exe', type=str, default=None, metavar='FILE',
+                        help='write executable FILE directly (without ilasm, msil code is not printed)')
+    parser.add_argument('--runtime', type=str, default=program.DEFAULT_RUNTIME, metavar='FILE',
+                        help='runtime msil code (assembled once into a cached netmodule)')
+    parser.add_argument('--runtime-dir', type=str, default=None, metavar='DIR',
+                        help='reference runtime netmodule cached in DIR instead of linking runtime code '
+                             '(for --msil-only, --exe uses the directory of executable)')
+    parser.add_argument('--jar', type=str, default=None, metavar='FILE',
+                        help='write jar FILE with jvm class files directly (without assembler and jar tool)')
+    parser.add_argument('--java-runtime', type=str, default=program.DEFAULT_JAVA_RUNTIME, metavar='DIR',
+                        help='directory with compiled CompilerDemo/*.class (for --jar, built by runtime-java/build)')
     args = parser.parse_args()
 
     with open(args.src, mode='r', encoding="utf-8") as f:
         src = f.read()
 
-    program.execute(src, args.msil_only, file_name=args.src)
+    program.execute(src, args.msil_only, args.jbc_only, file_name=args.src, memoize=args.memoize,
+                    const_eval=args.const_eval, unroll=args.unroll, unroll_budget=args.unroll_budget,
+                    peephole=not args.no_peephole, peephole_stats=args.peephole_stats,
+                    promote_globals=not args.no_promote_globals, reuse_locals=not args.no_reuse_locals,
+                    string_builders=not args.no_string_builders, main_part_size=args.main_part_size,
+                    buffered_output=not args.no_buffered_output,
+                    exe=args.exe, runtime=args.runtime, runtime_dir=args.runtime_dir,
+                    jar=args.jar, java_runtime=args.java_runtime)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,68 @@
+package CompilerDemo;
+
+import java.util.ArrayList;
+import java.util.List;
+import java.util.concurrent.ExecutionException;
+import java.util.concurrent.ExecutorService;
+import java.util.concurrent.ForkJoinPool;
+import java.util.concurrent.Future;
+
+
+// тело параллельного цикла (от класса наследуется класс, который генерирует компилятор):
+// диапазон делится на части, метод run выполняет одну часть, части выполняются в разных потоках
+public abstract class ParallelBody {
+  private static final ExecutorService executor = ForkJoinPool.commonPool();
+
+  private int first;
+  private long length;
+  private int count;
+
+  protected abstract void run(int part, int first, int last);
+
+  // разбиение диапазона first..end (first until end для exclusive), возвращает кол-во частей
+  public int split(int first, int end, boolean exclusive) {
+    this.first = first;
+    // длина диапазона Integer.MIN_VALUE..Integer.MAX_VALUE не помещается в int
+    length = Math.max(0L, (long) end - first + (exclusive ? 0 : 1));
+    count = (int) Math.min(length, (long) java.lang.Runtime.getRuntime().availableProcessors() * 4);
+    return count;
+  }
+
+  private int start(int part) {
+    return (int) (first + length * part / count);
+  }
+
+  private void runPart(int part) {
+    run(part, start(part), start(part + 1) - 1);
+  }
+
+  public void execute() {
+    if (count == 0) {
+      return;
+    }
+    List<Future<?>> futures = new ArrayList<>(count - 1);
+    for (int part = 0; part < count - 1; part++) {
+      final int p = part;
+      futures.add(executor.submit(() -> runPart(p)));
+    }
+    // последняя часть выполняется в текущем потоке
+    runPart(count - 1);
+    for (Future<?> future : futures) {
+      try {
+        future.get();
+      } catch (InterruptedException e) {
+        Thread.currentThread().interrupt();
+        throw new RuntimeException(e);
+      } catch (ExecutionException e) {
+        Throwable cause = e.getCause();
+        if (cause instanceof RuntimeException) {
+          throw (RuntimeException) cause;
+        }
+        if (cause instanceof Error) {
+          throw (Error) cause;
+        }
+        throw new RuntimeException(cause);
+      }
+    }
+  }
+}
@@ -1,17 +1,181 @@
 package CompilerDemo;
 
-import java.util.Scanner;
+import java.io.BufferedOutputStream;
+import java.io.FileDescriptor;
+import java.io.FileInputStream;
+import java.io.FileOutputStream;
+import java.io.IOException;
+import java.io.InputStream;
+import java.io.PrintStream;
+import java.io.UncheckedIOException;
+import java.nio.charset.StandardCharsets;
+import java.util.Arrays;
 import java.util.Locale;
+import java.util.NoSuchElementException;
 
 
 public class Runtime {
+  // буфер для вывода целых чисел без создания строк (Long.MIN_VALUE - 20 символов)
+  private static final byte[] digits = new byte[20];
+  // буферизованный ввод: байты stdin читаются блоками, числа разбираются прямо из буфера без создания строк
+  private static final InputStream input = new FileInputStream(FileDescriptor.in);
+  private static final byte[] inputBuffer = new byte[1 << 16];
+  private static int inputPos;
+  private static int inputLength;
+  // байты текущего слова или строки ввода
+  private static byte[] token = new byte[64];
+  private static int tokenLength;
+  // точные степени 10 для разбора вещественных чисел с короткой мантиссой
+  private static final double[] powersOf10 = new double[16];
+
   static {
     Locale.setDefault(Locale.ROOT);
+    // буферизованный вывод (стандартный System.out сбрасывается после каждой строки): сбрасывается в конце main,
+    // перед чтением ввода и при завершении JVM, в т.ч. из-за исключения (PrintStream синхронизирован)
+    System.setOut(new PrintStream(new BufferedOutputStream(new FileOutputStream(FileDescriptor.out), 1 << 16), false));
+    java.lang.Runtime.getRuntime().addShutdownHook(new Thread(Runtime::flush));
+    powersOf10[0] = 1;
+    for (int i = 1; i < powersOf10.length; i++) {
+      powersOf10[i] = powersOf10[i - 1] * 10;
+    }
+  }
+
+  public static void flush() {
+    System.out.flush();
+  }
+
+  // вывод без буферизации (для интерактивных программ, вызывается в начале main)
+  public static void unbuffered() {
+    System.out.flush();
+    System.setOut(new PrintStream(new FileOutputStream(FileDescriptor.out), true));
+  }
+
+  // следующий байт ввода без извлечения (-1 - конец ввода)
+  private static int peekByte() {
+    if (inputPos == inputLength) {
+      // приглашение к вводу должно быть выведено до ожидания ввода
+      flush();
+      inputPos = 0;
+      try {
+        inputLength = input.read(inputBuffer, 0, inputBuffer.length);
+      } catch (IOException e) {
+        throw new UncheckedIOException(e);
+      }
+      if (inputLength <= 0) {
+        inputLength = 0;
+        return -1;
+      }
+    }
+    return inputBuffer[inputPos] & 0xff;
+  }
+
+  private static void appendToken(int b) {
+    if (tokenLength == token.length) {
+      token = Arrays.copyOf(token, token.length * 2);
+    }
+    token[tokenLength++] = (byte) b;
+  }
+
+  // чтение в token слова (до пробельного символа или конца ввода) после пропуска пробельных символов
+  private static void readToken() {
+    int b = peekByte();
+    while (b != -1 && b <= ' ') {
+      inputPos++;
+      b = peekByte();
+    }
+    tokenLength = 0;
+    while (b > ' ') {
+      appendToken(b);
+      inputPos++;
+      b = peekByte();
+    }
+  }
+
+  // позиция после знака числа в token
+  private static int skipSign() {
+    return tokenLength > 0 && (token[0] == '-' || token[0] == '+') ? 1 : 0;
+  }
+
+  public static synchronized String readLine() {
+    int b = peekByte();
+    if (b == -1) {
+      throw new NoSuchElementException("No line found");
+    }
+    tokenLength = 0;
+    while (b != -1 && b != '\n') {
+      appendToken(b);
+      inputPos++;
+      b = peekByte();
+    }
+    if (b != -1) {
+      inputPos++;
+    }
+    if (tokenLength > 0 && token[tokenLength - 1] == '\r') {
+      tokenLength--;
+    }
+    return new String(token, 0, tokenLength);
+  }
+
+  public static synchronized String readWord() {
+    readToken();
+    return new String(token, 0, tokenLength);
+  }
+
+  public static synchronized int readInt() {
+    readToken();
+    int pos = skipSign();
+    if (pos == tokenLength) {
+      throw new NumberFormatException("Integer expected.");
+    }
+    // накапливается отрицательное значение, чтобы не переполнить Integer.MIN_VALUE
+    int result = 0;
+    for (; pos < tokenLength; pos++) {
+      int digit = token[pos] - '0';
+      if (digit < 0 || digit > 9) {
+        throw new NumberFormatException("Integer expected.");
+      }
+      // result * 10 - digit не должно выйти за Integer.MIN_VALUE
+      if (result < (Integer.MIN_VALUE + digit) / 10) {
+        throw new NumberFormatException("Integer out of range.");
+      }
+      result = result * 10 - digit;
+    }
+    if (token[0] == '-') {
+      return result;
+    }
+    if (result == Integer.MIN_VALUE) {
+      throw new NumberFormatException("Integer out of range.");
+    }
+    return -result;
   }
 
-  public static String read() {
-    Scanner scanner = new Scanner(System.in);
-    return scanner.nextLine();
+  public static synchronized double readDouble() {
+    readToken();
+    int pos = skipSign();
+    // до 15 цифр мантисса и степень 10 представимы точно, поэтому результат деления округлен верно
+    long mantissa = 0;
+    int digitCount = 0;
+    int scale = -1;
+    for (; pos < tokenLength; pos++) {
+      int b = token[pos];
+      if (b == '.' && scale < 0) {
+        scale = 0;
+      } else if (b >= '0' && b <= '9' && digitCount < 15) {
+        mantissa = mantissa * 10 + (b - '0');
+        digitCount++;
+        if (scale >= 0) {
+          scale++;
+        }
+      } else {
+        break;
+      }
+    }
+    if (pos < tokenLength || digitCount == 0) {
+      // экспонента, длинная мантисса, NaN и т.п.
+      return Double.parseDouble(new String(token, 0, tokenLength, StandardCharsets.US_ASCII));
+    }
+    double value = scale > 0 ? mantissa / powersOf10[scale] : mantissa;
+    return token[0] == '-' ? -value : value;
   }
 
   public static void print(String p0) {
@@ -22,6 +186,58 @@ public class Runtime {
     System.out.println(p0);
   }
 
+  // буфер digits общий для всех потоков
+  private static synchronized void write(long v) {
+    int pos = digits.length;
+    // цифры получаются из неположительного значения, чтобы не переполнить Long.MIN_VALUE
+    long n = v < 0 ? v : -v;
+    do {
+      digits[--pos] = (byte) ('0' - n % 10);
+      n /= 10;
+    } while (n != 0);
+    if (v < 0) {
+      digits[--pos] = '-';
+    }
+    System.out.write(digits, pos, digits.length - pos);
+  }
+
+  private static void write(double v) {
+    // целые значения, которые Java выводит без экспоненты, выводятся как целые числа с ".0",
+    // остальные (в т.ч. -0.0) - через стандартное преобразование в строку
+    if (v == Math.floor(v) && Math.abs(v) < 1e7 && (v != 0 || Double.doubleToRawLongBits(v) == 0)) {
+      write((long) v);
+      System.out.print(".0");
+    } else {
+      System.out.print(v);
+    }
+  }
+
+  public static void print(int p0) {
+    write(p0);
+  }
+
+  public static void println(int p0) {
+    write(p0);
+    System.out.println();
+  }
+
+  public static void print(double p0) {
+    write(p0);
+  }
+
+  public static void println(double p0) {
+    write(p0);
+    System.out.println();
+  }
+
+  public static void print(boolean p0) {
+    System.out.print(p0);
+  }
+
+  public static void println(boolean p0) {
+    System.out.println(p0);
+  }
+
   public static int to_int(String p0) {
     return Integer.parseInt(p0);
   }
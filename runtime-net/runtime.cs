@@ -1,17 +1,198 @@
 using System;
 using System.Globalization;
+using System.IO;
+using System.Runtime.CompilerServices;
+using System.Text;
 using System.Threading;
+using System.Threading.Tasks;
 
 
 namespace CompilerDemo {
 
   class Runtime {
+    // буфер для вывода целых чисел без создания строк (long.MinValue - 20 символов)
+    static char[] digits = new char[20];
+    // буферизованный вывод (стандартный Console.Out сбрасывается после каждой записи): сбрасывается в конце Main,
+    // перед чтением ввода и при завершении процесса, в т.ч. из-за исключения
+    static StreamWriter output;
+    // буферизованный ввод: байты stdin читаются блоками, числа разбираются прямо из буфера без создания строк
+    static Stream input;
+    static byte[] inputBuffer = new byte[1 << 16];
+    static int inputPos;
+    static int inputLength;
+    // байты текущего слова или строки ввода
+    static byte[] token = new byte[64];
+    static int tokenLength;
+    // точные степени 10 для разбора вещественных чисел с короткой мантиссой
+    static double[] powersOf10 = new double[16];
+
     static Runtime() {
       Thread.CurrentThread.CurrentCulture = CultureInfo.InvariantCulture;
+      // и для потоков, в которых выполняются тела параллельных циклов
+      CultureInfo.DefaultThreadCurrentCulture = CultureInfo.InvariantCulture;
+      Encoding encoding = Console.OutputEncoding;
+      // без BOM в начале вывода
+      if (encoding.CodePage == 65001) {
+        encoding = new UTF8Encoding(false);
+      }
+      output = new StreamWriter(Console.OpenStandardOutput(), encoding, 1 << 16);
+      // Console.SetOut оборачивает writer в синхронизированный (вывод из тел параллельных циклов)
+      Console.SetOut(output);
+      AppDomain.CurrentDomain.ProcessExit += flushOnExit;
+      AppDomain.CurrentDomain.UnhandledException += flushOnException;
+      input = Console.OpenStandardInput();
+      powersOf10[0] = 1;
+      for (int i = 1; i < powersOf10.Length; i++) {
+        powersOf10[i] = powersOf10[i - 1] * 10;
+      }
+    }
+
+    static void flushOnExit(object sender, EventArgs e) {
+      flush();
+    }
+
+    static void flushOnException(object sender, UnhandledExceptionEventArgs e) {
+      flush();
+    }
+
+    public static void flush() {
+      Console.Out.Flush();
+    }
+
+    // вывод без буферизации (для интерактивных программ, вызывается в начале Main)
+    public static void unbuffered() {
+      output.AutoFlush = true;
+    }
+
+    // следующий байт ввода без извлечения (-1 - конец ввода)
+    static int peekByte() {
+      if (inputPos == inputLength) {
+        // приглашение к вводу должно быть выведено до ожидания ввода
+        flush();
+        inputPos = 0;
+        inputLength = input.Read(inputBuffer, 0, inputBuffer.Length);
+        if (inputLength <= 0) {
+          inputLength = 0;
+          return -1;
+        }
+      }
+      return inputBuffer[inputPos];
+    }
+
+    static void appendToken(int b) {
+      if (tokenLength == token.Length) {
+        byte[] larger = new byte[token.Length * 2];
+        Array.Copy(token, larger, tokenLength);
+        token = larger;
+      }
+      token[tokenLength++] = (byte) b;
     }
 
-    public static string read() {
-      return Console.ReadLine();
+    // чтение в token слова (до пробельного символа или конца ввода) после пропуска пробельных символов
+    static void readToken() {
+      int b = peekByte();
+      while (b != -1 && b <= ' ') {
+        inputPos++;
+        b = peekByte();
+      }
+      tokenLength = 0;
+      while (b > ' ') {
+        appendToken(b);
+        inputPos++;
+        b = peekByte();
+      }
+    }
+
+    // позиция после знака числа в token
+    static int skipSign() {
+      return tokenLength > 0 && (token[0] == '-' || token[0] == '+') ? 1 : 0;
+    }
+
+    [MethodImpl(MethodImplOptions.Synchronized)]
+    public static string readLine() {
+      int b = peekByte();
+      if (b == -1) {
+        return null;
+      }
+      tokenLength = 0;
+      while (b != -1 && b != '\n') {
+        appendToken(b);
+        inputPos++;
+        b = peekByte();
+      }
+      if (b != -1) {
+        inputPos++;
+      }
+      if (tokenLength > 0 && token[tokenLength - 1] == '\r') {
+        tokenLength--;
+      }
+      return Console.InputEncoding.GetString(token, 0, tokenLength);
+    }
+
+    [MethodImpl(MethodImplOptions.Synchronized)]
+    public static string readWord() {
+      readToken();
+      return Console.InputEncoding.GetString(token, 0, tokenLength);
+    }
+
+    [MethodImpl(MethodImplOptions.Synchronized)]
+    public static int readInt() {
+      readToken();
+      int pos = skipSign();
+      if (pos == tokenLength) {
+        throw new FormatException("Integer expected.");
+      }
+      // накапливается отрицательное значение, чтобы не переполнить int.MinValue
+      int result = 0;
+      for (; pos < tokenLength; pos++) {
+        int digit = token[pos] - '0';
+        if (digit < 0 || digit > 9) {
+          throw new FormatException("Integer expected.");
+        }
+        // result * 10 - digit не должно выйти за int.MinValue
+        if (result < (int.MinValue + digit) / 10) {
+          throw new FormatException("Integer out of range.");
+        }
+        result = result * 10 - digit;
+      }
+      if (token[0] == '-') {
+        return result;
+      }
+      if (result == int.MinValue) {
+        throw new FormatException("Integer out of range.");
+      }
+      return -result;
+    }
+
+    [MethodImpl(MethodImplOptions.Synchronized)]
+    public static double readDouble() {
+      readToken();
+      int pos = skipSign();
+      // до 15 цифр мантисса и степень 10 представимы точно, поэтому результат деления округлен верно
+      long mantissa = 0;
+      int digitCount = 0;
+      int scale = -1;
+      for (; pos < tokenLength; pos++) {
+        int b = token[pos];
+        if (b == '.' && scale < 0) {
+          scale = 0;
+        } else if (b >= '0' && b <= '9' && digitCount < 15) {
+          mantissa = mantissa * 10 + (b - '0');
+          digitCount++;
+          if (scale >= 0) {
+            scale++;
+          }
+        } else {
+          break;
+        }
+      }
+      if (pos < tokenLength || digitCount == 0) {
+        // экспонента, длинная мантисса, NaN и т.п.
+        return double.Parse(Encoding.ASCII.GetString(token, 0, tokenLength), NumberStyles.Float,
+                            CultureInfo.InvariantCulture);
+      }
+      double value = scale > 0 ? mantissa / powersOf10[scale] : mantissa;
+      return token[0] == '-' ? -value : value;
     }
 
     public static void print(string p0) {
@@ -22,6 +203,58 @@ namespace CompilerDemo {
       Console.WriteLine(p0);
     }
 
+    // буфер digits общий для всех потоков
+    [MethodImpl(MethodImplOptions.Synchronized)]
+    static void write(long v) {
+      int pos = digits.Length;
+      // цифры получаются из неположительного значения, чтобы не переполнить long.MinValue
+      long n = v < 0 ? v : -v;
+      do {
+        digits[--pos] = (char) ('0' - n % 10);
+        n /= 10;
+      } while (n != 0);
+      if (v < 0) {
+        digits[--pos] = '-';
+      }
+      Console.Out.Write(digits, pos, digits.Length - pos);
+    }
+
+    static void write(double v) {
+      // целые значения, которые Convert.ToString выводит без экспоненты, выводятся как целые числа,
+      // остальные - через Convert.ToString (так же, как при преобразовании в строку)
+      if (v == Math.Floor(v) && Math.Abs(v) < 1e15) {
+        write((long) v);
+      } else {
+        Console.Out.Write(Convert.ToString(v));
+      }
+    }
+
+    public static void print(int p0) {
+      write(p0);
+    }
+
+    public static void println(int p0) {
+      write(p0);
+      Console.Out.WriteLine();
+    }
+
+    public static void print(double p0) {
+      write(p0);
+    }
+
+    public static void println(double p0) {
+      write(p0);
+      Console.Out.WriteLine();
+    }
+
+    public static void print(bool p0) {
+      Console.Write(p0);
+    }
+
+    public static void println(bool p0) {
+      Console.WriteLine(p0);
+    }
+
     public static int to_int(string p0) {
       return Convert.ToInt32(p0);
     }
@@ -50,4 +283,35 @@ namespace CompilerDemo {
       return a.CompareTo(b);
     }
   }
+
+  // тело параллельного цикла (от класса наследуется класс, который генерирует компилятор):
+  // диапазон делится на части, метод run выполняет одну часть, части выполняются в разных потоках
+  abstract class ParallelBody {
+    int first;
+    long length;
+    int count;
+
+    protected abstract void run(int part, int first, int last);
+
+    // разбиение диапазона first..end (first until end для exclusive), возвращает кол-во частей
+    public int split(int first, int end, bool exclusive) {
+      this.first = first;
+      // длина диапазона int.MinValue..int.MaxValue не помещается в int
+      length = Math.Max(0L, (long) end - first + (exclusive ? 0 : 1));
+      count = (int) Math.Min(length, (long) Environment.ProcessorCount * 4);
+      return count;
+    }
+
+    int start(int part) {
+      return (int) (first + length * part / count);
+    }
+
+    void runPart(int part) {
+      run(part, start(part), start(part + 1) - 1);
+    }
+
+    public void execute() {
+      Parallel.For(0, count, runPart);
+    }
+  }
 }